@@ -1,18 +1,30 @@
 from flask import Blueprint
 
 from api.auth.routes import auth_blueprint
+from api.balance.routes import balance_blueprint
 from api.category.routes import category_blueprint
+from api.changes.routes import changes_blueprint
 from api.charts.routes import charts_blueprint
 from api.datatables.routes import datatables_blueprint
+from api.events.routes import events_blueprint
 from api.expense.routes import expense_blueprint
+from api.jobs.routes import jobs_blueprint
+from api.recurring.routes import recurring_blueprint
+from api.reports.routes import reports_blueprint
 from api.user.routes import user_blueprint
 
 
 api_blueprint = Blueprint('api', __name__)
 
 api_blueprint.register_blueprint(auth_blueprint)
+api_blueprint.register_blueprint(balance_blueprint)
 api_blueprint.register_blueprint(category_blueprint)
+api_blueprint.register_blueprint(changes_blueprint)
 api_blueprint.register_blueprint(charts_blueprint)
 api_blueprint.register_blueprint(datatables_blueprint)
+api_blueprint.register_blueprint(events_blueprint)
 api_blueprint.register_blueprint(expense_blueprint)
+api_blueprint.register_blueprint(jobs_blueprint)
+api_blueprint.register_blueprint(recurring_blueprint)
+api_blueprint.register_blueprint(reports_blueprint)
 api_blueprint.register_blueprint(user_blueprint)
@@ -1,25 +1,39 @@
-from flask import Blueprint, current_app
+from flask import Blueprint, current_app, request
 from flask_restful import Resource, reqparse
-from flask_jwt_extended import jwt_required, create_access_token, create_refresh_token, get_jwt_identity
+from flask_jwt_extended import jwt_required, create_access_token, create_refresh_token, get_jwt_identity, get_jwt
 from sqlalchemy.sql import or_
 
 import logging
 
-from app import api
+from app import api, rate_limiter, identity_cache
 from models import db, User
+from commons.passwords import PasswordHasherBusy
 from commons.decorators.reqparser import req_parser
+from commons.decorators.ratelimit import rate_limit
 
 logger = logging.getLogger(__name__)
 
 auth_blueprint = Blueprint('auth', __name__)
 
 
+def _login_username():
+    username = (body.get('username') if isinstance(body := request.get_json(silent=True), dict) else None) or \
+        request.values.get('username')
+
+    return username.strip().lower() if isinstance(username, str) and username.strip() else None
+
+
 class AuthenticationResource(Resource):
 
     post_args_parser = reqparse.RequestParser(bundle_errors=True)
     post_args_parser.add_argument('username', type=str, required=True, help='Username is required')
     post_args_parser.add_argument('password', type=str, required=True, help='Password is required')
 
+    # login attempts are limited before any query or password hashing
+    @rate_limit(rate_limiter, 'login-ip', 'LOGIN_IP_RATE_LIMIT', lambda: request.remote_addr,
+                'Too many login attempts, try again later')
+    @rate_limit(rate_limiter, 'login-account', 'LOGIN_ACCOUNT_RATE_LIMIT', _login_username,
+                'Too many login attempts, try again later')
     @req_parser(post_args_parser)
     def post(self, request_args):
         user = User.query.filter(or_(
@@ -27,13 +41,24 @@ class AuthenticationResource(Resource):
             User.email == request_args.username)) \
             .first()
 
-        if not user or not user.verify_password(request_args.password):
-            return {'error': 'Wrong username or password'}, 401
+        try:
+            if not user or not user.verify_password(request_args.password):
+                return {'error': 'Wrong username or password'}, 401
+
+            # transparently rehash passwords hashed with other method or cost
+            if user.password_needs_rehash:
+                user.password = request_args.password
+
+        except PasswordHasherBusy as password_hasher_busy:
+            logger.warning('Login rejected:', exc_info=password_hasher_busy)
+            return {'error': 'Too many login attempts, try again later'}, 503, {'Retry-After': 1}
 
         # if user account is disabled, login will activate it again
-        elif not user.active:
+        if not user.active:
             user.active = True
-            db.session.commit()
+
+        db.session.commit()
+        identity_cache.invalidate(user.id)
 
         return {
             'access_token': create_access_token(identity=user.id),
@@ -51,6 +76,10 @@ class TokenRefreshResource(Resource):
     def post(self):
         user_id = get_jwt_identity()
 
+        # refresh tokens are used once, they are replaced by the new refresh token
+        if not identity_cache.revoke(get_jwt()):
+            return {'token': 'Token has been revoked'}, 401
+
         return {
             'access_token': create_access_token(identity=user_id),
             'refresh_token': create_refresh_token(identity=user_id),
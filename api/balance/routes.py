@@ -0,0 +1,80 @@
+from flask import Blueprint
+from flask_restful import Resource, marshal, fields
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app import api, exchange_rates
+from models import db, Balance, User
+from commons.settle_up import net_balances, settle_up
+
+
+balance_blueprint = Blueprint('balance', __name__)
+
+BALANCE_FIELDS = {
+    'user_id': fields.Integer,
+    'username': fields.String,
+    'amount': fields.Float
+}
+
+TRANSFER_FIELDS = {
+    'from_user_id': fields.Integer,
+    'from_username': fields.String,
+    'to_user_id': fields.Integer,
+    'to_username': fields.String,
+    'amount': fields.Float
+}
+
+
+class BalancesResource(Resource):
+
+    @jwt_required()
+    def get(self):
+        user_id = get_jwt_identity()
+
+        return marshal(Balance.get_user_balances(user_id), BALANCE_FIELDS)
+
+
+api.add_resource(BalancesResource, '/balances/')
+
+
+class BalancesRecomputeResource(Resource):
+
+    # the ledger of the user is rebuilt from the shared expenses
+    @jwt_required()
+    def post(self):
+        user_id = get_jwt_identity()
+
+        Balance.recompute_user_balances(user_id)
+        db.session.commit()
+
+        return marshal(Balance.get_user_balances(user_id), BALANCE_FIELDS)
+
+
+api.add_resource(BalancesRecomputeResource, '/balances/recompute/')
+
+
+class SettleUpResource(Resource):
+
+    @jwt_required()
+    def get(self):
+        user_id = get_jwt_identity()
+
+        transfers = settle_up(net_balances(Balance.get_group_debts(user_id)))
+
+        # ledger amounts at the current exchange rate
+        rate = exchange_rates.convert(1, exchange_rates.reference_currency, exchange_rates.user_currency(user_id))
+
+        usernames = dict(User.query
+                         .filter(User.id.in_({user for transfer in transfers for user in transfer[:2]}))
+                         .with_entities(User.id, User.username)
+                         .all())
+
+        return marshal([{
+            'from_user_id': debtor,
+            'from_username': usernames.get(debtor),
+            'to_user_id': creditor,
+            'to_username': usernames.get(creditor),
+            'amount': round(amount * rate, 2)
+        } for debtor, creditor, amount in transfers], TRANSFER_FIELDS)
+
+
+api.add_resource(SettleUpResource, '/balances/settle-up/')
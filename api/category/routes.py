@@ -2,7 +2,7 @@ from flask import Blueprint
 from flask_restful import Resource, reqparse, marshal, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import api
+from app import api, category_cache
 from models import db, Category
 from commons.decorators.reqparser import req_parser
 
@@ -36,14 +36,15 @@ class CategoryResource(Resource):
     def get(self, parsed_args, category_id=None):
         user_id = get_jwt_identity()
 
-        if category_id and (category := Category.query.filter_by(id=category_id, user_id=user_id).first()):
+        if category_id and (category := category_cache.category(user_id, category_id)):
             return marshal(category, CATEGORY_FIELDS)
 
         elif not category_id:
+            categories = category_cache.get(user_id).values()
             if parsed_args.only_actives:
-                return marshal(Category.query.filter_by(user_id=user_id, active=True).all(), CATEGORY_FIELDS)
+                return marshal([category for category in categories if category.active], CATEGORY_FIELDS)
 
-            return marshal(Category.query.filter_by(user_id=user_id).all(), CATEGORY_FIELDS)
+            return marshal(list(categories), CATEGORY_FIELDS)
 
         else:
             return {'error': 'Category is disabled, does not exist or does not belong to user'}, 404
@@ -77,6 +78,7 @@ class CategoryResource(Resource):
             category = Category(**parsed_args, user_id=user_id)
             db.session.add(category)
 
+        category_cache.changed(db.session, user_id)
         db.session.commit()
 
         return marshal(category, CATEGORY_FIELDS), response_code
@@ -87,6 +89,7 @@ class CategoryResource(Resource):
 
         if category := Category.query.filter_by(id=category_id, user_id=user_id).first():
             category.active = False
+            category_cache.changed(db.session, user_id)
             db.session.commit()
 
             return marshal(category, CATEGORY_FIELDS)
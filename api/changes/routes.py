@@ -0,0 +1,97 @@
+from flask import Blueprint
+from flask_restful import Resource, reqparse, marshal, fields
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app import api
+from models import db, Expense, Category, Share, User, Change, ChangeSequence
+from api.expense.routes import EXPENSE_FIELDS
+from api.category.routes import CATEGORY_FIELDS
+from commons.decorators.reqparser import req_parser
+
+
+changes_blueprint = Blueprint('changes', __name__)
+
+SHARE_FIELDS = {
+    'user_id': fields.Integer(attribute='shared_with_user_id'),
+    'username': fields.String(attribute='shared_with.username')
+}
+
+ENTITIES = ('expense', 'category', 'share')
+
+
+class ChangesResource(Resource):
+
+    @staticmethod
+    def _validate_limit(value):
+        if (value := int(value)) < 1:
+            raise ValueError('Limit must be greater than 0')
+
+        return min(value, 1000)
+
+    get_args_parse = reqparse.RequestParser(bundle_errors=True)
+    get_args_parse.add_argument('since', type=int, default=0, location='args', help='Invalid sequence value')
+    get_args_parse.add_argument('limit', type=_validate_limit, default=500, location='args',
+                                help='Invalid limit value')
+
+    @jwt_required()
+    @req_parser(get_args_parse, strict=False)
+    def get(self, parsed_args):
+        user_id = get_jwt_identity()
+
+        sequence = db.session.query(ChangeSequence.sequence).filter_by(user_id=user_id).scalar() or 0
+
+        # clients without sequence (or with an unknown one) get every entity
+        if not parsed_args.since or parsed_args.since > sequence:
+            return {
+                'sequence': sequence,
+                'full': True,
+                'more': False,
+                'expenses': marshal(Expense.query.filter_by(user_id=user_id).all(), EXPENSE_FIELDS),
+                'categories': marshal(Category.query.filter_by(user_id=user_id).all(), CATEGORY_FIELDS),
+                'shares': marshal(Share.query.filter_by(shared_by_user_id=user_id).all(), SHARE_FIELDS),
+                'deleted': {entity: list() for entity in ENTITIES}
+            }
+
+        changes = Change.query \
+            .filter(Change.user_id == user_id, Change.sequence > parsed_args.since) \
+            .order_by(Change.sequence) \
+            .limit(parsed_args.limit + 1) \
+            .all()
+
+        more = len(changes) > parsed_args.limit
+        changes = changes[:parsed_args.limit]
+
+        changed, deleted = {entity: set() for entity in ENTITIES}, {entity: set() for entity in ENTITIES}
+        for change in changes:
+            (deleted if change.deleted else changed)[change.entity].add(change.entity_id)
+
+        expenses = Expense.query \
+            .filter(Expense.user_id == user_id, Expense.id.in_(changed['expense'])) \
+            .all() if changed['expense'] else list()
+
+        categories = Category.query \
+            .filter(Category.user_id == user_id, Category.id.in_(changed['category'])) \
+            .all() if changed['category'] else list()
+
+        shares = Share.query \
+            .join(User, Share.shared_with_user_id == User.id) \
+            .filter(Share.shared_by_user_id == user_id, Share.shared_with_user_id.in_(changed['share'])) \
+            .all() if changed['share'] else list()
+
+        # entities changed and deleted after the changes were read are deleted
+        deleted['expense'].update(changed['expense'].difference(expense.id for expense in expenses))
+        deleted['category'].update(changed['category'].difference(category.id for category in categories))
+        deleted['share'].update(changed['share'].difference(share.shared_with_user_id for share in shares))
+
+        return {
+            'sequence': changes[-1].sequence if changes else parsed_args.since,
+            'full': False,
+            'more': more,
+            'expenses': marshal(expenses, EXPENSE_FIELDS),
+            'categories': marshal(categories, CATEGORY_FIELDS),
+            'shares': marshal(shares, SHARE_FIELDS),
+            'deleted': {entity: sorted(entity_ids) for entity, entity_ids in deleted.items()}
+        }
+
+
+api.add_resource(ChangesResource, '/changes/')
@@ -1,49 +1,81 @@
-from flask import Blueprint
+from flask import Blueprint, current_app
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy.sql import func, desc
+from sqlalchemy.sql import func, desc, select
 
 from math import copysign
 from datetime import datetime
 from calendar import monthrange, month_name
 
-from app import api
-from models import Expense, Category
+from app import api, admission_controller, exchange_rates
+from models import db, Category, ExpenseSummary
+from commons.money import to_cents, from_cents
+from commons.decorators.admission import admission_control
 
 
 charts_blueprint = Blueprint('charts', __name__)
 
+# read only core statements (plain rows, no orm entities), built once with bound parameters. amounts of the
+# archived expenses come from their monthly summaries, all of them converted to the user currency
+category_table = Category.__table__
+
+
+def user_amounts_statement(amounts):
+    return select().select_from(amounts.join(category_table, amounts.c.category_id == category_table.c.id))
+
+
+history_amounts = ExpenseSummary.user_amounts()
+month_trunc = func.date_trunc('month', history_amounts.c.timestamp)
+HISTORY_CHART_STATEMENT = user_amounts_statement(history_amounts) \
+    .add_columns(category_table.c.name,
+                 category_table.c.color,
+                 month_trunc.label('month'),
+                 func.sum(history_amounts.c.amount).label('total_amount')) \
+    .group_by(month_trunc, category_table.c.id, category_table.c.name, category_table.c.color) \
+    .order_by(category_table.c.name)
+
+
+def categories_chart_statement(amounts):
+    return user_amounts_statement(amounts) \
+        .add_columns(category_table.c.name,
+                     category_table.c.color,
+                     func.sum(amounts.c.amount).label('total_amount')) \
+        .group_by(category_table.c.id, category_table.c.name, category_table.c.color) \
+        .order_by(desc('total_amount'))
+
+
+CATEGORIES_CHART_STATEMENT = categories_chart_statement(ExpenseSummary.user_amounts())
+CATEGORY_CATEGORIES_CHART_STATEMENT = categories_chart_statement(ExpenseSummary.user_amounts(category=True))
+
 
 class QuickHistoryChartResource(Resource):
 
     @jwt_required()
+    @admission_control(admission_controller, 'history-chart', 'HISTORY_CHART_ADMISSION_LIMIT', get_jwt_identity)
     def get(self, months=12):
         user_id = get_jwt_identity()
 
+        if months > (max_months := current_app.config['MAX_HISTORY_MONTHS']):
+            return {'message': {'months': f'History cannot exceed {max_months} months'}}, 400
+
         end_date = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
         start_date = self._calculate_start_date(end_date, months)
 
-        month_trunc = func.date_trunc('month', Expense.timestamp)
-        expenses = Expense.query.filter(Expense.user_id == user_id,
-                                        Expense.timestamp >= start_date,
-                                        Expense.timestamp <= end_date) \
-            .join(Category, Expense.category_id == Category.id) \
-            .with_entities(Category, month_trunc, func.sum(Expense.amount).label('total_amount')) \
-            .group_by(month_trunc, Category) \
-            .order_by(Category.name)
+        expenses = db.session.execute(HISTORY_CHART_STATEMENT,
+                                      ExpenseSummary.user_amounts_params(user_id, start_date, end_date))
 
         datasets = dict()
-        for category, month, amount in expenses:
-            if category.name not in datasets:
-                datasets[category.name] = {
-                    'label': category.name,
+        for name, color, month, amount in expenses:
+            if name not in datasets:
+                datasets[name] = {
+                    'label': name,
                     'data': [0 for _ in range(months)],
-                    'borderColor': category.color,
-                    'backgroundColor': category.color
+                    'borderColor': color,
+                    'backgroundColor': color
                 }
 
             months_list_index = abs((month.year - start_date.year) * 12 + (month.month - start_date.month - 1))
-            datasets[category.name]['data'][months_list_index] = amount
+            datasets[name]['data'][months_list_index] = amount
 
         return {
             'labels': list(map(lambda m: month_name[(m % 12) + 1],
@@ -72,6 +104,7 @@ api.add_resource(QuickHistoryChartResource, '/history-chart/<int:months>')
 class CategoriesChartResource(Resource):
 
     @jwt_required()
+    @admission_control(admission_controller, 'categories-chart', 'CATEGORIES_CHART_ADMISSION_LIMIT', get_jwt_identity)
     def get(self, start_date=None, end_date=None, category=0):
         user_id = get_jwt_identity()
 
@@ -88,17 +121,12 @@ class CategoriesChartResource(Resource):
         start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
         end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-        expenses = Expense.get_user_expenses_date_interval(user_id,
-                                                           start_date,
-                                                           end_date,
-                                                           category)
+        if (end_date - start_date).days >= (max_days := current_app.config['MAX_DATE_RANGE_DAYS']):
+            return {'message': {'end_date': f'Date range cannot exceed {max_days} days'}}, 400
 
-        expenses = expenses \
-            .join(Category, Expense.category_id == Category.id) \
-            .with_entities(Category.name, Category.background_color, func.sum(Expense.amount).label('total_amount')) \
-            .group_by(Category) \
-            .order_by(desc('total_amount')) \
-            .all()
+        expenses = db.session.execute(CATEGORY_CATEGORIES_CHART_STATEMENT if category else CATEGORIES_CHART_STATEMENT,
+                                      ExpenseSummary.user_amounts_params(user_id, start_date, end_date,
+                                                                         category)).all()
 
         labels, background_colors, amounts = list(), list(), list()
         if expenses:
@@ -112,7 +140,8 @@ class CategoriesChartResource(Resource):
                     'backgroundColor': background_colors
                 }]
             },
-            'total_amount': round(sum(amounts), 2)
+            'total_amount': from_cents(sum(map(to_cents, amounts))),
+            'currency': exchange_rates.user_currency(user_id)
         }
 
 
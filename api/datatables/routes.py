@@ -1,16 +1,19 @@
-from flask import Blueprint
-from flask_restful import Resource, marshal, fields
+from flask import Blueprint, current_app
+from flask_restful import Resource, reqparse, marshal, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, select, bindparam, true
 
 from datetime import datetime
 from calendar import monthrange
 
-from app import api
-from models import Expense, Category, User, Share
-from api.expense.routes import EXPENSE_FIELDS
+from app import api, admission_controller
+from models import Expense, ExpenseSummary, Category, User, Share
+from api.expense.routes import EXPENSE_FIELDSET
 from api.category.routes import CATEGORY_FIELDS
 from commons.datatable import DatatableHandler, datatable_request_parser
+from commons.money import to_cents, from_cents
+from commons.decorators.reqparser import req_parser
+from commons.decorators.admission import admission_control
 
 
 datatables_blueprint = Blueprint('datatables', __name__)
@@ -19,20 +22,60 @@ datatables_blueprint = Blueprint('datatables', __name__)
 FAVORITES_DATATABLE_FIELDS = {
     'description': fields.String,
     'category': fields.Nested({
-        'color': fields.String
-    }, attribute='category'),
+        'color': fields.String(attribute='category_color')
+    }, attribute=lambda obj: obj),  # pass the row to the nested field
     'amount': fields.Float,
+    'currency': fields.String,
     'favorite_order': fields.Integer
 }
 
 SHARES_DATATABLE_FIELDS = {
-    'username': fields.String(attribute='shared_with.username'),
+    'username': fields.String,
     'id': fields.Nested({
         'shared_by_user_id': fields.Integer,
         'shared_with_user_id': fields.Integer
-    }, attribute=lambda obj: obj)  # pass the Share object to the nested field
+    }, attribute=lambda obj: obj)  # pass the row to the nested field
 }
 
+# read only core statements (plain rows, no orm entities), built once with bound parameters
+expense_table, category_table, user_table, share_table = \
+    Expense.__table__, Category.__table__, User.__table__, Share.__table__
+
+CATEGORIES_STATEMENT = select(category_table) \
+    .where(category_table.c.user_id == bindparam('user_id'))
+
+
+def categories_balance_statement(amounts):
+    # amounts of the archived expenses come from their monthly summaries, converted to the user currency
+    return select(category_table.c.name,
+                  category_table.c.color,
+                  category_table.c.limit,
+                  func.sum(amounts.c.amount).label('total_amount')) \
+        .select_from(amounts.join(category_table, amounts.c.category_id == category_table.c.id)) \
+        .group_by(category_table.c.id, category_table.c.name, category_table.c.color, category_table.c.limit) \
+        .order_by(category_table.c.name)
+
+
+CATEGORIES_BALANCE_STATEMENT = categories_balance_statement(ExpenseSummary.user_amounts())
+CATEGORY_CATEGORIES_BALANCE_STATEMENT = categories_balance_statement(ExpenseSummary.user_amounts(category=True))
+
+# favorites are read through the favorites partial index (the is_favorite = true condition must be kept as is, it is
+# the sqlite index predicate)
+FAVORITES_STATEMENT = select(expense_table.c.description,
+                             expense_table.c.amount,
+                             expense_table.c.currency,
+                             expense_table.c.favorite_order,
+                             category_table.c.color.label('category_color')) \
+    .select_from(expense_table.join(category_table, expense_table.c.category_id == category_table.c.id)) \
+    .where(expense_table.c.user_id == bindparam('user_id'),
+           expense_table.c.is_favorite == true())
+
+SHARES_STATEMENT = select(share_table.c.shared_by_user_id,
+                          share_table.c.shared_with_user_id,
+                          user_table.c.username) \
+    .select_from(share_table.join(user_table, share_table.c.shared_with_user_id == user_table.c.id)) \
+    .where(share_table.c.shared_by_user_id == bindparam('user_id'))
+
 
 class ExpensesDatatableResource(Resource, DatatableHandler):
 
@@ -46,9 +89,16 @@ class ExpensesDatatableResource(Resource, DatatableHandler):
         6: Expense.paid
     }
 
+    get_args_parse = reqparse.RequestParser()
+    get_args_parse.add_argument('fields', type=EXPENSE_FIELDSET.parse, location='args',
+                                help='Invalid fields: {error_msg}')
+
     @jwt_required()
+    @admission_control(admission_controller, 'expenses-datatable', 'EXPENSES_DATATABLE_ADMISSION_LIMIT',
+                       get_jwt_identity)
     @datatable_request_parser()
-    def get(self, start_date=None, end_date=None, category=0):
+    @req_parser(get_args_parse, strict=False)
+    def get(self, parsed_args, start_date=None, end_date=None, category=0):
         user_id = get_jwt_identity()
 
         # set start_date and end_date if not set
@@ -64,15 +114,18 @@ class ExpensesDatatableResource(Resource, DatatableHandler):
         start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
         end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
 
+        if (end_date - start_date).days >= (max_days := current_app.config['MAX_DATE_RANGE_DAYS']):
+            return {'message': {'end_date': f'Date range cannot exceed {max_days} days'}}, 400
+
         expenses = Expense.get_user_expenses_date_interval(user_id,
                                                            start_date,
                                                            end_date,
                                                            category)
 
-        paginate = super().handle_request(expenses)
+        paginate = super().handle_request(EXPENSE_FIELDSET.query(expenses, parsed_args.fields))
 
         return {
-            'data': marshal(paginate.items, EXPENSE_FIELDS),
+            'data': marshal(paginate.items, EXPENSE_FIELDSET.fields(parsed_args.fields)),
             'recordsTotal': paginate.total,
         }
 
@@ -85,8 +138,8 @@ api.add_resource(ExpensesDatatableResource,
 class CategoriesDatatableResource(Resource, DatatableHandler):
 
     COLUMNS = {
-        0: Category.name,
-        1: Category.limit,
+        0: category_table.c.name,
+        1: category_table.c.limit,
         2: 'Options'
     }
 
@@ -95,10 +148,10 @@ class CategoriesDatatableResource(Resource, DatatableHandler):
     def get(self):
         user_id = get_jwt_identity()
 
-        paginate = super().handle_request(Category.query.filter_by(user_id=user_id))
+        paginate = super().handle_request(CATEGORIES_STATEMENT, {'user_id': user_id})
 
         return {
-            'data': marshal(paginate.items, CATEGORY_FIELDS),
+            'data': marshal([category._mapping for category in paginate.items], CATEGORY_FIELDS),
             'recordsTotal': paginate.total
         }
 
@@ -109,13 +162,15 @@ api.add_resource(CategoriesDatatableResource, '/categories-datatable/')
 class CategoriesBalanceDatatableResource(Resource, DatatableHandler):
 
     COLUMNS = {
-        0: Category.name,
+        0: category_table.c.name,
         1: 'Limit',
         2: 'Balance',
         3: 'Spent'
     }
 
     @jwt_required()
+    @admission_control(admission_controller, 'categories-balance-datatable', 'CATEGORIES_BALANCE_ADMISSION_LIMIT',
+                       get_jwt_identity)
     @datatable_request_parser()
     def get(self, start_date=None, end_date=None, category=0):
         user_id = get_jwt_identity()
@@ -133,30 +188,27 @@ class CategoriesBalanceDatatableResource(Resource, DatatableHandler):
         start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
         end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
 
+        if (end_date - start_date).days >= (max_days := current_app.config['MAX_DATE_RANGE_DAYS']):
+            return {'message': {'end_date': f'Date range cannot exceed {max_days} days'}}, 400
+
         # calculate the number of months between start date and end date
         months = ((end_date.year - start_date.year) * 12 + end_date.month - start_date.month) + 1
 
-        expenses = Expense.get_user_expenses_date_interval(user_id,
-                                                           start_date,
-                                                           end_date,
-                                                           category) \
-            .with_entities(Category, func.sum(Expense.amount).label('total_amount')) \
-            .group_by(Category.id) \
-            .order_by(Category.name)
-
-        paginate = super().handle_request(expenses)
+        paginate = super().handle_request(
+            CATEGORY_CATEGORIES_BALANCE_STATEMENT if category else CATEGORIES_BALANCE_STATEMENT,
+            ExpenseSummary.user_amounts_params(user_id, start_date, end_date, category))
 
         return {
             'recordsTotal': paginate.total,
             'data': [{
                 'category': {
-                    'name': category.name,
-                    'color': category.color
+                    'name': name,
+                    'color': color
                 },
-                'limit': (months_limit := round(category.limit * months, 2)),
-                'balance': round(months_limit - total_amount, 2),
-                'spent': round(total_amount, 2)
-            } for category, total_amount in paginate.items]
+                'limit': from_cents(to_cents(limit) * months),
+                'balance': from_cents(to_cents(limit) * months - to_cents(total_amount)),
+                'spent': total_amount
+            } for name, color, limit, total_amount in paginate.items]
         }
 
 
@@ -168,10 +220,10 @@ api.add_resource(CategoriesBalanceDatatableResource,
 class FavoritesDatatableResource(Resource, DatatableHandler):
 
     COLUMNS = {
-        0: Expense.description,
-        1: Expense.amount,
+        0: expense_table.c.description,
+        1: expense_table.c.amount,
         2: 'Options',
-        3: Expense.favorite_order
+        3: expense_table.c.favorite_order
     }
 
     @jwt_required()
@@ -179,12 +231,10 @@ class FavoritesDatatableResource(Resource, DatatableHandler):
     def get(self):
         user_id = get_jwt_identity()
 
-        paginate = super().handle_request(
-            Expense.query.filter_by(user_id=user_id, is_favorite=True)
-            .join(Category, Expense.category_id == Category.id))
+        paginate = super().handle_request(FAVORITES_STATEMENT, {'user_id': user_id})
 
         return {
-            'data': marshal(paginate.items, FAVORITES_DATATABLE_FIELDS),
+            'data': marshal([expense._mapping for expense in paginate.items], FAVORITES_DATATABLE_FIELDS),
             'recordsTotal': paginate.total
         }
 
@@ -195,7 +245,7 @@ api.add_resource(FavoritesDatatableResource, '/favorites-datatable/')
 class SharesDatatableResource(Resource, DatatableHandler):
 
     COLUMNS = {
-        0: User.username,
+        0: user_table.c.username,
         1: 'Options'
     }
 
@@ -204,13 +254,10 @@ class SharesDatatableResource(Resource, DatatableHandler):
     def get(self):
         user_id = get_jwt_identity()
 
-        paginate = super().handle_request(
-            Share.query.filter_by(shared_by_user_id=user_id)
-            .join(User, Share.shared_with_user_id == User.id)
-        )
+        paginate = super().handle_request(SHARES_STATEMENT, {'user_id': user_id})
 
         return {
-            'data': marshal(paginate.items, SHARES_DATATABLE_FIELDS),
+            'data': marshal([share._mapping for share in paginate.items], SHARES_DATATABLE_FIELDS),
             'recordsTotal': paginate.total
         }
 
@@ -0,0 +1,30 @@
+from flask import Blueprint, Response, stream_with_context
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app import api, event_broker
+from models import db
+
+
+events_blueprint = Blueprint('events', __name__)
+
+
+class EventsResource(Resource):
+
+    # browsers event sources cannot send headers, the token can be sent in the query string (jwt parameter)
+    @jwt_required(locations=['headers', 'query_string'])
+    def get(self):
+        user_id = get_jwt_identity()
+
+        if not (subscription := event_broker.subscribe(user_id)):
+            return {'error': 'Too many event streams, try again later'}, 503, {'Retry-After': 30}
+
+        # the stream does not use the database, the connection is returned to the pool
+        db.session.remove()
+
+        return Response(stream_with_context(event_broker.stream(subscription)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+api.add_resource(EventsResource, '/events/')
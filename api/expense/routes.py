@@ -1,15 +1,29 @@
-from flask import Blueprint
+from flask import Blueprint, Response, current_app, stream_with_context
 from flask_restful import Resource, reqparse, marshal, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import insert, update, select, values, column, case, true, BigInteger, Integer
+from sqlalchemy.orm import selectinload
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import FileStorage
 
+import json
+import shutil
 import logging
-from types import SimpleNamespace
-from datetime import datetime, date, time
-
-from app import api
-from models import db, Expense, Category, Share, User
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+from collections import Counter
+from datetime import datetime, date, time, timedelta
+
+from app import api, job_queue, description_indexes, share_permissions, category_cache, shard_router, \
+    exchange_rates
+from models import db, Expense, ArchivedExpense, ExpenseSummary, Change
 from api.category.routes import CATEGORY_FIELDS
+from commons.transaction import after_commit
+from commons.fieldsets import Fieldset
+from commons.partitions import ensure_partitions
 from commons.decorators.reqparser import req_parser
+from commons.statement_import import StatementImportError, read_csv_statement, read_ofx_statement, chunks, \
+    expense_key
 
 
 logger = logging.getLogger(__name__)
@@ -25,19 +39,45 @@ SHARES_FIELDS = {
 EXPENSE_FIELDS = {
     'id': fields.Integer,
     'description': fields.String,
-    'category': fields.Nested(CATEGORY_FIELDS),
+    'category': fields.Nested(CATEGORY_FIELDS,
+                              attribute=lambda obj: category_cache.category(obj.user_id, obj.category_id)),
     'date': fields.String(attribute=lambda obj: obj.timestamp.date()),
     'time': fields.String(attribute=lambda obj: obj.timestamp.time()),
     'timestamp': fields.String(),
     'amount': fields.Float,
+    'currency': fields.String,
     'paid': fields.Boolean,
     'is_favorite': fields.Boolean,
     'favorite_order': fields.Integer,
     'parent_id': fields.Integer,
+    'recurring_expense_id': fields.Integer,
     'shares': fields.Nested(SHARES_FIELDS, default=True, attribute='children'),
     'is_owner': fields.Boolean
 }
 
+# sparse fieldsets of the expenses (fields query argument): model columns of each field and shares loaded with a
+# single query when requested
+EXPENSE_FIELDSET = Fieldset(EXPENSE_FIELDS, {
+    'id': (Expense.id,),
+    'description': (Expense.description,),
+    'category': (Expense.user_id, Expense.category_id),
+    'date': (Expense.timestamp,),
+    'time': (Expense.timestamp,),
+    'timestamp': (Expense.timestamp,),
+    'amount': (Expense.amount,),
+    'currency': (Expense.currency,),
+    'paid': (Expense.paid,),
+    'is_favorite': (Expense.is_favorite,),
+    'favorite_order': (Expense.favorite_order,),
+    'parent_id': (Expense.parent_id,),
+    'recurring_expense_id': (Expense.recurring_expense_id,),
+    'shares': (Expense.id,),
+    'is_owner': (Expense.parent_id,)
+}, {
+    'shares': (Expense.children,
+               selectinload(Expense.children).load_only(Expense.user_id, Expense.amount, Expense.paid))
+})
+
 
 class ExpenseResource(Resource):
 
@@ -73,12 +113,21 @@ class ExpenseResource(Resource):
 
             return value
 
+    @staticmethod
+    def _validate_currency(value):
+        if value:
+            if not exchange_rates.is_supported(value := value.strip().upper()):
+                raise ValueError('Invalid currency or currency without exchange rates')
+
+            return value
+
     post_args_parse = reqparse.RequestParser(bundle_errors=True)
     post_args_parse.add_argument('description', type=str, required=True, help='Description is required')
     post_args_parse.add_argument('category', type=int, required=True, help='Category is required')
     post_args_parse.add_argument('date', type=_validate_date, required=True, help='Date is required')
     post_args_parse.add_argument('time', type=_validate_time, required=True, help='Time is required')
     post_args_parse.add_argument('amount', type=_validate_amount, required=True, help='Amount is required')
+    post_args_parse.add_argument('currency', type=_validate_currency, help='{error_msg}')
     post_args_parse.add_argument('paid', type=bool, default=True)
     post_args_parse.add_argument('is_favorite', type=bool, default=False)
     post_args_parse.add_argument('favorite_order', type=int)
@@ -91,21 +140,30 @@ class ExpenseResource(Resource):
                                    help='Share amount is required')
     shares_args_parse.add_argument('paid', type=bool, location='json', default=False)
 
+    get_args_parse = reqparse.RequestParser()
+    get_args_parse.add_argument('fields', type=EXPENSE_FIELDSET.parse, location='args',
+                                help='Invalid fields: {error_msg}')
+    get_args_parse.add_argument('archived', type=int, default=0, location='args', help='Invalid archived value')
+
     @jwt_required()
-    def get(self, expense_id=None):
+    @req_parser(get_args_parse, strict=False)
+    def get(self, parsed_args, expense_id=None):
         user_id = get_jwt_identity()
 
-        if expense_id and (expense := Expense.query.filter_by(id=expense_id, user_id=user_id).first()):
-            return marshal(expense, EXPENSE_FIELDS)
+        # archived expenses are only served on request (archived=1)
+        expenses = ArchivedExpense.query.filter_by(user_id=user_id) if parsed_args.archived else \
+            EXPENSE_FIELDSET.query(Expense.query.filter_by(user_id=user_id), parsed_args.fields)
+        if expense_id and (expense := expenses.filter_by(id=expense_id).first()):
+            return marshal(expense, EXPENSE_FIELDSET.fields(parsed_args.fields))
 
         elif not expense_id:
-            return marshal(Expense.query.filter_by(user_id=user_id).all(), EXPENSE_FIELDS)
+            return marshal(expenses.all(), EXPENSE_FIELDSET.fields(parsed_args.fields))
 
         else:
             return {'error': 'Expense does not exist or does not belong to user'}, 404
 
     @jwt_required()
-    @req_parser(post_args_parse)
+    @req_parser(post_args_parse, nested={'shares': shares_args_parse})
     def post(self, parsed_args, expense_id=None):
         user_id = get_jwt_identity()
 
@@ -115,19 +173,15 @@ class ExpenseResource(Resource):
         parsed_args.timestamp = datetime.combine(parsed_args.date, parsed_args.time).replace(microsecond=0)
         del parsed_args['date'], parsed_args['time']
 
-        # shares validation (using args_parse)
-        shares = \
-            list(map(lambda v: self.shares_args_parse.parse_args(SimpleNamespace(**{'json': v})),
-                     parsed_args.pop('shares')))
+        # shares are validated with the request body (nested shares_args_parse)
+        shares = parsed_args.pop('shares')
+
+        # new expenses are in the user currency unless given (supported currencies convert on any date)
+        if not parsed_args.currency:
+            del parsed_args['currency']
 
         # shares permission check
-        unallowed_shares_user_ids = {s.user_id for s in shares} \
-            .difference(
-                {s.shared_with_user_id for s in Share.query
-                    .join(User, Share.shared_with_user_id == User.id)
-                    .with_entities(Share.shared_with_user_id)
-                    .filter(Share.shared_by_user_id == user_id,
-                            User.active).all()})
+        unallowed_shares_user_ids = {s.user_id for s in shares}.difference(share_permissions.allowed_user_ids(user_id))
         if unallowed_shares_user_ids:
             # convert unallowed_shares_user_ids from set to string to user in messages bellow
             unallowed_shares_user_ids = ', '.join(map(lambda v: str(v), unallowed_shares_user_ids))
@@ -138,8 +192,8 @@ class ExpenseResource(Resource):
                     {'shares': f'User is not allowed to share expenses with user(s): {unallowed_shares_user_ids}'}}, 400
 
         # check if the expense category exists and belong to user
-        if category := Category.query.filter_by(id=parsed_args.category, active=True, user_id=user_id).first():
-            parsed_args.category = category
+        if category_cache.category(user_id, parsed_args.category, active=True):
+            parsed_args.category_id = parsed_args.pop('category')
 
         else:
             return {'message':
@@ -152,61 +206,355 @@ class ExpenseResource(Resource):
                 return {'message':
                         {'amount': 'Cannot change the amount of a shared expense'}}
 
+            if expense.parent_id and parsed_args.get('currency', expense.currency) != expense.currency:
+                return {'message':
+                        {'currency': 'Cannot change the currency of a shared expense'}}, 400
+
+            # edits only count for the autocomplete when the description or the category changed
+            indexed = parsed_args.description != expense.description or parsed_args.category_id != expense.category_id
             list(map(lambda arg: setattr(expense, arg, parsed_args[arg]), parsed_args))
 
         else:
-            response_code = 201
+            response_code, indexed = 201, True
 
             expense = Expense(**parsed_args, user_id=user_id)
             db.session.add(expense)
+            db.session.flush()  # get the expense id for the shares job
 
+        # expense shares are handled in background after the expense is committed
+        if shares:
+            job_queue.enqueue('expense_shares', expense_id=expense.id, shares=list(map(dict, shares)), user_id=user_id)
+
+        if indexed:
+            after_commit(db.session, lambda: description_indexes.add(user_id,
+                                                                     parsed_args.description,
+                                                                     parsed_args.category_id,
+                                                                     parsed_args.timestamp))
         db.session.commit()
 
-        # handle expense shares
-        has_uncommitted_changes = False
-        for share in shares:
-            shared_expense = Expense.query.filter_by(user_id=share.user_id, parent_id=expense.id).first()
-            # added shared expense
-            if not shared_expense:
-                try:
-                    shared_expense = expense.create_shared_expense(share.user_id, share.amount, share.paid)
-                    db.session.add(shared_expense)
+        return marshal(expense, EXPENSE_FIELDS), response_code
 
-                except PermissionError as permission_error:
-                    logger.warning(f'Expense {expense.id} not shared with user {share.user_id}:',
-                                   exc_info=permission_error)
+    @jwt_required()
+    def delete(self, expense_id):
+        user_id = get_jwt_identity()
 
-            # removed shared expense
-            elif share.amount in [None, 0]:
-                db.session.delete(shared_expense)
+        if expense := Expense.query.filter_by(id=expense_id, user_id=user_id).first():
+            db.session.delete(expense)
+            db.session.commit()
 
-            # updated shared expense
-            elif share.amount != shared_expense.amount or share.paid != shared_expense.paid:
-                shared_expense.amount = share.amount
-                shared_expense.paid = share.paid
+            return marshal(expense, EXPENSE_FIELDS)
 
-            else:
-                continue  # avoid changing the value of the flag bellow
+        else:
+            return {'error': 'Expense does not exist or does not belong to user'}, 404
+
+
+api.add_resource(ExpenseResource, '/expense/', '/expense/<int:expense_id>/')
+
+
+class ExpenseImportResource(Resource):
+
+    post_args_parse = reqparse.RequestParser(bundle_errors=True)
+    post_args_parse.add_argument('file', type=FileStorage, location='files', required=True, help='File is required')
+    post_args_parse.add_argument('category', type=int, location='form', required=True, help='Category is required')
+    post_args_parse.add_argument('currency', type=ExpenseResource._validate_currency, location='form',
+                                 help='{error_msg}')
+    post_args_parse.add_argument('format', type=str, location='form', choices=('csv', 'ofx'),
+                                 help='Format must be csv or ofx')
+    post_args_parse.add_argument('negative_amounts', type=int, location='form', default=1,
+                                 help='Invalid value: 0 for false or other numeric value for true')
+    post_args_parse.add_argument('description_column', type=str, location='form', default='description')
+    post_args_parse.add_argument('date_column', type=str, location='form', default='date')
+    post_args_parse.add_argument('time_column', type=str, location='form')
+    post_args_parse.add_argument('amount_column', type=str, location='form', default='amount')
+    post_args_parse.add_argument('category_column', type=str, location='form')
+    post_args_parse.add_argument('date_format', type=str, location='form')
+    post_args_parse.add_argument('delimiter', type=str, location='form', default=',')
+
+    @jwt_required()
+    @req_parser(post_args_parse, strict=False)  # strict mode would try to read a json body
+    def post(self, parsed_args):
+        user_id = get_jwt_identity()
+
+        # categories by name, used for the category column mapping
+        categories = {category.name.lower(): category.id
+                      for category in category_cache.get(user_id).values() if category.active}
+        if parsed_args.category not in categories.values():
+            return {'message':
+                    {'category': 'Category is disabled, does not exist or does not belong to user'}}, 400
 
-            has_uncommitted_changes = True
+        # the upload is copied to a file owned by the import generator, the request file is closed when the view
+        # returns (before the response is streamed)
+        upload = SpooledTemporaryFile(max_size=current_app.config['IMPORT_SPOOL_MAX_SIZE'])
+        shutil.copyfileobj(parsed_args.file.stream, upload)
+        upload.seek(0)
 
-        if has_uncommitted_changes:
+        import_format = parsed_args.format or \
+            ('ofx' if parsed_args.file.filename.lower().endswith(('.ofx', '.qfx')) else 'csv')
+        if import_format == 'ofx':
+            lines = read_ofx_statement(upload)
+
+        else:
+            lines = read_csv_statement(upload,
+                                       description_column=parsed_args.description_column,
+                                       date_column=parsed_args.date_column,
+                                       amount_column=parsed_args.amount_column,
+                                       time_column=parsed_args.time_column,
+                                       category_column=parsed_args.category_column,
+                                       date_format=parsed_args.date_format,
+                                       delimiter=parsed_args.delimiter)
+
+        # read the first line before streaming the response so file errors can still be reported as bad request
+        try:
+            lines = chain([first_line], lines) if (first_line := next(lines, None)) else list()
+
+        except (StatementImportError, UnicodeDecodeError) as file_error:
+            upload.close()
+            return {'message': {'file': f'Invalid file: {file_error}'}}, 400
+
+        return Response(stream_with_context(self._import(user_id, upload, lines, categories, parsed_args)),
+                        mimetype='application/x-ndjson')
+
+    @staticmethod
+    def _import(user_id, upload, lines, categories, parsed_args):
+        # expenses are inserted in batches inside a single transaction, reporting the progress after each batch
+        progress = {'processed': 0, 'inserted': 0, 'duplicates': 0, 'skipped': 0, 'errors': 0}
+        errors = list()
+        currency = parsed_args.currency or exchange_rates.user_currency(user_id)
+
+        # statement lines equal to existing expenses are not imported again (counting repeated lines, so equal
+        # lines in the statement are all imported the first time)
+        seen, inserted = Counter(), Counter()
+        try:
+            for chunk in chunks(lines, current_app.config['IMPORT_BATCH_SIZE']):
+                rows = list()
+                for line, row in chunk:
+                    progress['processed'] += 1
+
+                    if not isinstance(row, StatementImportError) and not row['description']:
+                        row = StatementImportError('Description is required')
+
+                    if isinstance(row, StatementImportError):
+                        progress['errors'] += 1
+                        if len(errors) < 100:
+                            errors.append({'line': line, 'error': str(row)})
+
+                        continue
+
+                    # with negative amounts only debits (negative values) are expenses
+                    amount = -row['amount'] if parsed_args.negative_amounts else row['amount']
+                    if amount <= 0:
+                        progress['skipped'] += 1
+                        continue
+
+                    rows.append({
+                        'user_id': user_id,
+                        'category_id': categories.get((row['category'] or '').lower(), parsed_args.category),
+                        'description': row['description'][:50],
+                        'timestamp': row['timestamp'],
+                        'amount': round(amount, 2),
+                        'currency': currency
+                    })
+
+                existing = ExpenseImportResource._get_existing_expenses(user_id, rows)
+                existing.subtract(inserted)  # ignore the expenses inserted by this import
+
+                batch = list()
+                for row in rows:
+                    key = expense_key(row['timestamp'], row['amount'], row['description'])
+
+                    seen[key] += 1
+                    if seen[key] > existing[key]:
+                        inserted[key] += 1
+                        batch.append(row)
+
+                    else:
+                        progress['duplicates'] += 1
+
+                if batch:
+                    # core inserts do not go through the session flush, imported expenses changes are recorded here
+                    expense_ids = db.session.execute(insert(Expense).returning(Expense.id), batch).scalars()
+                    Change.record(db.session, {(user_id, 'expense', expense_id): 'added' for expense_id in expense_ids})
+
+                progress['inserted'] += len(batch)
+                yield json.dumps(progress) + '\n'
+
+            # the user descriptions index is built again with the imported expenses
+            after_commit(db.session, lambda: description_indexes.invalidate(user_id))
             db.session.commit()
 
-        return marshal(expense, EXPENSE_FIELDS), response_code
+            yield json.dumps({**progress, 'done': True, 'error_lines': errors}) + '\n'
+
+        except (StatementImportError, UnicodeDecodeError) as file_error:
+            db.session.rollback()
+
+            yield json.dumps({**progress, 'inserted': 0, 'error': f'Invalid file: {file_error}'}) + '\n'
+            return
+
+        except SQLAlchemyError as import_error:
+            db.session.rollback()
+            logger.error(f'Expenses import of user {user_id} failed:', exc_info=import_error)
+
+            yield json.dumps({**progress, 'inserted': 0, 'error': 'Import failed, no expenses were imported'}) + '\n'
+
+        finally:
+            upload.close()
+
+    @staticmethod
+    def _get_existing_expenses(user_id, rows):
+        if not rows:
+            return Counter()
+
+        timestamps = [row['timestamp'] for row in rows]
+        return Counter(expense_key(*expense) for expense in Expense.query
+                       .filter(Expense.user_id == user_id,
+                               Expense.timestamp >= min(timestamps),
+                               Expense.timestamp <= max(timestamps))
+                       .with_entities(Expense.timestamp, Expense.amount, Expense.description))
+
+
+api.add_resource(ExpenseImportResource, '/expense/import/')
+
+
+class ExpenseAutocompleteResource(Resource):
+
+    get_args_parse = reqparse.RequestParser()
+    get_args_parse.add_argument('q', type=str, default='', location='args')
+    get_args_parse.add_argument('limit', type=int, default=10, location='args', help='Invalid limit value')
 
     @jwt_required()
-    def delete(self, category_id):
+    @req_parser(get_args_parse, strict=False)
+    def get(self, parsed_args):
         user_id = get_jwt_identity()
 
-        if expense := Expense.query.filter_by(id=category_id, user_id=user_id).first():
-            db.session.delete(expense)
+        suggestions = description_indexes.get(user_id).search(parsed_args.q, max(min(parsed_args.limit, 50), 1))
+
+        return {
+            'suggestions': [{
+                'description': description,
+                'category_id': category_id
+            } for description, category_id in suggestions],
+            # the category of the most likely description
+            'category_id': next((category_id for _, category_id in suggestions if category_id), None)
+        }
+
+
+api.add_resource(ExpenseAutocompleteResource, '/expense/autocomplete/')
+
+
+class ExpenseFavoritesOrderResource(Resource):
+
+    post_args_parse = reqparse.RequestParser(bundle_errors=True)
+    post_args_parse.add_argument('ids', type=int, action='append', location='json', required=True,
+                                 help='Favorite expenses ids are required')
+
+    @jwt_required()
+    @req_parser(post_args_parse)
+    def post(self, parsed_args):
+        user_id = get_jwt_identity()
+
+        # the new order must have every favorite expense of the user once (favorites partial index)
+        expense_table = Expense.__table__
+        orders = dict(db.session.execute(select(expense_table.c.id, expense_table.c.favorite_order)
+                                         .where(expense_table.c.user_id == user_id,
+                                                expense_table.c.is_favorite == true()))
+                      .all())
+        if len(parsed_args.ids) != len(orders) or set(parsed_args.ids) != set(orders):
+            return {'message': {'ids': 'Favorite expenses ids must have every favorite expense of the user once'}}, 400
+
+        # only the favorites with a new position are updated, with a single statement
+        if changed := {expense_id: order for order, expense_id in enumerate(parsed_args.ids, 1)
+                       if orders[expense_id] != order}:
+            db.session.execute(self._update_statement(user_id, changed))
+
+            # core updates do not go through the session flush, the favorites changes are recorded here
+            Change.record(db.session, {(user_id, 'expense', expense_id): 'updated' for expense_id in changed})
             db.session.commit()
 
-            return marshal(expense, EXPENSE_FIELDS)
+        return [{'id': expense_id, 'favorite_order': order} for order, expense_id in enumerate(parsed_args.ids, 1)]
 
-        else:
-            return {'error': 'Expense does not exist or does not belong to user'}, 404
+    @staticmethod
+    def _update_statement(user_id, orders):
+        expense_table = Expense.__table__
+        statement = update(expense_table).where(expense_table.c.user_id == user_id)
 
+        # UPDATE ... FROM (VALUES ...) on postgres, a CASE on the ids elsewhere (sqlite has no VALUES column names)
+        if db.engine.dialect.name == 'postgresql':
+            new_orders = values(column('id', BigInteger), column('favorite_order', Integer), name='new_orders') \
+                .data(list(orders.items()))
 
-api.add_resource(ExpenseResource, '/expense/', '/expense/<int:expense_id>/')
+            return statement \
+                .where(expense_table.c.id == new_orders.c.id) \
+                .values(favorite_order=new_orders.c.favorite_order)
+
+        return statement \
+            .where(expense_table.c.id.in_(orders)) \
+            .values(favorite_order=case(orders, value=expense_table.c.id))
+
+
+api.add_resource(ExpenseFavoritesOrderResource, '/expense/favorites/order/')
+
+
+@job_queue.task('expense_shares')
+def handle_expense_shares(expense_id, shares, user_id=None):
+    # shared expenses are on the expense shard: users not moved there yet (see user_shard_move) are moved first
+    shard = shard_router.shard(user_id)
+    for share_user_id in {share['user_id'] for share in shares}:
+        if shard_router.shard(share_user_id) != shard:
+            shard_router.move(share_user_id, shard)
+
+    shard_router.route(db.session, user_id)
+    if not (expense := db.session.get(Expense, expense_id)):
+        logger.warning(f'Expense {expense_id} no longer exists, shares ignored')
+        return
+
+    for share in shares:
+        shared_expense = Expense.query.filter_by(user_id=share['user_id'], parent_id=expense.id).first()
+        # added shared expense
+        if not shared_expense:
+            try:
+                shared_expense = expense.create_shared_expense(share['user_id'], share['amount'], share['paid'])
+                db.session.add(shared_expense)
+
+                after_commit(db.session, lambda user_id=share['user_id']:
+                             description_indexes.add(user_id, expense.description, timestamp=expense.timestamp))
+
+            except PermissionError as permission_error:
+                logger.warning(f'Expense {expense.id} not shared with user {share["user_id"]}:',
+                               exc_info=permission_error)
+
+        # removed shared expense
+        elif share['amount'] in [None, 0]:
+            db.session.delete(shared_expense)
+
+        # updated shared expense (shared expenses are in the expense currency)
+        elif share['amount'] != shared_expense.amount or share['paid'] != shared_expense.paid or \
+                shared_expense.currency != expense.currency:
+            shared_expense.amount = share['amount']
+            shared_expense.paid = share['paid']
+            shared_expense.currency = expense.currency
+
+
+@job_queue.task('expense_partitions', every=24 * 60 * 60)
+def handle_expense_partitions():
+    # partitions of the next periods are created ahead (only for partitioned expense tables)
+    if created := ensure_partitions(db.session.connection(),
+                                    'expense',
+                                    current_app.config['EXPENSE_PARTITION_INTERVAL'],
+                                    current_app.config['EXPENSE_PARTITIONS_AHEAD']):
+        logger.info(f'Expense partitions created: {", ".join(created)}')
+
+
+@job_queue.task('expense_archive', every=24 * 60 * 60)
+def handle_expense_archive():
+    # old expenses are moved to the archive in batches, their amounts are kept in the monthly summaries
+    if not (days := current_app.config['EXPENSE_ARCHIVE_AFTER_DAYS']):
+        return
+
+    horizon = datetime.combine(date.today() - timedelta(days=days), time())
+    for shard in shard_router.shards:
+        db.session.info['shard'] = shard
+        while archived := ExpenseSummary.archive(db.session, horizon,
+                                                 current_app.config['EXPENSE_ARCHIVE_BATCH_SIZE']):
+            db.session.commit()
+
+            logger.info(f'Expenses archived on shard {shard}: {sum(map(len, archived.values()))}')
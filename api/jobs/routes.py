@@ -0,0 +1,26 @@
+from flask import Blueprint
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required
+
+from app import api, job_queue
+
+
+jobs_blueprint = Blueprint('jobs', __name__)
+
+
+class JobsMetricsResource(Resource):
+
+    @jwt_required()
+    def get(self):
+        depth = job_queue.depth()
+
+        return {
+            'queue_depth': depth.get('pending', 0),
+            'running': depth.get('running', 0),
+            'failed': depth.get('failed', 0),
+            'workers': job_queue.size,
+            **job_queue.metrics.as_dict()
+        }
+
+
+api.add_resource(JobsMetricsResource, '/jobs/metrics/')
@@ -0,0 +1,179 @@
+from flask import Blueprint, current_app
+from flask_restful import Resource, reqparse, marshal, fields
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+import logging
+from datetime import datetime, time
+
+from app import api, job_queue, share_permissions, category_cache, shard_router
+from models import db, RecurringExpense
+from api.category.routes import CATEGORY_FIELDS
+from api.expense.routes import ExpenseResource, SHARES_FIELDS
+from commons.recurrence import FREQUENCIES
+from commons.decorators.reqparser import req_parser
+
+
+logger = logging.getLogger(__name__)
+
+recurring_blueprint = Blueprint('recurring', __name__)
+
+RECURRING_EXPENSE_FIELDS = {
+    'id': fields.Integer,
+    'description': fields.String,
+    'category': fields.Nested(CATEGORY_FIELDS,
+                              attribute=lambda obj: category_cache.category(obj.user_id, obj.category_id)),
+    'amount': fields.Float,
+    'currency': fields.String,
+    'paid': fields.Boolean,
+    'shares': fields.List(fields.Nested(SHARES_FIELDS)),
+    'frequency': fields.String,
+    'interval': fields.Integer,
+    'start_timestamp': fields.String(),
+    'end_timestamp': fields.String(),
+    'next_timestamp': fields.String(),
+    'count': fields.Integer,
+    'active': fields.Boolean
+}
+
+
+class RecurringExpenseResource(Resource):
+
+    @staticmethod
+    def _validate_interval(value):
+        if (value := int(value)) < 1:
+            raise ValueError('Interval cannot be lower than 1')
+
+        return value
+
+    # schedules (frequency, interval and start) cannot be changed, the recurring expense is removed and added again
+    post_args_parse = reqparse.RequestParser(bundle_errors=True)
+    post_args_parse.add_argument('description', type=str, required=True, help='Description is required')
+    post_args_parse.add_argument('category', type=int, required=True, help='Category is required')
+    post_args_parse.add_argument('amount', type=ExpenseResource._validate_amount, required=True,
+                                 help='Amount is required')
+    post_args_parse.add_argument('currency', type=ExpenseResource._validate_currency, help='{error_msg}')
+    post_args_parse.add_argument('paid', type=bool, default=True)
+    post_args_parse.add_argument('shares', type=dict, default=[], action='append')
+    post_args_parse.add_argument('frequency', type=str, choices=FREQUENCIES, required=True,
+                                 help='Frequency must be one of: ' + ', '.join(FREQUENCIES))
+    post_args_parse.add_argument('interval', type=_validate_interval, default=1, help='{error_msg}')
+    post_args_parse.add_argument('start_date', type=ExpenseResource._validate_date, required=True,
+                                 help='Start date is required')
+    post_args_parse.add_argument('time', type=ExpenseResource._validate_time, help='{error_msg}')
+    post_args_parse.add_argument('end_date', type=ExpenseResource._validate_date, help='{error_msg}')
+
+    @jwt_required()
+    def get(self, recurring_expense_id=None):
+        user_id = get_jwt_identity()
+
+        recurring_expenses = RecurringExpense.query.filter_by(user_id=user_id)
+        if recurring_expense_id and (recurring_expense := recurring_expenses.filter_by(id=recurring_expense_id)
+                                     .first()):
+            return marshal(recurring_expense, RECURRING_EXPENSE_FIELDS)
+
+        elif not recurring_expense_id:
+            return marshal(recurring_expenses.order_by(RecurringExpense.next_timestamp).all(),
+                           RECURRING_EXPENSE_FIELDS)
+
+        else:
+            return {'error': 'Recurring expense does not exist or does not belong to user'}, 404
+
+    @jwt_required()
+    @req_parser(post_args_parse, nested={'shares': ExpenseResource.shares_args_parse})
+    def post(self, parsed_args, recurring_expense_id=None):
+        user_id = get_jwt_identity()
+
+        # occurrences are at the start time (midnight by default), the schedule ends at the end of the end date
+        parsed_args.start_timestamp = datetime.combine(parsed_args.start_date, parsed_args.time or time())
+        parsed_args.end_timestamp = datetime.combine(parsed_args.end_date, time.max).replace(microsecond=0) \
+            if parsed_args.end_date else None
+        del parsed_args['start_date'], parsed_args['time'], parsed_args['end_date']
+
+        if parsed_args.end_timestamp and parsed_args.end_timestamp < parsed_args.start_timestamp:
+            return {'message': {'end_date': 'End date cannot be before the start date'}}, 400
+
+        parsed_args.shares = list(map(dict, parsed_args.shares))
+
+        # occurrences are in the user currency unless given
+        if not parsed_args.currency:
+            del parsed_args['currency']
+
+        # shares permission check
+        unallowed_shares_user_ids = {s['user_id'] for s in parsed_args.shares} \
+            .difference(share_permissions.allowed_user_ids(user_id))
+        if unallowed_shares_user_ids:
+            unallowed_shares_user_ids = ', '.join(map(str, unallowed_shares_user_ids))
+            return {'message':
+                    {'shares': f'User is not allowed to share expenses with user(s): {unallowed_shares_user_ids}'}}, 400
+
+        # check if the category exists and belong to user
+        if category_cache.category(user_id, parsed_args.category, active=True):
+            parsed_args.category_id = parsed_args.pop('category')
+
+        else:
+            return {'message':
+                    {'category': 'Category is disabled, does not exist or does not belong to user'}}, 400
+
+        response_code = None
+        if recurring_expense_id:
+            if not (recurring_expense := RecurringExpense.query.filter_by(id=recurring_expense_id, user_id=user_id,
+                                                                          active=True).first()):
+                return {'error': 'Recurring expense does not exist or does not belong to user'}, 404
+
+            schedule = ('frequency', 'interval', 'start_timestamp')
+            if any(parsed_args[arg] != getattr(recurring_expense, arg) for arg in schedule):
+                return {'message':
+                        {'frequency': 'Cannot change the schedule of a recurring expense'}}, 400
+
+            # changes apply to the next occurrences, ending before the next occurrence finishes the schedule
+            list(map(lambda arg: setattr(recurring_expense, arg, parsed_args[arg]), parsed_args))
+            if recurring_expense.end_timestamp and recurring_expense.end_timestamp < recurring_expense.next_timestamp:
+                recurring_expense.active = False
+
+        else:
+            response_code = 201
+
+            recurring_expense = RecurringExpense(**parsed_args, next_timestamp=parsed_args.start_timestamp,
+                                                 user_id=user_id)
+            db.session.add(recurring_expense)
+
+        db.session.commit()
+
+        return marshal(recurring_expense, RECURRING_EXPENSE_FIELDS), response_code
+
+    @jwt_required()
+    def delete(self, recurring_expense_id):
+        user_id = get_jwt_identity()
+
+        # removed recurring expenses are deactivated, their materialized expenses are kept
+        if recurring_expense := RecurringExpense.query.filter_by(id=recurring_expense_id, user_id=user_id).first():
+            recurring_expense.active = False
+            db.session.commit()
+
+            return marshal(recurring_expense, RECURRING_EXPENSE_FIELDS)
+
+        else:
+            return {'error': 'Recurring expense does not exist or does not belong to user'}, 404
+
+
+api.add_resource(RecurringExpenseResource, '/recurring-expense/', '/recurring-expense/<int:recurring_expense_id>/')
+
+
+@job_queue.task('recurring_expenses', every=15 * 60)
+def handle_recurring_expenses():
+    # due occurrences of every user are inserted in batches, each batch committed with its recurring expenses
+    # advanced so the occurrences are inserted once (missed ones and the ones over the run limit are caught up on
+    # the next run)
+    now = datetime.now()
+    batch_size, max_occurrences = (current_app.config['RECURRING_EXPENSES_BATCH_SIZE'],
+                                   current_app.config['RECURRING_EXPENSES_MAX_OCCURRENCES'])
+    for shard in shard_router.shards:
+        db.session.info['shard'] = shard
+        occurrences = 0
+        while occurrences < max_occurrences and \
+                (materialized := RecurringExpense.materialize(db.session, now,
+                                                              min(batch_size, max_occurrences - occurrences))):
+            db.session.commit()
+
+            occurrences += (added := sum(map(len, materialized.values())))
+            logger.info(f'Recurring expenses occurrences added on shard {shard}: {added}')
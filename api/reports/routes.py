@@ -0,0 +1,283 @@
+from flask import Blueprint, current_app, send_file
+from flask_restful import Resource, reqparse, marshal, fields
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.sql import func, select, cast, null, bindparam, union_all
+
+import os
+import logging
+from datetime import datetime, date, time, timedelta
+
+from app import api, job_queue, shard_router
+from models import db, Report, Expense, ArchivedExpense, ExpenseSummary, Category, Balance
+from api.expense.routes import ExpenseResource
+from commons.reports import REPORT_FORMATS
+from commons.decorators.reqparser import req_parser
+
+
+logger = logging.getLogger(__name__)
+
+reports_blueprint = Blueprint('reports', __name__)
+
+REPORT_FIELDS = {
+    'id': fields.String,
+    'format': fields.String,
+    'parameters': fields.Raw,
+    'status': fields.String,
+    'progress': fields.Integer,
+    'rows': fields.Integer,
+    'error': fields.String,
+    'created_timestamp': fields.DateTime(dt_format='iso8601'),
+    'finished_timestamp': fields.DateTime(dt_format='iso8601'),
+    'expires_timestamp': fields.DateTime(dt_format='iso8601'),
+    'download_url': fields.String(attribute=lambda report: api.url_for(ReportDownloadResource, report_id=report.id)
+                                  if report.status == 'done' else None)
+}
+
+# read only core statements of the report sections, each section is a single query streamed to the report file
+expense_table, archived_expense_table, category_table = \
+    Expense.__table__, ArchivedExpense.__table__, Category.__table__
+
+# categories monthly amounts in the user currency, archived expenses amounts come from their monthly summaries
+report_amounts = ExpenseSummary.user_amounts()
+report_month = func.date_trunc('month', report_amounts.c.timestamp)
+CATEGORIES_SECTION_STATEMENT = select(category_table.c.name,
+                                      report_month.label('month'),
+                                      func.sum(report_amounts.c.amount).label('amount')) \
+    .select_from(report_amounts.join(category_table, report_amounts.c.category_id == category_table.c.id)) \
+    .group_by(category_table.c.id, category_table.c.name, report_month) \
+    .order_by(category_table.c.name, report_month)
+
+
+def user_expenses_statement(table, parent_id):
+    return select(table.c.id,
+                  table.c.timestamp,
+                  table.c.description,
+                  table.c.category_id,
+                  table.c.amount,
+                  table.c.currency,
+                  table.c.paid,
+                  parent_id.label('parent_id')) \
+        .where(table.c.user_id == bindparam('user_id'),
+               table.c.timestamp >= bindparam('start_date'),
+               table.c.timestamp <= bindparam('end_date'))
+
+
+# expenses listing, archived expenses included
+report_expenses = union_all(user_expenses_statement(expense_table, expense_table.c.parent_id),
+                            user_expenses_statement(archived_expense_table, cast(null(), db.BigInteger))) \
+    .subquery('report_expenses')
+EXPENSES_SECTION_STATEMENT = select(report_expenses.c.id,
+                                    report_expenses.c.timestamp,
+                                    report_expenses.c.description,
+                                    category_table.c.name,
+                                    report_expenses.c.amount,
+                                    report_expenses.c.currency,
+                                    report_expenses.c.paid,
+                                    report_expenses.c.parent_id) \
+    .select_from(report_expenses.outerjoin(category_table, report_expenses.c.category_id == category_table.c.id)) \
+    .order_by(report_expenses.c.timestamp, report_expenses.c.id)
+
+
+def _section_rows(statement):
+    def rows(user_id, start_date, end_date):
+        return db.session.execute(statement.execution_options(yield_per=current_app.config['REPORTS_BATCH_SIZE']),
+                                  ExpenseSummary.user_amounts_params(user_id, start_date, end_date))
+
+    return rows
+
+
+def _balances_rows(user_id, start_date, end_date):
+    # current balances (not limited to the report dates)
+    return ((balance['user_id'], balance['username'], balance['amount'])
+            for balance in Balance.get_user_balances(user_id))
+
+
+# columns and rows function of each section
+REPORT_SECTIONS = {
+    'categories': (('category', 'month', 'amount'), _section_rows(CATEGORIES_SECTION_STATEMENT)),
+    'balances': (('user_id', 'username', 'amount'), _balances_rows),
+    'expenses': (('id', 'timestamp', 'description', 'category', 'amount', 'currency', 'paid', 'parent_id'),
+                 _section_rows(EXPENSES_SECTION_STATEMENT))
+}
+
+
+def _report_path(report):
+    return os.path.join(current_app.config['REPORTS_DIRECTORY'], report.file_name)
+
+
+def _remove_report_file(report):
+    for path in (_report_path(report), f'{_report_path(report)}.tmp'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ReportsResource(Resource):
+
+    post_args_parse = reqparse.RequestParser(bundle_errors=True)
+    post_args_parse.add_argument('start_date', type=ExpenseResource._validate_date, required=True,
+                                 help='Start date is required')
+    post_args_parse.add_argument('end_date', type=ExpenseResource._validate_date, required=True,
+                                 help='End date is required')
+    post_args_parse.add_argument('sections', type=str, action='append', choices=tuple(REPORT_SECTIONS),
+                                 help='Invalid section')
+    post_args_parse.add_argument('format', type=str, choices=tuple(REPORT_FORMATS), default='csv',
+                                 help='Invalid format')
+
+    @jwt_required()
+    def get(self):
+        user_id = get_jwt_identity()
+
+        return marshal(Report.query
+                       .filter_by(user_id=user_id)
+                       .order_by(Report.created_timestamp.desc())
+                       .all(), REPORT_FIELDS)
+
+    @jwt_required()
+    @req_parser(post_args_parse)
+    def post(self, parsed_args):
+        user_id = get_jwt_identity()
+
+        if parsed_args.end_date < parsed_args.start_date:
+            return {'message': {'end_date': 'End date must be after start date'}}, 400
+
+        if (parsed_args.end_date - parsed_args.start_date).days >= \
+                (max_days := current_app.config['MAX_DATE_RANGE_DAYS']):
+            return {'message': {'end_date': f'Date range cannot exceed {max_days} days'}}, 400
+
+        if Report.query.filter(Report.user_id == user_id, Report.status.in_(('pending', 'running'))).count() >= \
+                current_app.config['REPORTS_MAX_PENDING']:
+            return {'error': 'Too many reports in progress, try again later'}, 429, \
+                {'Retry-After': current_app.config['ADMISSION_RETRY_AFTER']}
+
+        report = Report(user_id=user_id,
+                        format=parsed_args.format,
+                        parameters={
+                            'start_date': parsed_args.start_date.isoformat(),
+                            'end_date': parsed_args.end_date.isoformat(),
+                            'sections': list(dict.fromkeys(parsed_args.sections or REPORT_SECTIONS))
+                        })
+        db.session.add(report)
+        db.session.flush()  # get the report id for the report job
+
+        # reports are generated in background, clients poll the report status
+        job_queue.enqueue('report', primary=True, report_id=report.id)
+        db.session.commit()
+
+        return marshal(report, REPORT_FIELDS), 202, {'Location': api.url_for(ReportResource, report_id=report.id)}
+
+
+api.add_resource(ReportsResource, '/reports/')
+
+
+class ReportResource(Resource):
+
+    @jwt_required()
+    def get(self, report_id):
+        user_id = get_jwt_identity()
+
+        if report := Report.query.filter_by(id=report_id, user_id=user_id).first():
+            return marshal(report, REPORT_FIELDS)
+
+        return {'error': 'Report does not exist or does not belong to user'}, 404
+
+    @jwt_required()
+    def delete(self, report_id):
+        user_id = get_jwt_identity()
+
+        if report := Report.query.filter_by(id=report_id, user_id=user_id).first():
+            _remove_report_file(report)
+            db.session.delete(report)
+            db.session.commit()
+
+            return marshal(report, REPORT_FIELDS)
+
+        return {'error': 'Report does not exist or does not belong to user'}, 404
+
+
+api.add_resource(ReportResource, '/reports/<string:report_id>/')
+
+
+class ReportDownloadResource(Resource):
+
+    @jwt_required()
+    def get(self, report_id):
+        user_id = get_jwt_identity()
+
+        if not (report := Report.query.filter_by(id=report_id, user_id=user_id).first()):
+            return {'error': 'Report does not exist or does not belong to user'}, 404
+
+        if report.status != 'done':
+            return {'error': 'Report is not ready'}, 409
+
+        if not os.path.exists(path := _report_path(report)):
+            return {'error': 'Report has expired'}, 404
+
+        _, mimetype = REPORT_FORMATS[report.format]
+        return send_file(path,
+                         mimetype=mimetype,
+                         as_attachment=True,
+                         download_name=f'report-{report.parameters["start_date"]}-{report.parameters["end_date"]}'
+                                       f'.{report.format}')
+
+
+api.add_resource(ReportDownloadResource, '/reports/<string:report_id>/download/')
+
+
+@job_queue.task('report')
+def handle_report(report_id):
+    if not (report := db.session.get(Report, report_id)):
+        logger.warning(f'Report {report_id} no longer exists')
+        return
+
+    # the report sections are read from the user shard
+    shard_router.route(db.session, report.user_id)
+    report.status, report.progress, report.rows, report.error = 'running', 0, 0, None
+    db.session.commit()
+
+    parameters = report.parameters
+    start_date = datetime.combine(date.fromisoformat(parameters['start_date']), time.min)
+    end_date = datetime.combine(date.fromisoformat(parameters['end_date']), time.max)
+
+    os.makedirs(current_app.config['REPORTS_DIRECTORY'], exist_ok=True)
+    path, rows = _report_path(report), 0
+    try:
+        # written to a temporary file, the report file only exists when complete
+        with open(f'{path}.tmp', 'w', newline='', encoding='utf-8') as file:
+            writer_class, _ = REPORT_FORMATS[report.format]
+            writer = writer_class(file, f'Expenses report {parameters["start_date"]} - {parameters["end_date"]}',
+                                  parameters)
+
+            for index, section in enumerate(parameters['sections'], 1):
+                columns, section_rows = REPORT_SECTIONS[section]
+                writer.section(section, columns)
+                for row in section_rows(report.user_id, start_date, end_date):
+                    writer.row(row)
+                    rows += 1
+
+                # progress is committed between sections (committing ends the streamed query)
+                report.progress, report.rows = index * 100 // len(parameters['sections']), rows
+                db.session.commit()
+
+            writer.close()
+
+        os.replace(f'{path}.tmp', path)
+
+    except Exception as report_error:
+        db.session.rollback()
+        _remove_report_file(report)
+
+        report.status, report.error = 'failed', str(report_error)[:255]
+        report.finished_timestamp = datetime.now()
+        report.expires_timestamp = report.finished_timestamp + timedelta(seconds=current_app.config['REPORTS_TTL'])
+        db.session.commit()
+        raise
+
+    report.status, report.finished_timestamp = 'done', datetime.now()
+    report.expires_timestamp = report.finished_timestamp + timedelta(seconds=current_app.config['REPORTS_TTL'])
+
+
+@job_queue.task('reports_expire', every=60 * 60)
+def handle_reports_expire():
+    for report in Report.query.filter(Report.expires_timestamp < datetime.now()):
+        _remove_report_file(report)
+        db.session.delete(report)
@@ -1,13 +1,17 @@
-from flask import Blueprint
+from flask import Blueprint, request
 from flask_restful import Resource, reqparse, marshal, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
 
 import logging
 
-from app import api
+from app import api, job_queue, identity_cache, shard_router, exchange_rates, rate_limiter, user_availability
 from models import db, User
+from api.expense.routes import ExpenseResource
+from commons.passwords import PasswordHasherBusy
 from commons.decorators.reqparser import req_parser
+from commons.decorators.ratelimit import rate_limit
 
 
 logger = logging.getLogger(__name__)
@@ -19,6 +23,7 @@ USER_FIELDS = {
     'email': fields.String,
     'username': fields.String,
     'active': fields.Boolean,
+    'currency': fields.String,
     'created_timestamp': fields.DateTime(dt_format='iso8601'),
     'updated_timestamp': fields.DateTime(dt_format='iso8601')
 }
@@ -31,12 +36,14 @@ class UserResource(Resource):
     post_args_parse.add_argument('username', type=str, required=True, help='Username is required')
     post_args_parse.add_argument('password', type=str, required=True, help='Password is required')
     post_args_parse.add_argument('active', type=bool)
+    post_args_parse.add_argument('currency', type=ExpenseResource._validate_currency, help='{error_msg}')
 
     patch_args_parse = reqparse.RequestParser(bundle_errors=True)
     patch_args_parse.add_argument('email', type=str)
     patch_args_parse.add_argument('username', type=str)
     patch_args_parse.add_argument('password', type=str)
     patch_args_parse.add_argument('active', type=bool)
+    patch_args_parse.add_argument('currency', type=ExpenseResource._validate_currency, help='{error_msg}')
 
     @jwt_required()
     def get(self, user_id=None):
@@ -73,6 +80,7 @@ class UserResource(Resource):
         if user := User.query.filter_by(id=user_id).first():
             user.active = False
             db.session.commit()
+            identity_cache.invalidate(user_id)
 
             return marshal(user, USER_FIELDS)
 
@@ -82,18 +90,32 @@ class UserResource(Resource):
     @staticmethod
     def _post_patch_handler(parsed_args, user_id):
         response_code = None
-        if user_id and (user := User.query.filter_by(id=user_id).first()):
-            # set user object property if property has a value
-            list(map(lambda arg: setattr(user, arg, parsed_args[arg]) if parsed_args[arg] else True, parsed_args))
+        try:
+            if user_id and (user := User.query.filter_by(id=user_id).first()):
+                # set user object property if property has a value
+                list(map(lambda arg: setattr(user, arg, parsed_args[arg]) if parsed_args[arg] else True, parsed_args))
 
-        elif not user_id:
-            response_code = 201
+                # amounts are shown in the user currency (cached by every process)
+                if inspect(user).attrs.currency.history.has_changes():
+                    exchange_rates.user_currency_changed(db.session, user_id)
 
-            user = User(**parsed_args)
-            db.session.add(user)
+            elif not user_id:
+                response_code = 201
 
-        else:
-            return {'error': 'The user does not exist'}, 404
+                user = User(**parsed_args)
+                db.session.add(user)
+
+            else:
+                return {'error': 'The user does not exist'}, 404
+
+            # new usernames and emails are taken in every process availability filter
+            if not user_id or parsed_args.username or parsed_args.email:
+                user_availability.user_changed(db.session, user)
+
+        except PasswordHasherBusy as password_hasher_busy:
+            db.session.rollback()
+            logger.warning('User change rejected:', exc_info=password_hasher_busy)
+            return {'error': 'Server is busy, try again later'}, 503, {'Retry-After': 1}
 
         try:
             db.session.commit()
@@ -102,7 +124,35 @@ class UserResource(Resource):
             logger.error('Attempt to create user with existing email or username:', exc_info=integrity_error)
             return {'error': 'Email or username already exists'}
 
+        if user_id:
+            identity_cache.invalidate(user_id)
+
         return marshal(user, USER_FIELDS), response_code
 
 
 api.add_resource(UserResource, '/user/', '/user/<int:user_id>/')
+
+
+class UserAvailabilityResource(Resource):
+
+    get_args_parse = reqparse.RequestParser()
+    get_args_parse.add_argument('username', type=str, location='args')
+    get_args_parse.add_argument('email', type=str, location='args')
+
+    # checked while typing, limited by ip as the login
+    @rate_limit(rate_limiter, 'user-availability', 'USER_AVAILABILITY_RATE_LIMIT', lambda: request.remote_addr)
+    @req_parser(get_args_parse)
+    def get(self, parsed_args):
+        if not (values := {field: value for field, value in parsed_args.items() if value and value.strip()}):
+            return {'message': {'username': 'Username or email is required'}}, 400
+
+        return {field: user_availability.is_available(field, value) for field, value in values.items()}
+
+
+api.add_resource(UserAvailabilityResource, '/user/availability/')
+
+
+@job_queue.task('user_shard_move')
+def handle_user_shard_move(user_id, shard):
+    # users sharing expenses are moved to the same shard (see _colocate_shared_users)
+    shard_router.move(user_id, shard)
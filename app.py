@@ -9,22 +9,82 @@ from flask_cors import CORS
 from flask_restful import Api
 
 from config import Config
+from commons.jobs import JobQueue
+from commons.autocomplete import DescriptionIndexes
+from commons.passwords import PasswordHasher
+from commons.ratelimit import RateLimiter
+from commons.admission import AdmissionController
+from commons.identity import IdentityCache
+from commons.share_permissions import SharePermissions
+from commons.pubsub import PubSub
+from commons.category_cache import CategoryCache
+from commons.exchange_rates import ExchangeRates
+from commons.availability import UserAvailability
+from commons.events import EventBroker
+from commons.shards import ShardRouter, ShardSession
+from commons.asgi import AsgiAdapter
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
-# db
-db = SQLAlchemy()
+# db (sessions route the users data to the users shards)
+db = SQLAlchemy(session_options={'class_': ShardSession})
 migrate = Migrate()
 
 # jwt
 jwt = JWTManager()
 jwt.invalid_token_loader(lambda *_: ({'token': 'Token is invalid'}, 400))
 jwt.expired_token_loader(lambda *_: ({'token': 'Token has expired'}, 401))
+jwt.revoked_token_loader(lambda *_: ({'token': 'Token has been revoked'}, 401))
+jwt.user_lookup_error_loader(lambda *_: ({'token': 'User is disabled or does not exist'}, 401))
+
+# jwt identities (active users) and refresh tokens revocations
+identity_cache = IdentityCache()
+jwt.user_lookup_loader(lambda *args: identity_cache.load_user(*args))
+jwt.token_in_blocklist_loader(lambda *args: identity_cache.is_revoked(*args))
+
+# passwords hashing
+password_hasher = PasswordHasher()
+
+# rate limiting
+rate_limiter = RateLimiter()
+
+# admission control of the expensive endpoints
+admission_controller = AdmissionController()
 
 # cors
 cors = CORS()
 
+# background jobs
+job_queue = JobQueue()
+
+# cross process notifications
+pubsub = PubSub()
+
+# users database shards
+shard_router = ShardRouter()
+
+# asgi serving mode (see asgi.py)
+asgi_adapter = AsgiAdapter()
+
+# categories cache
+category_cache = CategoryCache()
+
+# currencies exchange rates
+exchange_rates = ExchangeRates()
+
+# usernames and emails availability
+user_availability = UserAvailability()
+
+# users data change events
+event_broker = EventBroker()
+
+# expenses descriptions autocomplete
+description_indexes = DescriptionIndexes()
+
+# expenses share permissions
+share_permissions = SharePermissions()
+
 # api
 api = Api()
 
@@ -33,16 +93,56 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # init users shards (before db, shards are database binds)
+    shard_router.init_app(app, db, pubsub)
+
+    # init asgi serving mode
+    asgi_adapter.init_app(app)
+
     # init db
     db.init_app(app)
     migrate.init_app(app, db)
 
     # init jwt
     jwt.init_app(app)
+    identity_cache.init_app(app)
+
+    # init passwords hashing
+    password_hasher.init_app(app)
+
+    # init rate limiting
+    rate_limiter.init_app(app)
+
+    # init admission control
+    admission_controller.init_app(app, db)
 
     # init cors
     cors.init_app(app, resources={r'*': {'origins': '*'}})
 
+    # init background jobs
+    job_queue.init_app(app, db)
+
+    # init cross process notifications
+    pubsub.init_app(app, db)
+
+    # init categories cache
+    category_cache.init_app(app, pubsub)
+
+    # init exchange rates
+    exchange_rates.init_app(app, db, pubsub, shard_router)
+
+    # init usernames and emails availability
+    user_availability.init_app(app, db, pubsub)
+
+    # init users data change events
+    event_broker.init_app(app, pubsub)
+
+    # init autocomplete
+    description_indexes.init_app(app)
+
+    # init share permissions
+    share_permissions.init_app(app, pubsub)
+
     # url converters
     from commons.url_converters import DatetimeConverter
     app.url_map.converters['datetime'] = DatetimeConverter
@@ -54,11 +154,20 @@ def create_app(config_class=Config):
 
     app.app_context().push()
     db.create_all()
+    shard_router.create_all()
 
     return app
 
 
+def start_workers():
+    # background jobs workers and notifications listener, started by the serving entry points only (cli commands
+    # like the database migrations import the app too)
+    job_queue.start()
+    pubsub.start()
+
+
 created_app = create_app()
 
 if __name__ == '__main__':
+    start_workers()
     created_app.run()
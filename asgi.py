@@ -0,0 +1,13 @@
+# asgi serving entry point: the io bound endpoints requests wait on the database (asyncpg, aiosqlite), password
+# hashing and event streams on the event loop instead of holding a thread (see commons/asgi.py), with the background
+# jobs workers and notifications listener
+#
+#   uvicorn --workers 4 asgi:application
+from app import asgi_adapter as application, start_workers
+
+start_workers()
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(application)
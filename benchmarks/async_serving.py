@@ -0,0 +1,209 @@
+# concurrency and memory per in-flight request of the sync (gunicorn threads) and asgi (uvicorn) serving modes, a
+# worker process each with the database behind a proxy adding a network latency to its responses:
+# - an io bound read (an expense) served to a growing number of concurrent clients
+# - event streams held open (requests in flight until the client leaves), the streams served and their memory
+# postgres only, gunicorn and uvicorn packages
+#
+#   DATABASE_URL=postgresql://localhost/benchmarks python -m benchmarks.async_serving
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+import subprocess
+from datetime import datetime
+from statistics import median, quantiles
+
+import psutil
+from flask_jwt_extended import create_access_token
+from sqlalchemy import make_url
+
+from benchmarks.common import app, client, db, reset_database
+from models import Category, Expense
+
+LATENCY = 0.05
+CONNECTIONS = 64
+CLIENTS = (16, 64, 256)
+STREAMS = 500
+DURATION = 10
+PROXY_PORT = 6543
+SERVER_PORT = 8049
+MODES = {
+    'wsgi, 16 threads': ['gunicorn', '--worker-class', 'gthread', '--threads', '16', '--bind', f':{SERVER_PORT}',
+                         '--log-level', 'warning', 'wsgi:created_app'],
+    'wsgi, 256 threads': ['gunicorn', '--worker-class', 'gthread', '--threads', '256', '--bind', f':{SERVER_PORT}',
+                          '--log-level', 'warning', 'wsgi:created_app'],
+    'asgi': ['uvicorn', '--port', str(SERVER_PORT), '--log-level', 'warning', 'asgi:application']
+}
+
+reset_database()
+client.post('/api/user/', json={'email': 'user@benchmarks.local', 'username': 'user', 'password': 'password'})
+db.session.execute(db.insert(Category), [{'user_id': 1, 'name': 'category', 'background_color': '#ff0000',
+                                          'text_color': '#ffffff', 'limit': 1000}])
+expense_id = db.session.execute(db.insert(Expense).returning(Expense.id), {
+    'user_id': 1, 'category_id': 1, 'description': 'expense', 'timestamp': datetime.now(), 'amount': 10,
+    'currency': 'EUR'}).scalar()
+db.session.commit()
+token = create_access_token(identity=1)
+request = f'GET /api/expense/{expense_id}/ HTTP/1.1\r\nHost: localhost\r\n' \
+          f'Authorization: Bearer {token}\r\n\r\n'.encode()
+stream_request = f'GET /api/events/?jwt={token} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode()
+
+
+async def delayed_copy(reader, writer, delay):
+    # chunks are written in order, each one delay after it was read
+    chunks = asyncio.Queue()
+
+    async def write():
+        while (chunk := await chunks.get()) is not None:
+            await asyncio.sleep(chunk[0] - time.monotonic())
+            writer.write(chunk[1])
+            await writer.drain()
+
+        writer.close()
+
+    writing = asyncio.ensure_future(write())
+    while data := await reader.read(65536):
+        await chunks.put((time.monotonic() + delay, data))
+
+    await chunks.put(None)
+    await writing
+
+
+async def proxy(url):
+    # database responses are delayed by the latency, as a database on another host
+    database_url = make_url(url)
+    host, port = database_url.query.get('host') or database_url.host or 'localhost', database_url.port or 5432
+
+    async def connect(client_reader, client_writer):
+        if host.startswith('/'):
+            database_reader, database_writer = await asyncio.open_unix_connection(f'{host}/.s.PGSQL.{port}')
+
+        else:
+            database_reader, database_writer = await asyncio.open_connection(host, port)
+
+        await asyncio.gather(delayed_copy(client_reader, database_writer, 0),
+                             delayed_copy(database_reader, client_writer, LATENCY), return_exceptions=True)
+
+    server = await asyncio.start_server(connect, '127.0.0.1', PROXY_PORT)
+    await server.serve_forever()
+
+
+async def load(clients, duration):
+    # clients on keep alive connections, requests latencies (seconds) and failed requests
+    latencies, failed, stop = list(), 0, time.monotonic() + duration
+
+    async def run_client():
+        nonlocal failed
+        reader, writer = await asyncio.open_connection('127.0.0.1', SERVER_PORT)
+        while time.monotonic() < stop:
+            start = time.monotonic()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int(next(line.split(b':')[1] for line in head.lower().split(b'\r\n')
+                              if line.startswith(b'content-length')))
+            await reader.readexactly(length)
+
+            if head.startswith(b'HTTP/1.1 200'):
+                latencies.append(time.monotonic() - start)
+
+            else:
+                failed += 1
+
+        writer.close()
+
+    await asyncio.gather(*[run_client() for _ in range(clients)])
+    return latencies, failed
+
+
+async def hold_streams(streams, timeout, process):
+    # streams served (response started) within the timeout, memory and threads while they are open
+    connections = [await asyncio.open_connection('127.0.0.1', SERVER_PORT) for _ in range(streams)]
+    for _, writer in connections:
+        writer.write(stream_request)
+
+    async def started(reader):
+        try:
+            return (await asyncio.wait_for(reader.readline(), timeout)).startswith(b'HTTP/1.1 200')
+
+        except asyncio.TimeoutError:
+            return False
+
+    served = sum(await asyncio.gather(*[started(reader) for reader, _ in connections]))
+    rss, threads = memory(process)
+
+    for _, writer in connections:
+        writer.close()
+
+    return served, rss, threads
+
+
+def memory(process):
+    # resident memory (bytes) and threads of the server processes (master and worker)
+    processes = [process, *process.children(recursive=True)]
+    return sum(each.memory_info().rss for each in processes), sum(each.num_threads() for each in processes)
+
+
+def serve(command):
+    environment = {**os.environ,
+                   'DATABASE_URL': make_url(os.environ['DATABASE_URL'])
+                   .set(host='127.0.0.1', port=PROXY_PORT, query={}).render_as_string(hide_password=False),
+                   'DATABASE_POOL_SIZE': str(CONNECTIONS),
+                   'DATABASE_MAX_OVERFLOW': '0',
+                   'EVENTS_MAX_SUBSCRIPTIONS': str(STREAMS)}
+    server = subprocess.Popen([sys.executable, '-m', *command], env=environment, stdout=subprocess.DEVNULL)
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', SERVER_PORT)).close()
+            return server
+
+        except ConnectionRefusedError:
+            time.sleep(0.5)
+
+
+threading.Thread(target=asyncio.run, args=(proxy(app.config['SQLALCHEMY_DATABASE_URI']),), daemon=True).start()
+
+reads, streams = list(), list()
+for mode, command in MODES.items():
+    server = serve(command)
+    process = psutil.Process(server.pid)
+    try:
+        # warmed up (connections pool, caches), the idle memory is the baseline
+        asyncio.run(load(CONNECTIONS, 2))
+        idle_rss, _ = memory(process)
+
+        for clients in CLIENTS:
+            peak = [0, 0]
+
+            def sample(stopped):
+                while not stopped.wait(0.2):
+                    peak[:] = map(max, peak, memory(process))
+
+            sampling = threading.Event()
+            threading.Thread(target=sample, args=(sampling,), daemon=True).start()
+            latencies, failed = asyncio.run(load(clients, DURATION))
+            sampling.set()
+
+            rss, threads = peak
+            reads.append(f'{mode:<18} {clients:>7} {len(latencies) / DURATION:>10.1f} '
+                         f'{median(latencies) * 1000:>9.1f} {quantiles(latencies, n=100)[98] * 1000:>9.1f} '
+                         f'{failed:>6} {rss / 2 ** 20:>8.1f} {threads:>7}')
+
+        served, rss, threads = asyncio.run(hold_streams(STREAMS, 5, process))
+        streams.append(f'{mode:<18} {served:>7} {rss / 2 ** 20:>8.1f} {threads:>7} '
+                       f'{max(rss - idle_rss, 0) / max(served, 1) / 1024:>17.1f}')
+
+    finally:
+        server.terminate()
+        server.wait()
+
+print(f'{db.engine.dialect.name} with {LATENCY * 1000:.0f}ms latency, {CONNECTIONS} database connections, '
+      f'one worker process, {os.cpu_count()} cpus')
+print(f'\nexpense read, {DURATION}s per run')
+print(f'{"mode":<18} {"clients":>7} {"requests/s":>10} {"p50 (ms)":>9} {"p99 (ms)":>9} {"failed":>6} '
+      f'{"rss (MB)":>8} {"threads":>7}')
+print('\n'.join(reads))
+print(f'\n{STREAMS} event streams opened, served within 5s')
+print(f'{"mode":<18} {"served":>7} {"rss (MB)":>8} {"threads":>7} {"kB per stream":>17}')
+print('\n'.join(streams))
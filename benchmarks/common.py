@@ -0,0 +1,28 @@
+# benchmarks setup: the application on a scratch database (its tables are dropped and created again by each
+# benchmark), run from the repository root:
+#
+#   DATABASE_URL=postgresql://localhost/benchmarks python -m benchmarks.<benchmark>
+import os
+import time
+from secrets import token_hex
+
+os.environ.setdefault('SECRET_KEY', token_hex(32))
+
+from app import created_app as app, db  # imported after the configuration
+
+client = app.test_client()
+
+
+def reset_database():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def cpu_time(f, number):
+    # mean process cpu time of a call (all threads), in microseconds
+    start = time.process_time()
+    for _ in range(number):
+        f()
+
+    return (time.process_time() - start) / number * 1e6
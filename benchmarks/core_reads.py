@@ -0,0 +1,81 @@
+# per request cpu time of the chart and datatable reads on the core statements (plain rows) and on the equivalent
+# orm entity queries the endpoints ran before (same sql shape and data). the session is removed after each read, as
+# at the end of a request, and the database time is not counted (process cpu time)
+#
+#   DATABASE_URL=postgresql://localhost/benchmarks python -m benchmarks.core_reads
+from datetime import datetime, timedelta
+
+from sqlalchemy import desc, func
+
+from benchmarks.common import client, cpu_time, db, reset_database
+from models import Category, Expense, ExpenseSummary
+from api.charts.routes import CATEGORIES_CHART_STATEMENT
+from api.datatables.routes import CATEGORIES_STATEMENT, FAVORITES_STATEMENT
+
+CATEGORIES = 20
+EXPENSES = 10000
+FAVORITES = 50
+NUMBER = 500
+
+reset_database()
+client.post('/api/user/', json={'email': 'user@benchmarks.local', 'username': 'user', 'password': 'password'})
+user_id = 1
+
+now = datetime.now()
+db.session.execute(db.insert(Category), [{'user_id': user_id,
+                                           'name': f'category {index}',
+                                           'background_color': '#ff0000',
+                                           'text_color': '#ffffff',
+                                           'limit': 1000} for index in range(CATEGORIES)])
+db.session.execute(db.insert(Expense), [{'user_id': user_id,
+                                         'category_id': index % CATEGORIES + 1,
+                                         'description': f'expense {index}',
+                                         'timestamp': now - timedelta(minutes=index * 50),
+                                         'amount': index % 100 + 0.5,
+                                         'currency': 'EUR',
+                                         'is_favorite': index < FAVORITES,
+                                         'favorite_order': index if index < FAVORITES else None}
+                                        for index in range(EXPENSES)])
+db.session.commit()
+
+chart_params = ExpenseSummary.user_amounts_params(user_id, now - timedelta(days=365), now)
+amounts = ExpenseSummary.user_amounts()
+
+
+def read(f):
+    def request():
+        f()
+        db.session.remove()
+
+    return request
+
+
+reads = {
+    'categories datatable': (
+        read(lambda: [(category.name, category.color, category.limit)
+                      for category in Category.query.filter_by(user_id=user_id)]),
+        read(lambda: db.session.execute(CATEGORIES_STATEMENT, {'user_id': user_id}).all())),
+    'categories chart': (
+        read(lambda: [(category.name, category.color, total_amount)
+                      for category, total_amount in db.session.query(Category,
+                                                                     func.sum(amounts.c.amount).label('total_amount'))
+                      .select_from(amounts.join(Category, amounts.c.category_id == Category.id))
+                      .group_by(Category.id)
+                      .order_by(desc('total_amount'))
+                      .params(chart_params)]),
+        read(lambda: db.session.execute(CATEGORIES_CHART_STATEMENT, chart_params).all())),
+    # the category of each favorite is loaded through the relationship, as the favorites fields did
+    'favorites datatable': (
+        read(lambda: [(expense.description, expense.amount, expense.currency, expense.favorite_order,
+                       expense.category.color)
+                      for expense in Expense.query.filter_by(user_id=user_id, is_favorite=True)
+                      .join(Category, Expense.category_id == Category.id)]),
+        read(lambda: db.session.execute(FAVORITES_STATEMENT, {'user_id': user_id}).all()))
+}
+
+print(f'{db.engine.dialect.name}, {CATEGORIES} categories, {EXPENSES} expenses, {FAVORITES} favorites')
+print(f'{"read":<22} {"orm (us)":>9} {"core (us)":>10} {"speedup":>8}')
+for name, (orm_read, core_read) in reads.items():
+    orm_read(), core_read()
+    orm_time, core_time = cpu_time(orm_read, NUMBER), cpu_time(core_read, NUMBER)
+    print(f'{name:<22} {orm_time:>9.1f} {core_time:>10.1f} {orm_time / core_time:>7.1f}x')
@@ -0,0 +1,106 @@
+# expenses range queries latency as the expense table grows, unpartitioned and partitioned by month (the migrations
+# run with EXPENSE_PARTITION_INTERVAL=month). bigger tables span more months, the queries read the last month: the
+# categories chart of a user and the month total of every user. postgres only
+#
+#   DATABASE_URL=postgresql://localhost/benchmarks python -m benchmarks.expense_partitions
+import time
+from datetime import datetime, timedelta
+from statistics import median
+
+from flask_migrate import stamp, upgrade
+from sqlalchemy import text
+
+from benchmarks.common import app, db, reset_database
+from models import Expense, ExpenseSummary
+from api.charts.routes import CATEGORIES_CHART_STATEMENT
+from commons.partitions import partition_start
+
+USERS = 1000
+MONTH_EXPENSES = 40000
+MONTHS = (3, 12, 48)
+NUMBER = 50
+
+expense_table = Expense.__table__
+MONTH_TOTAL_STATEMENT = db.select(db.func.count(), db.func.sum(expense_table.c.amount)) \
+    .where(expense_table.c.timestamp >= db.bindparam('start_date'),
+           expense_table.c.timestamp < db.bindparam('end_date'))
+
+
+def seed(months):
+    reset_database()
+    db.session.execute(text('INSERT INTO "user" (email, username, password, currency, active) '
+                            "SELECT 'user' || i || '@benchmarks.local', 'user' || i, 'unused', 'EUR', true "
+                            'FROM generate_series(1, :users) i'), {'users': USERS})
+    db.session.execute(text('INSERT INTO category (user_id, name, "limit", color, text_color, active) '
+                            "SELECT i, 'category', 100000, '#ff0000', '#ffffff', true "
+                            'FROM generate_series(1, :users) i'),
+                       {'users': USERS})
+
+    # expenses spread evenly over the months up to now (amounts in cents)
+    db.session.execute(text('INSERT INTO expense (user_id, category_id, description, timestamp, amount, currency, '
+                            'paid, is_favorite) '
+                            "SELECT i % :users + 1, i % :users + 1, 'expense ' || i, "
+                            "now() - i::float / :expenses * (:months * interval '30 days'), i % 10000, 'EUR', "
+                            'true, false '
+                            'FROM generate_series(1, :expenses) i'),
+                       {'users': USERS, 'months': months, 'expenses': months * MONTH_EXPENSES})
+    db.session.commit()
+    analyze()
+
+
+def partition():
+    # the partitioning migration moves the expenses to the monthly partitions
+    db.session.remove()
+    app.config['EXPENSE_PARTITION_INTERVAL'] = 'month'
+    stamp(directory='migrations', revision='base')
+    upgrade(directory='migrations')
+    app.config['EXPENSE_PARTITION_INTERVAL'] = ''
+    analyze()
+
+
+def analyze():
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('VACUUM ANALYZE')
+
+
+def latency(statement, params):
+    # median latency in milliseconds
+    times = list()
+    for _ in range(NUMBER):
+        start = time.perf_counter()
+        db.session.execute(statement, params).all()
+        times.append((time.perf_counter() - start) * 1e3)
+        db.session.remove()
+
+    return median(times)
+
+
+def scanned_tables(statement, params):
+    # expense tables (partitions) in the query plan
+    compiled = statement.compile(db.engine)
+    with db.engine.connect() as connection:
+        plan = connection.exec_driver_sql(f'EXPLAIN {compiled}', compiled.construct_params(params)).scalars().all()
+
+    return sum(' on expense' in line for line in plan)
+
+
+month_end = partition_start(datetime.now(), 'month')
+month_start = partition_start(month_end - timedelta(days=1), 'month')
+queries = {
+    'user categories chart': (CATEGORIES_CHART_STATEMENT,
+                              ExpenseSummary.user_amounts_params(USERS // 2, month_start, month_end)),
+    'month total': (MONTH_TOTAL_STATEMENT, {'start_date': month_start, 'end_date': month_end})
+}
+
+print(f'{db.engine.dialect.name}, {USERS} users, {MONTH_EXPENSES} expenses per month, '
+      f'queries of {month_start:%Y-%m}, median of {NUMBER} runs')
+print(f'{"expenses":>9} {"table":<14} {"query":<22} {"latency (ms)":>13} {"tables scanned":>15}')
+for months in MONTHS:
+    seed(months)
+    for layout in ('unpartitioned', 'partitioned'):
+        if layout == 'partitioned':
+            partition()
+
+        for name, (statement, params) in queries.items():
+            print(f'{months * MONTH_EXPENSES:>9} {layout:<14} {name:<22} {latency(statement, params):>13.2f} '
+                  f'{scanned_tables(statement, params):>15}')
@@ -0,0 +1,48 @@
+# login throughput for each password hashing method: logins per second of process cpu time (the throughput of a
+# core, hashing dominates the login) and logins per second with concurrent clients (bounded by the password hasher
+# workers, the other request threads are not pinned)
+#
+#   DATABASE_URL=sqlite:////tmp/benchmarks.db python -m benchmarks.login [method ...]
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import app, client, reset_database
+from app import password_hasher
+from commons.passwords import argon2
+
+METHODS = sys.argv[1:] or ['pbkdf2:sha256', 'scrypt:32768:8:1'] + (['argon2'] if argon2 else [])
+LOGINS = 40
+CLIENTS = 8
+
+reset_database()
+
+# rate limits off, queue large enough for every client
+app.config.update(LOGIN_IP_RATE_LIMIT='1000000/60', LOGIN_ACCOUNT_RATE_LIMIT='1000000/60',
+                  PASSWORD_HASH_QUEUE_SIZE=CLIENTS)
+
+print(f'cpus: {os.cpu_count()}, password hasher workers: {app.config["PASSWORD_HASH_WORKERS"]}, '
+      f'clients: {CLIENTS}, logins: {LOGINS}')
+print(f'{"method":<24} {"cpu per login (ms)":>19} {"logins/cpu s":>13} {"logins/s":>9} {"failed":>7}')
+for index, method in enumerate(METHODS):
+    app.config['PASSWORD_HASH_METHOD'] = method
+    password_hasher.init_app(app)
+
+    username = f'user{index}'
+    client.post('/api/user/', json={'email': f'{username}@benchmarks.local', 'username': username,
+                                    'password': 'password'})
+
+    def login(_):
+        return app.test_client().post('/api/auth/token/', json={'username': username,
+                                                                'password': 'password'}).status_code
+
+    login(None)
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(CLIENTS) as executor:
+        statuses = list(executor.map(login, range(LOGINS)))
+
+    wall_time, cpu_time = time.perf_counter() - start, time.process_time() - cpu_start
+    print(f'{method:<24} {cpu_time / LOGINS * 1e3:>19.1f} {LOGINS / cpu_time:>13.1f} {LOGINS / wall_time:>9.1f} '
+          f'{sum(status != 200 for status in statuses):>7}')
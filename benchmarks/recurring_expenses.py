@@ -0,0 +1,45 @@
+# materialization of a month of recurring expenses: monthly recurring expenses of many users, each due once in
+# the last month, materialized by the recurring expenses job (batches of RECURRING_EXPENSES_BATCH_SIZE), then a
+# second run with nothing due
+#
+#   DATABASE_URL=postgresql://localhost/benchmarks python -m benchmarks.recurring_expenses
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import app, db, reset_database
+from models import User, RecurringExpense, Expense
+from api.recurring.routes import handle_recurring_expenses
+
+USERS = 1000
+RECURRING_EXPENSES = 100000
+
+reset_database()
+app.config['RECURRING_EXPENSES_MAX_OCCURRENCES'] = RECURRING_EXPENSES
+
+db.session.execute(db.insert(User), [{'email': f'user{index}@benchmarks.local', 'username': f'user{index}',
+                                      'password_hash': 'unused', 'currency': 'EUR'} for index in range(USERS)])
+
+# start timestamps spread over the last 28 days (a single occurrence due)
+now = datetime.now()
+db.session.execute(db.insert(RecurringExpense), [{
+    'user_id': index % USERS + 1,
+    'description': f'recurring expense {index}',
+    'amount': 10,
+    'currency': 'EUR',
+    'shares': [],
+    'frequency': 'monthly',
+    'start_timestamp': (start_timestamp := now - timedelta(seconds=index * 28 * 24 * 3600 // RECURRING_EXPENSES)),
+    'next_timestamp': start_timestamp
+} for index in range(RECURRING_EXPENSES)])
+db.session.commit()
+
+print(f'{db.engine.dialect.name}, {RECURRING_EXPENSES} recurring expenses of {USERS} users, '
+      f'batch size {app.config["RECURRING_EXPENSES_BATCH_SIZE"]}')
+for run in ('first run', 'second run'):
+    start = time.perf_counter()
+    handle_recurring_expenses()
+    run_time = time.perf_counter() - start
+
+    expenses = db.session.scalar(db.select(db.func.count(Expense.id)))
+    db.session.remove()
+    print(f'{run}: {run_time:.2f}s, {expenses} expenses')
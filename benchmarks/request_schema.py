@@ -0,0 +1,33 @@
+# expense body validation time with reqparse (the body parser, then the shares parser once per share) and with the
+# compiled request schema (single pass), for bodies without shares, with a single share and with batches of shares
+#
+#   python -m benchmarks.request_schema
+from types import SimpleNamespace
+
+from benchmarks.common import app, cpu_time
+from api.expense.routes import ExpenseResource
+from commons.request_schema import RequestSchema
+
+NUMBER = 2000
+
+schema = RequestSchema(ExpenseResource.post_args_parse, {'shares': ExpenseResource.shares_args_parse},
+                       reject_empty_required=True)
+
+
+def reqparse_validation():
+    parsed_args = ExpenseResource.post_args_parse.parse_args(strict=True)
+    for share in parsed_args.shares or list():
+        ExpenseResource.shares_args_parse.parse_args(SimpleNamespace(json=share))
+
+
+def schema_validation():
+    schema.parse(strict=True)
+
+
+print(f'{"shares":>6} {"reqparse (us)":>14} {"schema (us)":>12} {"speedup":>8}')
+for shares in (0, 1, 20, 100):
+    body = {'description': 'lunch', 'category': 1, 'date': '2026-10-01', 'time': '12:00:00', 'amount': 20,
+            'shares': [{'user_id': user_id, 'amount': 1} for user_id in range(2, shares + 2)]}
+    with app.test_request_context('/api/expense/', method='POST', json=body):
+        reqparse_time, schema_time = cpu_time(reqparse_validation, NUMBER), cpu_time(schema_validation, NUMBER)
+        print(f'{shares:>6} {reqparse_time:>14.1f} {schema_time:>12.1f} {reqparse_time / schema_time:>7.1f}x')
@@ -0,0 +1,171 @@
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from commons.asgi import wait
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_admission_limit(limit):
+    # "<concurrent requests>/<waiting requests>"
+    concurrency, queue_size = limit.split('/')
+    return int(concurrency), int(queue_size)
+
+
+class Bulkhead:
+    # at most concurrency requests running, the next queue_size requests wait for a free slot (up to a timeout)
+    # and the others are rejected right away
+
+    def __init__(self, concurrency, queue_size):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.running = 0
+
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self, timeout):
+        with self._lock:
+            if self.running < self.concurrency and not self._waiters:
+                self.running += 1
+                return True
+
+            if len(self._waiters) >= self.queue_size:
+                return False
+
+            self._waiters.append(waiter := Future())
+
+        # released slots are handed over to the waiting requests in order (see release), the asgi requests wait on
+        # the event loop
+        try:
+            wait(waiter, timeout)
+            return True
+
+        except TimeoutError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    return False
+
+            # handed over while timing out (unless cancelled by the timeout first)
+            return not waiter.cancelled()
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                if (waiter := self._waiters.popleft()).set_running_or_notify_cancel():
+                    waiter.set_result(True)
+                    return
+
+            self.running -= 1
+
+
+class AdmissionController:
+    # per process concurrency limits of the expensive endpoints (each endpoint its own bulkhead) and of each user
+    # requests, with a statement timeout for the queries of the admitted requests (postgres)
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+
+        self._app = None
+        self._bulkheads = dict()
+        self._users = Counter()
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.db = db or self.db
+
+        app.config.setdefault('ADMISSION_QUEUE_TIMEOUT', 2)
+        app.config.setdefault('ADMISSION_USER_CONCURRENCY', 2)
+        app.config.setdefault('ADMISSION_RETRY_AFTER', 1)
+        app.config.setdefault('ADMISSION_STATEMENT_TIMEOUT', 5000)
+
+        self._app = app
+        event.listen(Session, 'after_begin', self._set_statement_timeout)
+
+        app.extensions['admission_controller'] = self
+
+    @contextmanager
+    def admit(self, name, limit, user_id=None):
+        config = self._app.config
+        user_key = (name, user_id)
+        with self._lock:
+            if user_id is not None and self._users[user_key] >= config['ADMISSION_USER_CONCURRENCY']:
+                raise AdmissionRejected('Too many concurrent requests, try again later', 429,
+                                        config['ADMISSION_RETRY_AFTER'])
+
+            self._users[user_key] += 1
+            # bulkheads are created on the first request (and again if the configured limit changes)
+            if (bulkhead := self._bulkheads.get((name, limit))) is None:
+                bulkhead = self._bulkheads[name, limit] = Bulkhead(*parse_admission_limit(limit))
+
+        try:
+            if not bulkhead.acquire(config['ADMISSION_QUEUE_TIMEOUT']):
+                raise AdmissionRejected('Server is busy, try again later', 503, config['ADMISSION_RETRY_AFTER'])
+
+            try:
+                yield
+
+            finally:
+                bulkhead.release()
+
+        finally:
+            with self._lock:
+                if not (count := self._users[user_key] - 1):
+                    del self._users[user_key]
+
+                else:
+                    self._users[user_key] = count
+
+    @contextmanager
+    def statement_timeout(self, session):
+        if not (timeout := self._app.config['ADMISSION_STATEMENT_TIMEOUT']):
+            yield
+            return
+
+        # transactions begun from now on set the timeout (see _set_statement_timeout), the transaction already
+        # begun (the jwt identity lookup) is set here on the postgres binds the request uses: the primary database
+        # and the session shard (each can be a different backend)
+        session.info['statement_timeout'] = timeout
+        if session.in_transaction():
+            shard_router = self._app.extensions['shard_router']
+            for bind in {self.db.engine, shard_router.engine(shard_router.session_shard(session))}:
+                if bind.dialect.name == 'postgresql':
+                    session.execute(text(f'SET LOCAL statement_timeout = {int(timeout)}'),
+                                    bind_arguments={'bind': bind})
+
+        try:
+            yield
+
+        finally:
+            # read only requests: the transaction is ended, so the timeout is not kept by the next requests
+            del session.info['statement_timeout']
+            session.rollback()
+
+    @staticmethod
+    def _set_statement_timeout(session, transaction, connection):
+        if (timeout := session.info.get('statement_timeout')) and connection.dialect.name == 'postgresql':
+            connection.execute(text(f'SET LOCAL statement_timeout = {int(timeout)}'))
+
+    @staticmethod
+    def is_statement_timeout(error):
+        # postgres query_canceled error
+        return getattr(getattr(error, 'orig', None), 'pgcode', None) == '57014'
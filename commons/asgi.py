@@ -0,0 +1,183 @@
+import io
+import sys
+import asyncio
+import threading
+from contextvars import ContextVar
+from concurrent.futures import TimeoutError
+
+from sqlalchemy.util import await_only, greenlet_spawn
+
+# async drivers of the databases dialects (asyncpg and aiosqlite packages)
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+# set while a request of the asgi application is running (in a greenlet of the event loop)
+_serving = ContextVar('asgi_serving', default=False)
+
+
+def serving_async():
+    return _serving.get()
+
+
+def wait(future, timeout=None):
+    # waits for a concurrent future (executors, other threads): on the event loop for the asgi requests, so the
+    # other requests keep running
+    if not serving_async():
+        return future.result(timeout)
+
+    try:
+        return await_only(asyncio.wait_for(asyncio.wrap_future(future), timeout))
+
+    except asyncio.TimeoutError:
+        raise TimeoutError()
+
+
+class _RequestBody(io.RawIOBase):
+    # request body received from the asgi server as the application reads it (uploads are not buffered whole)
+
+    def __init__(self, receive):
+        self.complete = False
+
+        self._receive = receive
+        self._chunk = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and not self.complete:
+            message = await_only(self._receive())
+            self._chunk = message.get('body', b'')
+            self.complete = message['type'] == 'http.disconnect' or not message.get('more_body', False)
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size], self._chunk = self._chunk[:size], self._chunk[size:]
+        return size
+
+
+# asgi serving mode for the io bound endpoints: each request runs the flask application in a greenlet of the event
+# loop (sqlalchemy greenlet_spawn, as the asyncio sessions do), its sessions use the async drivers engines (asyncpg,
+# aiosqlite) and the database, password hashing and event streams waits are awaited on the event loop. the resources
+# and extensions are the same as the sync mode, the background jobs and notifications threads keep the sync engines
+class AsgiAdapter:
+
+    def __init__(self, app=None):
+        self._app = None
+        self._engines = dict()
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+
+        app.extensions['asgi_adapter'] = self
+
+    def bind(self, engine):
+        # the async twin of the engine (same database, pool options) for the asgi requests, binds already chosen
+        # (twins) are kept
+        if not serving_async() or engine.dialect.is_async:
+            return engine
+
+        with self._lock:
+            if (async_engine := self._engines.get(engine)) is None:
+                async_engine = self._engines[engine] = self._async_engine(engine)
+
+        return async_engine.sync_engine
+
+    def _async_engine(self, engine):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        if (driver := ASYNC_DRIVERS.get(dialect := engine.dialect.name)) is None:
+            raise RuntimeError(f'There is no async driver for {dialect} databases')
+
+        return create_async_engine(engine.url.set(drivername=f'{dialect}+{driver}'),
+                                   **self._app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while (await receive())['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            # the async engines connections belong to the event loop
+            for async_engine in self._engines.values():
+                await async_engine.dispose()
+
+            await send({'type': 'lifespan.shutdown.complete'})
+
+        elif scope['type'] == 'http':
+            await greenlet_spawn(self._handle, scope, receive, send)
+
+        else:
+            raise ValueError(f'Unsupported asgi scope type {scope["type"]}')
+
+    def _handle(self, scope, receive, send):
+        _serving.set(True)
+
+        body = _RequestBody(receive)
+        environ = self._environ(scope, io.BufferedReader(body))
+        response = dict()
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+        # an application context of its own (its database session), the process has one pushed by create_app
+        with self._app.app_context():
+            chunks = self._app(environ, start_response)
+            try:
+                await_only(send({'type': 'http.response.start', **response}))
+
+                # the asgi server does not fail the writes of disconnected clients, streams (server-sent events)
+                # stop on the disconnection message
+                while not body.complete:
+                    body.read(65536)
+
+                disconnect = asyncio.ensure_future(receive())
+                try:
+                    for chunk in chunks:
+                        if disconnect.done():
+                            break
+
+                        if chunk:
+                            await_only(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+
+                    await_only(send({'type': 'http.response.body'}))
+
+                finally:
+                    disconnect.cancel()
+
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+
+    @staticmethod
+    def _environ(scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+            'PATH_INFO': scope['path'].encode().decode('latin1'),
+            'QUERY_STRING': scope['query_string'].decode('latin1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+
+        # repeated headers are joined
+        for name, value in scope['headers']:
+            name, value = name.decode('latin1').upper().replace('-', '_'), value.decode('latin1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+
+        return environ
@@ -0,0 +1,123 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime
+
+from commons.cache import LRUCache
+
+
+class _Entry:
+
+    __slots__ = ('description', 'score', 'timestamp', 'categories')
+
+    def __init__(self, description):
+        self.description = description
+        self.score = 0.
+        self.timestamp = 0.
+        self.categories = Counter()
+
+
+class DescriptionIndex:
+    # sorted array of lower cased descriptions (prefix lookups with binary search), each one scored by
+    # frequency with an exponential decay by recency and counting the categories used with it
+
+    def __init__(self, half_life):
+        self.half_life = half_life
+
+        self._lock = threading.Lock()
+        self._keys = list()
+        self._entries = dict()
+
+    def _decay(self, elapsed):
+        return 0.5 ** (elapsed / self.half_life)
+
+    def add(self, description, category_id=None, timestamp=None, count=1):
+        if not description:
+            return
+
+        timestamp = (timestamp or datetime.now()).timestamp()
+        key = description.lower()
+        with self._lock:
+            if not (entry := self._entries.get(key)):
+                entry = self._entries[key] = _Entry(description)
+                insort(self._keys, key)
+
+            # scores are kept relative to the entry most recent timestamp
+            if timestamp >= entry.timestamp:
+                entry.score = entry.score * self._decay(timestamp - entry.timestamp) + count
+                entry.timestamp = timestamp
+                entry.description = description
+
+            else:
+                entry.score += count * self._decay(entry.timestamp - timestamp)
+
+            if category_id:
+                entry.categories[category_id] += count
+
+    def search(self, prefix, limit=10):
+        prefix = prefix.lower()
+        now = datetime.now().timestamp()
+        with self._lock:
+            start = bisect_left(self._keys, prefix)
+            end = bisect_left(self._keys, prefix + '\uffff', lo=start)
+
+            matches = heapq.nlargest(
+                limit,
+                (self._entries[key] for key in self._keys[start:end]),
+                key=lambda entry: entry.score * self._decay(max(now - entry.timestamp, 0)))
+
+            return [(entry.description, self._most_common(entry.categories)) for entry in matches]
+
+    @staticmethod
+    def _most_common(categories):
+        return categories.most_common(1)[0][0] if categories else None
+
+
+class DescriptionIndexes:
+    # per user description indexes, built from the database on first use and evicted by least recent use
+
+    def __init__(self, app=None):
+        self._indexes = None
+        self._half_life = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUTOCOMPLETE_MAX_USERS', 1000)
+        app.config.setdefault('AUTOCOMPLETE_TTL', 3600)
+        app.config.setdefault('AUTOCOMPLETE_HALF_LIFE_DAYS', 30)
+
+        self._indexes = LRUCache(app.config['AUTOCOMPLETE_MAX_USERS'], app.config['AUTOCOMPLETE_TTL'])
+        self._half_life = app.config['AUTOCOMPLETE_HALF_LIFE_DAYS'] * 24 * 60 * 60
+
+        app.extensions['description_indexes'] = self
+
+    def get(self, user_id):
+        return self._indexes.get_or_set(user_id, lambda: self._build(user_id))
+
+    def add(self, user_id, description, category_id=None, timestamp=None):
+        # only indexes already built are updated, the others will be built with the new description
+        if index := self._indexes.get(user_id):
+            index.add(description, category_id, timestamp)
+
+    def invalidate(self, user_id):
+        self._indexes.pop(user_id)
+
+    def _build(self, user_id):
+        from models import db, Expense
+
+        index = DescriptionIndex(self._half_life)
+        descriptions = Expense.query \
+            .filter(Expense.user_id == user_id) \
+            .with_entities(Expense.description,
+                           Expense.category_id,
+                           db.func.count(Expense.id),
+                           db.func.max(Expense.timestamp)) \
+            .group_by(Expense.description, Expense.category_id)
+
+        for description, category_id, count, timestamp in descriptions:
+            index.add(description, category_id, timestamp, count)
+
+        return index
@@ -0,0 +1,119 @@
+import math
+import hashlib
+import threading
+
+from sqlalchemy import select, func
+
+
+class BloomFilter:
+    # set membership without false negatives (false positives at the given rate up to the capacity), positions of
+    # each value from the two halves of a single blake2b digest (double hashing)
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+
+        self._bits = bytearray(math.ceil(self.size / 8))
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & 1 << (position & 7) for position in self._positions(value))
+
+
+class UserAvailability:
+    # usernames and emails availability (case insensitive) answered from a bloom filter of the existing ones, loaded
+    # on the first check and extended by notifications of the users created or changed in any process. only the
+    # possibly taken values are confirmed with the database (old values of changed users stay in the filter)
+
+    CHANNEL = 'user_names'
+    FIELDS = ('username', 'email')
+
+    def __init__(self, app=None, db=None, pubsub=None):
+        self.db = db
+        self.pubsub = pubsub
+
+        self._app = None
+        self._filter = None
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app, db, pubsub)
+
+    def init_app(self, app, db=None, pubsub=None):
+        self._app = app
+        self.db = db or self.db
+        self.pubsub = pubsub or self.pubsub
+
+        app.config.setdefault('USER_AVAILABILITY_CAPACITY', 1000000)
+        app.config.setdefault('USER_AVAILABILITY_ERROR_RATE', 0.01)
+
+        self.pubsub.subscribe(self.CHANNEL, self._add)
+
+        app.extensions['user_availability'] = self
+
+    def is_available(self, field, value):
+        if self._key(field, value) not in self._load():
+            return True
+
+        return not self.db.session.execute(select(self._exists(field, value.strip().lower()))).scalar()
+
+    def user_changed(self, session, user):
+        # published with the session transaction, so the values are added after commit
+        self.pubsub.publish(self.CHANNEL, [self._key(field, getattr(user, field)) for field in self.FIELDS], session,
+                            primary=True)
+
+    def _load(self):
+        if bloom_filter := self._filter:
+            return bloom_filter
+
+        from models import User
+
+        # notifications received while loading wait for the lock, so they are added to the loaded filter
+        with self._lock:
+            if not self._filter:
+                with self.db.engine.connect() as connection:
+                    # a username and an email of each user
+                    count = connection.execute(select(func.count(User.id))).scalar()
+                    bloom_filter = BloomFilter(2 * max(self._app.config['USER_AVAILABILITY_CAPACITY'], 2 * count),
+                                               self._app.config['USER_AVAILABILITY_ERROR_RATE'])
+
+                    for username, email in connection.execution_options(yield_per=10000) \
+                            .execute(select(User.username, User.email)):
+                        bloom_filter.add(self._key('username', username))
+                        bloom_filter.add(self._key('email', email))
+
+                self._filter = bloom_filter
+
+            return self._filter
+
+    def _add(self, keys):
+        with self._lock:
+            if bloom_filter := self._filter:
+                for key in keys:
+                    bloom_filter.add(key)
+
+                # over capacity the false positives rate grows, the filter is loaded again (twice the users)
+                if bloom_filter.count > bloom_filter.capacity:
+                    self._filter = None
+
+    @staticmethod
+    def _key(field, value):
+        return f'{field}:{value.strip().lower()}'
+
+    @staticmethod
+    def _exists(field, value):
+        from models import User
+
+        return select(User.id).where(func.lower(getattr(User, field)) == value).exists()
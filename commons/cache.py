@@ -0,0 +1,61 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            if (entry := self._entries.get(key, _MISSING)) is _MISSING:
+                return default
+
+            expires, value = entry
+            if expires and expires < time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+
+            # evict the least recently used entries
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, factory, ttl=None):
+        if (value := self.get(key, _MISSING)) is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            _, value = self._entries.pop(key, (None, default))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_MISSING = object()
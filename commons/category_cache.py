@@ -0,0 +1,63 @@
+from commons.cache import LRUCache
+
+
+class CachedCategory:
+
+    __slots__ = ('id', 'name', 'limit', 'color', 'text_color', 'active')
+
+    def __init__(self, category):
+        for attribute in self.__slots__:
+            setattr(self, attribute, getattr(category, attribute))
+
+
+class CategoryCache:
+    # per user categories ({id: CachedCategory}) loaded once and used to validate and serialize expenses categories,
+    # invalidated in every process by a notification published when the user categories change
+
+    CHANNEL = 'categories'
+
+    def __init__(self, app=None, pubsub=None):
+        self.pubsub = pubsub
+        self._categories = None
+
+        if app:
+            self.init_app(app, pubsub)
+
+    def init_app(self, app, pubsub=None):
+        self.pubsub = pubsub or self.pubsub
+
+        app.config.setdefault('CATEGORY_CACHE_MAX_USERS', 10000)
+        app.config.setdefault('CATEGORY_CACHE_TTL', 3600)
+
+        self._categories = LRUCache(app.config['CATEGORY_CACHE_MAX_USERS'], app.config['CATEGORY_CACHE_TTL'])
+        self.pubsub.subscribe(self.CHANNEL, self.invalidate)
+
+        app.extensions['category_cache'] = self
+
+    def get(self, user_id):
+        return self._categories.get_or_set(user_id, lambda: self._load(user_id))
+
+    def category(self, user_id, category_id, active=None):
+        if category_id is None:
+            return None
+
+        # categories unknown by this process (created by other process, not notified yet) reload the user categories
+        if (category := self.get(user_id).get(category_id)) is None:
+            self.invalidate(user_id)
+            category = self.get(user_id).get(category_id)
+
+        return category if category and (active is None or category.active == active) else None
+
+    def invalidate(self, user_id):
+        self._categories.pop(user_id)
+
+    def changed(self, session, user_id):
+        # published with the session transaction, so the categories are reloaded after commit
+        self.pubsub.publish(self.CHANNEL, user_id, session)
+
+    @staticmethod
+    def _load(user_id):
+        from models import Category
+
+        return {category.id: CachedCategory(category)
+                for category in Category.query.filter_by(user_id=user_id).order_by(Category.id)}
@@ -1,16 +1,23 @@
-from flask import request
-from sqlalchemy.sql import cast, desc, or_
+from flask import request, current_app
+from sqlalchemy.sql import cast, desc, or_, func, select, Select
 from sqlalchemy.sql.sqltypes import String
 
 from functools import wraps
 from types import SimpleNamespace
 
+from commons.money import Money
+
 
 def datatable_request_parser(default_ordered_column=None, default_order_direction=None):
     def decorator(f):
         @wraps(f)
         def inner(self, *args, **kwargs):
             page_length = request.args.get('length', 10, int)
+
+            # all records (negative length) and long pages are limited to the maximum page length, empty pages to a
+            # single record
+            max_page_length = current_app.config['DATATABLE_MAX_PAGE_LENGTH']
+            page_length = max_page_length if page_length < 0 else max(1, min(page_length, max_page_length))
             item_index_start = request.args.get('start', 0, int)
 
             if draw := request.args.get('draw', None, int):
@@ -21,7 +28,7 @@ def datatable_request_parser(default_ordered_column=None, default_order_directio
                 'draw': draw,
                 'ordered_column': request.args.get('order[0][column]', default_ordered_column, int),
                 'order_direction': request.args.get('order[0][dir]', default_order_direction, str),
-                'pagination_page': (item_index_start + page_length) / page_length if page_length > 0 else 1,
+                'pagination_page': (item_index_start + page_length) / page_length,
                 'page_length': page_length,
                 'item_start_index': item_index_start,
                 'search_value': request.args.get('search[value]', '', str)
@@ -42,7 +49,10 @@ def datatable_request_parser(default_ordered_column=None, default_order_directio
 
             self.datatable = SimpleNamespace(**datatable_data)
 
-            response = f(self, *args, **kwargs)
+            # error responses (tuples) are returned as they are
+            if not isinstance(response := f(self, *args, **kwargs), dict):
+                return response
+
             if 'draw' not in response:
                 response['draw'] = self.datatable.draw
 
@@ -63,8 +73,13 @@ class DatatableHandler:
 
     datatable = None
 
-    def handle_request(self, records):
-        return self.paginate_records(self.order_records(self.filter_records(records)))
+    def handle_request(self, records, params=None):
+        # records are orm queries or core select statements (executed with the params)
+        records = self.order_records(self.filter_records(records))
+        if isinstance(records, Select):
+            return self.paginate_statement(records, params)
+
+        return self.paginate_records(records)
 
     def filter_records(self, records):
         search_parameters = list()
@@ -74,6 +89,10 @@ class DatatableHandler:
                 if getattr(self.datatable, f'column_{i}_searchable'):
                     database_column = self.COLUMNS[i]
 
+                    # amounts are searched as shown, not as the stored cents
+                    if isinstance(getattr(database_column, 'type', None), Money):
+                        database_column = Money.decimal(database_column)
+
                     search_parameters.append(cast(database_column, String).contains(self.datatable.search_value))
 
             return records.filter(or_(*search_parameters))
@@ -92,9 +111,15 @@ class DatatableHandler:
         return records
 
     def paginate_records(self, records):
-        records_count = records.count()
-        if self.datatable.page_length < 0:  # user wants to see all records
-            self.datatable.page_length = records_count
-
         return records.paginate(page=self.datatable.pagination_page, per_page=self.datatable.page_length)
 
+    def paginate_statement(self, statement, params=None):
+        from models import db
+
+        records_count = db.session.execute(select(func.count()).select_from(statement.order_by(None).subquery()),
+                                           params).scalar()
+        items = db.session.execute(statement
+                                   .limit(self.datatable.page_length)
+                                   .offset(self.datatable.item_start_index), params).all()
+
+        return SimpleNamespace(items=items, total=records_count)
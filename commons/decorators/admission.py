@@ -0,0 +1,30 @@
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from functools import wraps
+
+from commons.admission import AdmissionRejected
+
+
+def admission_control(admission_controller, name, limit, key=None):
+    # limit is the configuration name of the "<concurrent>/<waiting>" limit, key the function returning the user key
+    def decorator(f):
+        @wraps(f)
+        def inner(self, *args, **kwargs):
+            try:
+                with admission_controller.admit(name, current_app.config[limit], key() if key else None), \
+                        admission_controller.statement_timeout(admission_controller.db.session()):
+                    return f(self, *args, **kwargs)
+
+            except AdmissionRejected as rejected:
+                return {'error': str(rejected)}, rejected.status, {'Retry-After': rejected.retry_after}
+
+            except OperationalError as operational_error:
+                if not admission_controller.is_statement_timeout(operational_error):
+                    raise
+
+                return {'error': 'Request took too long, try again later'}, 503, \
+                    {'Retry-After': current_app.config['ADMISSION_RETRY_AFTER']}
+
+        return inner
+    return decorator
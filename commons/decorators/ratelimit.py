@@ -0,0 +1,20 @@
+from flask import current_app
+
+from math import ceil
+from functools import wraps
+
+
+def rate_limit(rate_limiter, name, limit, key, message='Too many requests, try again later'):
+    # limit is the configuration name of the "<requests>/<seconds>" limit, key the function returning the request key
+    def decorator(f):
+        @wraps(f)
+        def inner(self, *args, **kwargs):
+            if (request_key := key()) is not None:
+                allowed, retry_after = rate_limiter.hit(name, request_key, current_app.config[limit])
+                if not allowed:
+                    return {'error': message}, 429, {'Retry-After': ceil(retry_after)}
+
+            return f(self, *args, **kwargs)
+
+        return inner
+    return decorator
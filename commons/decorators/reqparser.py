@@ -3,13 +3,20 @@ from flask import request
 from functools import wraps
 from types import SimpleNamespace
 
+from commons.request_schema import RequestSchema
 
-def req_parser(request_parser, strict=True):
+
+def req_parser(request_parser, strict=True, nested=None):
     def decorator(f):
+        # the request parser is compiled once per resource method (nested parsers are validated in the same pass)
+        schema = RequestSchema(request_parser, nested, reject_empty_required=True)
+
         @wraps(f)
         def inner(self, *args, **kwargs):
-            if request.data or request.args:  # bad request on empty request ArgParse workaround
-                parsed_args = request_parser.parse_args(strict=strict)
+            # bad request on empty request ArgParse workaround
+            if request.data or request.args or request.form or request.files:
+                parsed_args = schema.parse(strict=strict) if schema.compilable \
+                    else request_parser.parse_args(strict=strict)
 
                 # empty values ArgParse workaround
                 errors = dict()
@@ -20,6 +27,12 @@ def req_parser(request_parser, strict=True):
                 if errors:
                     return {'message': errors}, 400
 
+            elif schema.compilable:
+                # empty request body workaround (validate as an empty body and use arguments default values)
+                parsed_args = schema.parse(req=SimpleNamespace(**{'is_json': False, 'values': None, 'args': None,
+                                                                  'form': None, 'files': None}),
+                                           strict=strict)
+
             else:
                 # empty request body workaround
                 # (make requests_parser assume a request with an empty json body and use arguments default values)
@@ -0,0 +1,149 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError
+
+from commons.asgi import wait
+
+
+class EventSubscription:
+
+    def __init__(self, user_id, buffer_size):
+        self.user_id = user_id
+        self.overflowed = False
+
+        self._events = queue.Queue(buffer_size)
+        self._waiter = None
+
+    def put(self, events):
+        # slow clients are not waited for: once the buffer is full the events are dropped and the client is told
+        # to resynchronize (delta sync endpoint)
+        for event in events:
+            try:
+                self._events.put_nowait(event)
+
+            except queue.Full:
+                self.overflowed = True
+                break
+
+        # the waiting stream is woken once (the waiter can be cancelled by its timeout)
+        waiter, self._waiter = self._waiter, None
+        if waiter and waiter.set_running_or_notify_cancel():
+            waiter.set_result(None)
+
+    def get(self, timeout):
+        if self.overflowed:
+            self.overflowed = False
+            self._clear()
+            return {'type': 'resync'}
+
+        # the stream waits for the next put (on the event loop for the asgi requests), unless events were put
+        # while the waiter was set
+        self._waiter = Future()
+        try:
+            if self._events.empty():
+                wait(self._waiter, timeout)
+
+        except TimeoutError:
+            pass
+
+        finally:
+            self._waiter = None
+
+        try:
+            return self._events.get_nowait()
+
+        except queue.Empty:
+            return None
+
+    def _clear(self):
+        while True:
+            try:
+                self._events.get_nowait()
+
+            except queue.Empty:
+                return
+
+
+# per user data change events, published with the changes transaction through the cross process notifications and
+# delivered to the event streams (server-sent events) of the users connected to this process
+class EventBroker:
+
+    CHANNEL = 'events'
+
+    def __init__(self, app=None, pubsub=None):
+        self.pubsub = pubsub
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._count = 0
+
+        if app:
+            self.init_app(app, pubsub)
+
+    def init_app(self, app, pubsub=None):
+        self._app = app
+        self.pubsub = pubsub or self.pubsub
+
+        app.config.setdefault('EVENTS_BUFFER_SIZE', 100)
+        app.config.setdefault('EVENTS_HEARTBEAT_INTERVAL', 15)
+        app.config.setdefault('EVENTS_MAX_SUBSCRIPTIONS', 100)
+        app.config.setdefault('EVENTS_MAX_BATCH_SIZE', 50)
+
+        self.pubsub.subscribe(self.CHANNEL, self._deliver)
+
+        app.extensions['event_broker'] = self
+
+    def publish(self, session, user_id, events):
+        # big batches (imports) are notified as a single resync event, keeping the notifications small
+        if len(events) > self._app.config['EVENTS_MAX_BATCH_SIZE']:
+            events = [{'type': 'resync', 'sequence': max(event.get('sequence', 0) for event in events)}]
+
+        self.pubsub.publish(self.CHANNEL, {'user_id': user_id, 'events': events}, session)
+
+    def _deliver(self, notification):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(notification['user_id'], list()))
+
+        for subscription in subscriptions:
+            subscription.put(notification['events'])
+
+    def subscribe(self, user_id):
+        # returns None if this process has no more subscriptions available
+        with self._lock:
+            if self._count >= self._app.config['EVENTS_MAX_SUBSCRIPTIONS']:
+                return None
+
+            subscription = EventSubscription(user_id, self._app.config['EVENTS_BUFFER_SIZE'])
+            self._subscriptions[user_id].add(subscription)
+            self._count += 1
+
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in (subscriptions := self._subscriptions.get(subscription.user_id, set())):
+                subscriptions.discard(subscription)
+                self._count -= 1
+
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def stream(self, subscription):
+        # server-sent events with a heartbeat comment when there are no events (keeps proxies connections open)
+        heartbeat_interval = self._app.config['EVENTS_HEARTBEAT_INTERVAL']
+        try:
+            yield f'retry: {heartbeat_interval * 1000}\n\n'
+
+            while True:
+                if event := subscription.get(heartbeat_interval):
+                    event_id = f'id: {event["sequence"]}\n' if 'sequence' in event else ''
+                    yield f'{event_id}event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+
+                else:
+                    yield ': heartbeat\n\n'
+
+        finally:
+            self.unsubscribe(subscription)
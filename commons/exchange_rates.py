@@ -0,0 +1,140 @@
+import csv
+import click
+from datetime import date, datetime
+
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, tuple_
+
+from commons.cache import LRUCache
+
+
+class ExchangeRates:
+    # dated exchange rates (units of each currency per unit of the reference currency, the rate of a day is the
+    # last one published on or before it, or the first one after it for days before the currency rates). the same
+    # rate is used by python and sql (see ExchangeRate.rate_at), so any supported currency converts on any day.
+    # aggregates convert the amounts in sql (see ExchangeRate.converted), the
+    # single expense writes use the cached rate lookups of this process. users base currencies are cached too,
+    # both invalidated in every process by notifications
+
+    CHANNEL = 'exchange_rates'
+    USERS_CHANNEL = 'user_currencies'
+
+    def __init__(self, app=None, db=None, pubsub=None, shard_router=None):
+        self.db = db
+        self.pubsub = pubsub
+        self.shard_router = shard_router
+
+        self._rates = None
+        self._users = None
+
+        if app:
+            self.init_app(app, db, pubsub, shard_router)
+
+    def init_app(self, app, db=None, pubsub=None, shard_router=None):
+        self.db = db or self.db
+        self.pubsub = pubsub or self.pubsub
+        self.shard_router = shard_router or self.shard_router
+
+        app.config.setdefault('DEFAULT_CURRENCY', 'EUR')
+        app.config.setdefault('EXCHANGE_RATES_REFERENCE_CURRENCY', 'EUR')
+        app.config.setdefault('EXCHANGE_RATES_CACHE_SIZE', 10000)
+        app.config.setdefault('EXCHANGE_RATES_CACHE_TTL', 3600)
+
+        self._rates = LRUCache(app.config['EXCHANGE_RATES_CACHE_SIZE'], app.config['EXCHANGE_RATES_CACHE_TTL'])
+        self._users = LRUCache(app.config['EXCHANGE_RATES_CACHE_SIZE'], app.config['EXCHANGE_RATES_CACHE_TTL'])
+        self.pubsub.subscribe(self.CHANNEL, lambda _: self._rates.clear())
+        self.pubsub.subscribe(self.USERS_CHANNEL, self._users.pop)
+
+        app.cli.add_command(exchange_rates_cli)
+        app.extensions['exchange_rates'] = self
+
+    @property
+    def reference_currency(self):
+        return current_app.config['EXCHANGE_RATES_REFERENCE_CURRENCY']
+
+    def rate(self, currency, day):
+        # None when the currency has no rates
+        if currency == self.reference_currency:
+            return 1
+
+        day = day.date() if isinstance(day, datetime) else day
+        return self._rates.get_or_set((currency, day), lambda: self._lookup(currency, day))
+
+    def is_supported(self, currency, day=None):
+        return self.rate(currency, day or date.today()) is not None
+
+    def convert(self, amount, from_currency, to_currency, day=None):
+        if not amount or from_currency == to_currency:
+            return amount
+
+        day = day or date.today()
+        if (from_rate := self.rate(from_currency, day)) is None or (to_rate := self.rate(to_currency, day)) is None:
+            raise LookupError(f'There is no exchange rate from {from_currency} to {to_currency} on {day}')
+
+        return amount * to_rate / from_rate
+
+    def user_currency(self, user_id):
+        return self._users.get_or_set(int(user_id), lambda: self._user_currency(int(user_id)))
+
+    def user_currency_changed(self, session, user_id):
+        # published with the session transaction, so the user currency is reloaded after commit
+        self.pubsub.publish(self.USERS_CHANNEL, user_id, session, primary=True)
+
+    def load(self, rates):
+        # rates ({(currency, day): rate}) are written to the primary database and every shard (the aggregates join
+        # them with the users data), replacing the rates of the same days. returns the rates written
+        from models import ExchangeRate
+
+        exchange_rate_table = ExchangeRate.__table__
+        rows = [{'currency': currency, 'date': day, 'rate': rate} for (currency, day), rate in rates.items()
+                if currency != self.reference_currency]
+
+        for start in range(0, len(rows), 1000):
+            batch = rows[start:start + 1000]
+            for shard in self.shard_router.shards:
+                with self.shard_router.engine(shard).begin() as connection:
+                    connection.execute(exchange_rate_table.delete()
+                                       .where(tuple_(exchange_rate_table.c.currency, exchange_rate_table.c.date)
+                                              .in_([(row['currency'], row['date']) for row in batch])))
+                    connection.execute(exchange_rate_table.insert(), batch)
+
+        self.pubsub.publish(self.CHANNEL, len(rows), self.db.session, primary=True)
+        self.db.session.commit()
+
+        return len(rows)
+
+    def _lookup(self, currency, day):
+        from models import ExchangeRate
+
+        return self.db.session.execute(select(ExchangeRate.rate_at(currency, day))).scalar()
+
+    def _user_currency(self, user_id):
+        from models import User
+
+        # own connection, the lookup can happen while the session is flushing
+        with self.db.engine.connect() as connection:
+            return connection.execute(select(User.currency).where(User.id == user_id)).scalar() or \
+                current_app.config['DEFAULT_CURRENCY']
+
+
+exchange_rates_cli = AppGroup('exchange-rates', help='Currencies exchange rates.')
+
+
+@exchange_rates_cli.command('load', help='Load exchange rates from a csv file with currency, date and rate columns '
+                                         '(units of the currency per unit of the reference currency).')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+def load_command(file):
+    rates = dict()
+    for line, row in enumerate(csv.DictReader(file), 2):
+        try:
+            if (rate := float(row['rate'])) <= 0:
+                raise ValueError('rate must be greater than 0')
+
+            rates[row['currency'].strip().upper(), date.fromisoformat(row['date'].strip())] = rate
+
+        except (KeyError, AttributeError, ValueError) as row_error:
+            raise click.ClickException(f'Invalid exchange rate on line {line}: {row_error}')
+
+    loaded = current_app.extensions['exchange_rates'].load(rates)
+    click.echo(f'{loaded} exchange rates loaded')
@@ -0,0 +1,67 @@
+from flask_restful import fields as restful_fields
+from sqlalchemy.orm import load_only, noload
+
+from functools import lru_cache
+
+
+class Fieldset:
+    # sparse fieldsets of a marshal fields dictionary: the requested fields ("fields=id,amount,category.name") prune
+    # the serialized fields and the columns and relationships loaded by the query
+
+    def __init__(self, marshal_fields, columns, relationships=None):
+        # columns are the model columns of each field, relationships the loader options of each field (the
+        # relationships of the fields not requested are not loaded)
+        self.marshal_fields = marshal_fields
+        self.columns = columns
+        self.relationships = relationships or dict()
+
+        self.fields = lru_cache(maxsize=256)(self._fields)
+        self.options = lru_cache(maxsize=256)(self._options)
+
+    def parse(self, value):
+        # request argument type: comma separated fields, nested fields with a dot
+        requested = frozenset(field.strip() for field in value.split(',') if field.strip())
+        if unknown_fields := sorted(field for field in requested if not self._is_field(field)):
+            raise ValueError(f'Unknown fields: {", ".join(unknown_fields)}')
+
+        return requested
+
+    def _is_field(self, field):
+        name, _, nested_name = field.partition('.')
+        if not nested_name:
+            return name in self.marshal_fields
+
+        return isinstance(nested := self.marshal_fields.get(name), restful_fields.Nested) and \
+            nested_name in nested.nested
+
+    def _fields(self, requested=None):
+        if not requested:
+            return self.marshal_fields
+
+        marshal_fields = dict()
+        for name, field in self.marshal_fields.items():
+            nested_names = {field.partition('.')[2] for field in requested if field.startswith(f'{name}.')}
+            if name in requested:
+                marshal_fields[name] = field
+
+            elif nested_names:
+                marshal_fields[name] = restful_fields.Nested(
+                    {nested_name: nested_field for nested_name, nested_field in field.nested.items()
+                     if nested_name in nested_names},
+                    allow_null=field.allow_null,
+                    default=field.default,
+                    attribute=field.attribute)
+
+        return marshal_fields
+
+    def _options(self, requested=None):
+        names = {field.partition('.')[0] for field in requested} if requested else set(self.marshal_fields)
+
+        options = [load_only(*{column for name in names for column in self.columns.get(name, ())})] \
+            if requested else list()
+
+        return options + [option if name in names else noload(relationship)
+                          for name, (relationship, option) in self.relationships.items()]
+
+    def query(self, query, requested=None):
+        return query.options(*self.options(requested))
@@ -0,0 +1,80 @@
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from datetime import datetime
+
+from commons.cache import LRUCache
+
+
+class IdentityCache:
+    # short lived cache of the jwt identities state (active or not), so every jwt protected request checks the user
+    # without a database roundtrip. user changes invalidate the cache of this process, other processes see them
+    # after the ttl
+
+    def __init__(self, app=None):
+        self._identities = None
+        self._revoked_tokens = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JWT_IDENTITY_CACHE_SIZE', 10000)
+        app.config.setdefault('JWT_IDENTITY_CACHE_TTL', 30)
+
+        self._identities = LRUCache(app.config['JWT_IDENTITY_CACHE_SIZE'], app.config['JWT_IDENTITY_CACHE_TTL'])
+
+        # revoked refresh tokens already seen by this process (until they expire)
+        self._revoked_tokens = LRUCache(app.config['JWT_IDENTITY_CACHE_SIZE'])
+
+        app.extensions['identity_cache'] = self
+
+    def load_user(self, jwt_header, jwt_data):
+        # loaded users are the identities of active users, None (rejected token) otherwise
+        user_id = jwt_data[current_app.config['JWT_IDENTITY_CLAIM']]
+        return user_id if self._identities.get_or_set(user_id, lambda: self._is_active(user_id)) else None
+
+    def invalidate(self, user_id):
+        self._identities.pop(user_id)
+
+    @staticmethod
+    def _is_active(user_id):
+        from models import db, User
+
+        return bool(db.session.query(User.active).filter(User.id == user_id).scalar())
+
+    def is_revoked(self, jwt_header, jwt_data):
+        # only refresh tokens can be revoked, looked up by jti (primary key) when not known by this process
+        if jwt_data.get('type') != 'refresh':
+            return False
+
+        if (jti := jwt_data['jti']) in self._revoked_tokens:
+            return True
+
+        from models import db, RevokedToken
+
+        if revoked := (db.session.get(RevokedToken, jti) is not None):
+            self._revoked_tokens.set(jti, True, self._expires_in(jwt_data))
+
+        return revoked
+
+    def revoke(self, jwt_data):
+        # returns False if the token was already revoked (concurrent refreshes with the same token)
+        from models import db, RevokedToken
+
+        jti, expires = jwt_data['jti'], datetime.fromtimestamp(jwt_data['exp'])
+        try:
+            RevokedToken.query.filter(RevokedToken.expires < datetime.now()).delete()
+            db.session.add(RevokedToken(jti=jti, expires=expires))
+            db.session.commit()
+
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+        self._revoked_tokens.set(jti, True, self._expires_in(jwt_data))
+        return True
+
+    @staticmethod
+    def _expires_in(jwt_data):
+        return max(jwt_data['exp'] - datetime.now().timestamp(), 1)
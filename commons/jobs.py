@@ -0,0 +1,315 @@
+import time
+import random
+import logging
+import threading
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from statistics import median, quantiles
+
+from sqlalchemy import func, insert, select, update
+
+from commons.transaction import after_commit
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueMetrics:
+
+    def __init__(self, samples=1000):
+        self._lock = threading.Lock()
+        self._wait_times = deque(maxlen=samples)
+        self._run_times = deque(maxlen=samples)
+
+        self.enqueued = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def observe(self, wait_time, run_time):
+        with self._lock:
+            self._wait_times.append(wait_time)
+            self._run_times.append(run_time)
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return {'count': 0, 'p50': None, 'p95': None, 'max': None}
+
+        return {
+            'count': len(samples),
+            'p50': round(median(samples), 4),
+            # inclusive quantiles, the exclusive method extrapolates over the max with few samples
+            'p95': round(quantiles(samples, n=20, method='inclusive')[-1], 4) if len(samples) > 1 else
+            round(samples[0], 4),
+            'max': round(max(samples), 4)
+        }
+
+    def as_dict(self):
+        with self._lock:
+            wait_times, run_times = list(self._wait_times), list(self._run_times)
+
+            return {
+                'enqueued': self.enqueued,
+                'succeeded': self.succeeded,
+                'retried': self.retried,
+                'failed': self.failed,
+                'wait_time': self._summary(wait_times),
+                'run_time': self._summary(run_times)
+            }
+
+
+# durable job queue: jobs are rows of the job table written in the same transaction as the request data (on the
+# session shard), processed after commit by a pool of worker threads polling every shard, with retries and
+# exponential backoff
+class JobQueue:
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.tasks = dict()
+        self.periodic_tasks = dict()
+        self.metrics = JobQueueMetrics()
+
+        self._app = None
+        self._next_shard = 0
+        self._workers = list()
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+
+        if app:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self._app = app
+        self.db = db or self.db
+
+        app.config.setdefault('JOB_QUEUE_WORKERS', 2)
+        app.config.setdefault('JOB_QUEUE_POLL_INTERVAL', 1)
+        app.config.setdefault('JOB_QUEUE_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOB_QUEUE_RETRY_BACKOFF', 2)
+        app.config.setdefault('JOB_QUEUE_MAX_RETRY_BACKOFF', 300)
+        app.config.setdefault('JOB_QUEUE_STALE_TIMEOUT', 600)
+
+        app.extensions['job_queue'] = self
+
+    def task(self, name=None, max_attempts=None, every=None):
+        # periodic tasks (every seconds) are scheduled on start and again after each run
+        def decorator(f):
+            self.tasks[name or f.__name__] = (f, max_attempts)
+            if every:
+                self.periodic_tasks[name or f.__name__] = every
+
+            return f
+        return decorator
+
+    def enqueue(self, name, delay=0, primary=False, **payload):
+        # jobs of the users data are written on the session shard, jobs of global tables changes (primary) on the
+        # primary database. core insert, jobs can be enqueued while the session is flushing
+        from models import Job
+
+        if name not in self.tasks:
+            raise LookupError(f'There is no task registered with name {name}')
+
+        _, max_attempts = self.tasks[name]
+        self.db.session.execute(insert(Job).values(name=name,
+                                                   payload=payload,
+                                                   max_attempts=max_attempts or
+                                                   self._app.config['JOB_QUEUE_MAX_ATTEMPTS'],
+                                                   run_at=datetime.now() + timedelta(seconds=delay)),
+                                bind_arguments={'bind': self.db.engine} if primary else {'mapper': Job})
+
+        # the job is only visible to workers after the request transaction commits
+        after_commit(self.db.session, self.wakeup)
+        self.metrics.count('enqueued')
+
+    @property
+    def size(self):
+        return len(self._workers)
+
+    def wakeup(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def depth(self):
+        from models import Job
+
+        # own connections, the session shard is not changed
+        depth = dict()
+        for shard in (shard_router := self._app.extensions['shard_router']).shards:
+            with shard_router.engine(shard).connect() as connection:
+                for status, count in connection.execute(select(Job.status, func.count(Job.id)).group_by(Job.status)):
+                    depth[status] = depth.get(status, 0) + count
+
+        return depth
+
+    def start(self):
+        if self._workers or not self._app.config['JOB_QUEUE_WORKERS']:
+            return
+
+        self._requeue_stale_jobs()
+        self._schedule_periodic_tasks()
+
+        self._stopped.clear()
+        for i in range(self._app.config['JOB_QUEUE_WORKERS']):
+            worker = threading.Thread(target=self._work, name=f'job-queue-worker-{i}', daemon=True)
+            worker.start()
+
+            self._workers.append(worker)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.wakeup()
+
+        for worker in self._workers:
+            worker.join(timeout)
+
+        self._workers.clear()
+
+    def _requeue_stale_jobs(self):
+        from models import Job
+
+        # jobs left running by a worker that died (or by a previous process) are picked up again
+        with self._app.app_context():
+            requeued = 0
+            stale_timestamp = datetime.now() - timedelta(seconds=self._app.config['JOB_QUEUE_STALE_TIMEOUT'])
+            for shard in (shard_router := self._app.extensions['shard_router']).shards:
+                with shard_router.engine(shard).begin() as connection:
+                    requeued += connection.execute(update(Job)
+                                                   .where(Job.status == 'running',
+                                                          Job.started_timestamp < stale_timestamp)
+                                                   .values(status='pending', run_at=datetime.now())).rowcount
+
+            if requeued:
+                logger.warning(f'{requeued} stale job(s) requeued')
+
+    def _schedule_periodic_tasks(self):
+        with self._app.app_context():
+            for name in self.periodic_tasks:
+                self._schedule(name)
+
+            self.db.session.commit()
+
+    def _schedule(self, name, delay=0, job_id=None):
+        from models import Job
+
+        # periodic tasks have a single pending or running job on the primary database (processes starting together
+        # converge to one)
+        if not self.db.session.execute(select(func.count(Job.id))
+                                       .where(Job.name == name,
+                                              Job.status.in_(('pending', 'running')),
+                                              Job.id != job_id),
+                                       bind_arguments={'bind': self.db.engine}).scalar():
+            self.enqueue(name, delay, primary=True)
+
+    def _work(self):
+        with self._app.app_context():
+            while not self._stopped.is_set():
+                # the shards are polled in turns, starting after the shard of the last claimed job
+                shards, job = self._app.extensions['shard_router'].shards, None
+                for i in range(len(shards)):
+                    shard = shards[(self._next_shard + i) % len(shards)]
+                    self.db.session.info['shard'] = shard
+                    try:
+                        if job := self._claim():
+                            self._next_shard = shards.index(shard) + 1
+                            break
+
+                    except Exception as claim_error:
+                        logger.error(f'Unable to claim job on shard {shard}:', exc_info=claim_error)
+                        self.db.session.rollback()
+
+                if job:
+                    self._run(job, shard)
+                    self.db.session.remove()
+
+                else:
+                    with self._condition:
+                        self._condition.wait(self._app.config['JOB_QUEUE_POLL_INTERVAL'])
+
+    def _claim(self):
+        from models import Job
+
+        datetime_now = datetime.now()
+        job = Job.query \
+            .filter(Job.status == 'pending', Job.run_at <= datetime_now) \
+            .order_by(Job.run_at) \
+            .with_for_update(skip_locked=True) \
+            .first()
+
+        if not job:
+            self.db.session.rollback()
+            return None
+
+        # conditional update prevents two workers from claiming the same job on databases without row locks
+        claimed = Job.query \
+            .filter_by(id=job.id, status='pending') \
+            .update({'status': 'running', 'attempts': Job.attempts + 1, 'started_timestamp': datetime_now},
+                    synchronize_session=False)
+        self.db.session.commit()
+
+        return job if claimed else None
+
+    def _run(self, job, shard):
+        from models import Job
+
+        job_id, name, payload = job.id, job.name, job.payload
+        wait_time = (job.started_timestamp - job.run_at).total_seconds()
+
+        start_time = time.perf_counter()
+        try:
+            if name not in self.tasks:
+                raise LookupError(f'There is no task registered with name {name}')
+
+            task, _ = self.tasks[name]
+            task(**payload)
+
+            # tasks can route the session to other shards, the job is on the shard it was claimed from
+            self.db.session.info['shard'] = shard
+
+            # the task changes and the job removal (and the next periodic run) are committed together
+            self.db.session.delete(job)
+            if name in self.periodic_tasks:
+                self._schedule(name, self.periodic_tasks[name], job_id)
+
+            self.db.session.commit()
+
+        except Exception as task_error:
+            self.db.session.rollback()
+            logger.warning(f'Job {job_id} ({name}) failed:', exc_info=task_error)
+
+            # the failure can come from the database too: the job is left running (requeued once stale) and the
+            # worker keeps working
+            last_error = traceback.format_exc()
+            try:
+                self.db.session.info['shard'] = shard
+                job = self.db.session.get(Job, job_id)
+                job.last_error = last_error
+                if failed := job.attempts >= job.max_attempts:
+                    job.status = 'failed'
+                    if name in self.periodic_tasks:
+                        self._schedule(name, self.periodic_tasks[name], job_id)
+
+                else:
+                    job.status = 'pending'
+                    job.run_at = datetime.now() + timedelta(seconds=self._backoff(job.attempts))
+
+                self.db.session.commit()
+                self.metrics.count('failed' if failed else 'retried')
+
+            except Exception as update_error:
+                logger.error(f'Unable to update failed job {job_id} ({name}):', exc_info=update_error)
+                self.db.session.rollback()
+
+        else:
+            self.metrics.count('succeeded')
+
+        self.metrics.observe(wait_time, time.perf_counter() - start_time)
+
+    def _backoff(self, attempts):
+        # exponential backoff with jitter, capped by the configured maximum
+        backoff = self._app.config['JOB_QUEUE_RETRY_BACKOFF'] * 2 ** (attempts - 1)
+        return min(backoff, self._app.config['JOB_QUEUE_MAX_RETRY_BACKOFF']) * random.uniform(.5, 1)
@@ -0,0 +1,51 @@
+from sqlalchemy import BigInteger, Float, Numeric, cast
+from sqlalchemy.sql import operators
+from sqlalchemy.types import TypeDecorator
+
+# amounts are stored as integer minor units (cents), so sums in sql are exact integer arithmetic
+CENTS = 100
+
+# operators whose other operand is a factor (rates, counts), not an amount
+FACTOR_OPERATORS = {operators.mul, operators.truediv, operators.floordiv, operators.mod}
+
+
+def to_cents(amount):
+    return None if amount is None else round(amount * CENTS)
+
+
+def from_cents(cents):
+    # postgres sums of bigints are numeric (decimals)
+    return None if cents is None else float(cents) / CENTS
+
+
+class Money(TypeDecorator):
+    # amounts columns: floats at the api and python side, cents in the database (sql expressions of these columns
+    # are in cents, converted back when read)
+
+    impl = BigInteger
+    cache_ok = True
+
+    class Comparator(TypeDecorator.Comparator, BigInteger.Comparator):
+
+        def _adapt_expression(self, op, other_comparator):
+            # arithmetic of amounts are amounts, except the ratio of two amounts
+            if op is operators.truediv and isinstance(other_comparator.type, Money):
+                return op, Float()
+
+            return op, self.type
+
+    comparator_factory = Comparator
+
+    def process_bind_param(self, value, dialect):
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        return from_cents(value)
+
+    def coerce_compared_value(self, op, value):
+        return Float() if op in FACTOR_OPERATORS else self
+
+    @staticmethod
+    def decimal(cents):
+        # sql expression of the amount as a decimal number (text searches)
+        return cast(cents / float(CENTS), Numeric(15, 2))
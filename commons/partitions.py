@@ -0,0 +1,62 @@
+from sqlalchemy import text
+
+from datetime import datetime
+
+# declarative partitions (postgres >= 11) are used when configured, other databases keep regular tables
+MIN_SERVER_VERSION = 110000
+
+
+def partition_start(timestamp, interval):
+    return timestamp.replace(month=1 if interval == 'year' else timestamp.month, day=1,
+                             hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_partition_start(start, interval):
+    if interval == 'year':
+        return start.replace(year=start.year + 1)
+
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def partition_name(table, start, interval):
+    return f'{table}_y{start.year}' if interval == 'year' else f'{table}_y{start.year}m{start.month:02d}'
+
+
+def supports_partitions(connection):
+    return connection.dialect.name == 'postgresql' and \
+        int(connection.execute(text('SHOW server_version_num')).scalar()) >= MIN_SERVER_VERSION
+
+
+def is_partitioned(connection, table):
+    if connection.dialect.name != 'postgresql':
+        return False
+
+    return connection.execute(text('SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+                                   'WHERE c.relname = :table'), {'table': table}).scalar() is not None
+
+
+def create_partitions(connection, table, interval, start, end):
+    # partitions covering [start, end] (existing partitions are kept), returns the partitions created
+    created, start = list(), partition_start(start, interval)
+    while start <= end:
+        name, end_start = partition_name(table, start, interval), next_partition_start(start, interval)
+        if not connection.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar():
+            connection.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+                                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end_start.isoformat()}')"))
+            created.append(name)
+
+        start = end_start
+
+    return created
+
+
+def ensure_partitions(connection, table, interval, ahead):
+    # partitions of the current and the next periods, so rows are not written in the default partition
+    if not interval or not is_partitioned(connection, table):
+        return list()
+
+    end = start = partition_start(datetime.now(), interval)
+    for _ in range(ahead):
+        end = next_partition_start(end, interval)
+
+    return create_partitions(connection, table, interval, start, end)
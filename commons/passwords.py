@@ -0,0 +1,142 @@
+from werkzeug.security import generate_password_hash, check_password_hash, gen_salt, DEFAULT_PBKDF2_ITERATIONS
+
+import hmac
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from commons.asgi import wait
+
+try:
+    import argon2
+
+except ImportError:  # argon2 hashing is optional (argon2-cffi package)
+    argon2 = None
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # configurable password hashing (argon2, scrypt or werkzeug pbkdf2 methods) running in a bounded executor, so
+    # hashing spikes cannot take every request thread. hashes use the werkzeug "method$salt$hash" format (scrypt
+    # hashes are compatible with werkzeug >= 2.3) or the argon2 encoded format
+
+    def __init__(self, app=None):
+        self.method = None
+        self.timeout = None
+
+        self._argon2 = None
+        self._executor = None
+        self._slots = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', 32)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+
+        self.method = self._normalized_method(app.config['PASSWORD_HASH_METHOD'])
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+
+        if self.method.startswith('argon2'):
+            if not argon2:
+                raise RuntimeError('argon2-cffi package is required to use argon2 password hashing')
+
+            # argon2[:time_cost:memory_cost:parallelism]
+            self._argon2 = argon2.PasswordHasher(*map(int, self.method.split(':')[1:]))
+
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE_SIZE'])
+
+        app.extensions['password_hasher'] = self
+
+    def _submit(self, f, *args):
+        # hashing requests over the executor capacity (workers + queue size) are rejected
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Too many password hashing requests')
+
+        try:
+            future = self._executor.submit(f, *args)
+
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            # the asgi requests wait on the event loop
+            return wait(future, self.timeout)
+
+        except TimeoutError:
+            raise PasswordHasherBusy('Password hashing timed out')
+
+    def hash(self, password):
+        return self._submit(self._hash, password)
+
+    def verify(self, password_hash, password):
+        return self._submit(self._verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        if password_hash.startswith('$argon2'):
+            return not self._argon2 or self._argon2.check_needs_rehash(password_hash)
+
+        return password_hash.split('$', 1)[0] != self.method
+
+    @staticmethod
+    def _normalized_method(method):
+        # methods with the werkzeug default parameters filled in, as written in the hashes prefixes (compared by
+        # needs_rehash)
+        name, *parameters = method.split(':')
+        if name == 'scrypt':
+            defaults = ['32768', '8', '1']
+            return ':'.join([name] + parameters + defaults[len(parameters):])
+
+        if name == 'pbkdf2':
+            defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+            return ':'.join([name] + parameters + defaults[len(parameters):])
+
+        return method
+
+    def _hash(self, password):
+        if self._argon2:
+            return self._argon2.hash(password)
+
+        if self.method.startswith('scrypt'):
+            salt = gen_salt(16)
+            return f'{self.method}${salt}${self._scrypt(self.method, salt, password)}'
+
+        return generate_password_hash(password, self.method)
+
+    def _verify(self, password_hash, password):
+        if password_hash.startswith('$argon2'):
+            if not argon2:
+                raise RuntimeError('argon2-cffi package is required to verify argon2 password hashes')
+
+            try:
+                return (self._argon2 or argon2.PasswordHasher()).verify(password_hash, password)
+
+            except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHash):
+                return False
+
+        if password_hash.startswith('scrypt'):
+            try:
+                method, salt, hashval = password_hash.split('$', 2)
+
+            except ValueError:
+                return False
+
+            return hmac.compare_digest(self._scrypt(method, salt, password), hashval)
+
+        return check_password_hash(password_hash, password)
+
+    @staticmethod
+    def _scrypt(method, salt, password):
+        n, r, p = map(int, method.split(':')[1:])
+        return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=132 * n * r * p,
+                              dklen=64).hex()
@@ -0,0 +1,174 @@
+import json
+import time
+import uuid
+import select
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, insert
+
+from commons.transaction import after_commit
+
+logger = logging.getLogger(__name__)
+
+
+# cross process notifications published with the request transaction (delivered only if it commits): postgres
+# LISTEN/NOTIFY when available, otherwise a notification table polled by every process (sqlite and others). they are
+# published on the session shard (the primary database for global tables changes), listened on every shard
+class PubSub:
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.subscribers = dict()
+        self.origin = uuid.uuid4().hex
+
+        self._app = None
+        self._listeners = list()
+        self._stopped = threading.Event()
+
+        if app:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self._app = app
+        self.db = db or self.db
+
+        app.config.setdefault('PUBSUB_POLL_INTERVAL', 1)
+        app.config.setdefault('PUBSUB_RETENTION', 300)
+
+        app.extensions['pubsub'] = self
+
+    @staticmethod
+    def listen_notify(bind):
+        # each shard can be a different backend
+        return bind.dialect.name == 'postgresql'
+
+    def subscribe(self, channel, callback):
+        # callbacks receive the published payload
+        self.subscribers.setdefault(channel, list()).append(callback)
+
+    def publish(self, channel, payload, session=None, primary=False):
+        from models import Notification
+
+        session = session or self.db.session
+        message = json.dumps({'origin': self.origin, 'payload': payload})
+        bind = self.db.engine if primary else session.get_bind(mapper=Notification)
+        if self.listen_notify(bind):
+            session.execute(text('SELECT pg_notify(:channel, :message)'), {'channel': channel, 'message': message},
+                            bind_arguments={'bind': bind})
+
+        else:
+            # core insert, notifications can be published while the session is flushing
+            session.execute(insert(Notification).values(channel=channel, payload=message),
+                            bind_arguments={'bind': bind})
+
+        # this process subscribers are notified right after commit, not waiting for the listener
+        after_commit(session, lambda: self._dispatch(channel, payload))
+
+    def _receive(self, channel, message):
+        # notifications published by this process were already dispatched
+        if (message := json.loads(message))['origin'] != self.origin:
+            self._dispatch(channel, message['payload'])
+
+    def _dispatch(self, channel, payload):
+        for callback in self.subscribers.get(channel, list()):
+            try:
+                callback(payload)
+
+            except Exception as callback_error:
+                logger.error(f'Notification callback of channel {channel} failed:', exc_info=callback_error)
+
+    def start(self):
+        if self._listeners:
+            return
+
+        self._stopped.clear()
+        for shard in (shard_router := self._app.extensions['shard_router']).shards:
+            listener = threading.Thread(target=self._listen if self.listen_notify(shard_router.engine(shard)) else
+                                        self._poll,
+                                        args=(shard,),
+                                        name=f'pubsub-listener-{shard}',
+                                        daemon=True)
+            listener.start()
+
+            self._listeners.append(listener)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+
+        for listener in self._listeners:
+            listener.join(timeout)
+
+        self._listeners.clear()
+
+    def _listen(self, shard):
+        # dedicated connection out of the pool, reconnected on errors
+        with self._app.app_context():
+            engine = self._app.extensions['shard_router'].engine(shard)
+
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                driver_connection = connection.driver_connection
+                driver_connection.autocommit = True
+
+                listening = set()
+                while not self._stopped.is_set():
+                    with driver_connection.cursor() as cursor:
+                        for channel in set(self.subscribers).difference(listening):
+                            cursor.execute(f'LISTEN "{channel}"')
+                            listening.add(channel)
+
+                    if select.select([driver_connection], [], [], self._app.config['PUBSUB_POLL_INTERVAL'])[0]:
+                        driver_connection.poll()
+
+                        while driver_connection.notifies:
+                            notify = driver_connection.notifies.pop(0)
+                            self._receive(notify.channel, notify.payload)
+
+            except Exception as listen_error:
+                logger.error(f'Notifications listener of shard {shard} failed, reconnecting:', exc_info=listen_error)
+                self._stopped.wait(self._app.config['PUBSUB_POLL_INTERVAL'])
+
+            finally:
+                if connection:
+                    connection.invalidate()
+
+    def _poll(self, shard):
+        from models import Notification
+
+        with self._app.app_context():
+            last_id, last_purge = None, 0
+            while not self._stopped.is_set():
+                self.db.session.info['shard'] = shard
+                try:
+                    # notifications before the listener start are not delivered
+                    if last_id is None:
+                        last_id = self.db.session.query(self.db.func.max(Notification.id)).scalar() or 0
+
+                    for notification in Notification.query \
+                            .filter(Notification.id > last_id) \
+                            .order_by(Notification.id):
+                        last_id = notification.id
+                        self._receive(notification.channel, notification.payload)
+
+                    if time.monotonic() - last_purge > self._app.config['PUBSUB_RETENTION']:
+                        last_purge = time.monotonic()
+
+                        retention = timedelta(seconds=self._app.config['PUBSUB_RETENTION'])
+                        Notification.query \
+                            .filter(Notification.created_timestamp < datetime.now() - retention) \
+                            .delete(synchronize_session=False)
+
+                    self.db.session.commit()
+
+                except Exception as poll_error:
+                    logger.error(f'Unable to poll notifications on shard {shard}:', exc_info=poll_error)
+                    self.db.session.rollback()
+
+                finally:
+                    self.db.session.remove()
+
+                self._stopped.wait(self._app.config['PUBSUB_POLL_INTERVAL'])
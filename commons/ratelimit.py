@@ -0,0 +1,124 @@
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+
+except ImportError:  # shared rate limit storage is optional (redis package)
+    redis = None
+
+
+class MemoryStorage:
+    # token buckets of a single process: {key: (tokens, timestamp, full_timestamp)} kept in least recently used
+    # order, bounded in size and swept of the buckets already full again (same as a new bucket)
+
+    def __init__(self, max_keys=100000, sweep_interval=1000):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._calls = 0
+
+    def consume(self, key, rate, capacity, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, timestamp, _ = self._buckets.pop(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - timestamp) * rate)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+
+            self._calls += 1
+            if self._calls % self.sweep_interval == 0:
+                self._sweep(now)
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def _sweep(self, now):
+        for key, (_, _, full_timestamp) in list(self._buckets.items()):
+            if full_timestamp > now:
+                break
+
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisStorage:
+    # token buckets shared by every worker, updated atomically by a lua script
+
+    _SCRIPT = '''
+        local rate, capacity, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+        local tokens, timestamp = tonumber(bucket[1]) or capacity, tonumber(bucket[2]) or now
+
+        tokens = math.min(capacity, tokens + math.max(now - timestamp, 0) * rate)
+        local allowed = tokens >= cost
+        if allowed then
+            tokens = tokens - cost
+        end
+
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'timestamp', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+
+        if allowed then
+            return '0'
+        end
+        return tostring((cost - tokens) / rate)
+    '''
+
+    def __init__(self, url, prefix='ratelimit:'):
+        if not redis:
+            raise RuntimeError('redis package is required to use a redis rate limit storage')
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    def consume(self, key, rate, capacity, cost=1):
+        retry_after = float(self._script(keys=[self.prefix + key], args=[rate, capacity, cost, time.time()]))
+        return not retry_after, retry_after
+
+    def clear(self):
+        for key in self._client.scan_iter(f'{self.prefix}*'):
+            self._client.delete(key)
+
+
+def parse_limit(limit):
+    # "<requests>/<seconds>" -> (rate in tokens per second, capacity)
+    requests, seconds = map(float, limit.split('/'))
+    return requests / seconds, requests
+
+
+class RateLimiter:
+
+    def __init__(self, app=None):
+        self.storage = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+        app.config.setdefault('RATELIMIT_MAX_KEYS', 100000)
+
+        storage_url = app.config['RATELIMIT_STORAGE_URL']
+        self.storage = MemoryStorage(app.config['RATELIMIT_MAX_KEYS']) if storage_url.startswith('memory://') \
+            else RedisStorage(storage_url)
+
+        app.extensions['rate_limiter'] = self
+
+    def hit(self, name, key, limit):
+        # returns if the request is allowed and the seconds to wait otherwise
+        rate, capacity = parse_limit(limit)
+        return self.storage.consume(f'{name}:{key}', rate, capacity)
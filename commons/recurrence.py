@@ -0,0 +1,34 @@
+from datetime import timedelta
+from calendar import monthrange
+
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+
+
+def occurrence(start, frequency, interval, index):
+    # index-th occurrence of the schedule, computed from the start so monthly and yearly occurrences keep the start
+    # day (the last day of shorter months)
+    match frequency:
+        case 'daily':
+            return start + timedelta(days=interval * index)
+
+        case 'weekly':
+            return start + timedelta(weeks=interval * index)
+
+        case 'monthly' | 'yearly':
+            years, month = divmod(start.month - 1 + interval * index * (12 if frequency == 'yearly' else 1), 12)
+            year, month = start.year + years, month + 1
+            return start.replace(year=year, month=month, day=min(start.day, monthrange(year, month)[1]))
+
+        case _:
+            raise ValueError(f'Invalid frequency {frequency}')
+
+
+def due_occurrences(start, frequency, interval, index, until, end=None, limit=None):
+    # (index, timestamp) of the occurrences from the index-th one up to until (and the schedule end)
+    due = list()
+    while (limit is None or len(due) < limit) and \
+            (timestamp := occurrence(start, frequency, interval, index)) <= until and (end is None or timestamp <= end):
+        due.append((index, timestamp))
+        index += 1
+
+    return due
@@ -0,0 +1,118 @@
+import csv
+import json
+from html import escape
+from datetime import date, datetime
+
+
+def _value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+
+    return value
+
+
+# report writers stream the sections rows to the report file as they are read, nothing is kept in memory
+class ReportWriter:
+
+    def __init__(self, file, title, parameters):
+        self.file = file
+        self.title = title
+        self.parameters = parameters
+
+    def section(self, name, columns):
+        raise NotImplementedError
+
+    def row(self, values):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CsvReportWriter(ReportWriter):
+    # sections one after the other: section name, columns header and rows, separated by an empty line
+
+    def __init__(self, file, title, parameters):
+        super().__init__(file, title, parameters)
+        self._writer = csv.writer(file)
+        self._sections = 0
+
+    def section(self, name, columns):
+        if self._sections:
+            self._writer.writerow(())
+
+        self._writer.writerow((name,))
+        self._writer.writerow(columns)
+        self._sections += 1
+
+    def row(self, values):
+        self._writer.writerow(map(_value, values))
+
+
+class JsonReportWriter(ReportWriter):
+    # {"title": ..., "parameters": {...}, "sections": {"<name>": {"columns": [...], "rows": [[...], ...]}, ...}}
+
+    def __init__(self, file, title, parameters):
+        super().__init__(file, title, parameters)
+        self.file.write(f'{{"title": {json.dumps(title)}, "parameters": {json.dumps(parameters, default=_value)}, '
+                        f'"sections": {{')
+        self._sections = 0
+        self._rows = 0
+
+    def section(self, name, columns):
+        self._close_section()
+        self.file.write(f'{", " if self._sections else ""}{json.dumps(name)}: '
+                        f'{{"columns": {json.dumps(columns)}, "rows": [')
+        self._sections += 1
+        self._rows = 0
+
+    def row(self, values):
+        self.file.write(f'{", " if self._rows else ""}{json.dumps(list(values), default=_value)}')
+        self._rows += 1
+
+    def close(self):
+        self._close_section()
+        self.file.write('}}')
+
+    def _close_section(self):
+        if self._sections:
+            self.file.write(']}')
+
+
+class HtmlReportWriter(ReportWriter):
+    # standalone document with a table for each section
+
+    def __init__(self, file, title, parameters):
+        super().__init__(file, title, parameters)
+        self.file.write(f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{escape(title)}</title>\n'
+                        f'</head>\n<body>\n<h1>{escape(title)}</h1>\n')
+        self._sections = 0
+
+    def section(self, name, columns):
+        self._close_section()
+        self.file.write(f'<h2>{escape(name)}</h2>\n<table>\n<thead><tr>'
+                        f'{"".join(f"<th>{escape(column)}</th>" for column in columns)}</tr></thead>\n<tbody>\n')
+        self._sections += 1
+
+    def row(self, values):
+        self.file.write(f'<tr>{"".join(f"<td>{self._cell(value)}</td>" for value in values)}</tr>\n')
+
+    @staticmethod
+    def _cell(value):
+        return escape(str(_value(value))) if value is not None else str()
+
+    def close(self):
+        self._close_section()
+        self.file.write('</body>\n</html>\n')
+
+    def _close_section(self):
+        if self._sections:
+            self.file.write('</tbody>\n</table>\n')
+
+
+# writer and mimetype of each report format
+REPORT_FORMATS = {
+    'csv': (CsvReportWriter, 'text/csv'),
+    'json': (JsonReportWriter, 'application/json'),
+    'html': (HtmlReportWriter, 'text/html')
+}
@@ -0,0 +1,235 @@
+from flask import request
+from flask_restful import abort
+from flask_restful.reqparse import Namespace, text_type, _friendly_location
+from werkzeug.exceptions import BadRequest
+from werkzeug.datastructures import FileStorage
+
+import inspect
+from collections.abc import MutableSequence
+
+_SIMPLE_TYPES = (int, float, str, bool, dict, list, text_type)
+_LOCATIONS = ('json', 'values', 'args', 'form', 'files')
+
+
+# validation schema compiled once from a reqparse RequestParser: it follows the parser arguments semantics (locations,
+# types, defaults, choices and help messages) but reads the request sources once and validates every argument (and
+# nested arguments) in a single pass, bundling the errors of the whole body. parsers using features not supported here
+# are not compilable and must be parsed by the RequestParser itself
+class RequestSchema:
+
+    def __init__(self, request_parser, nested=None, reject_empty_required=False):
+        self.request_parser = request_parser
+        self.bundle_errors = request_parser.bundle_errors
+        self.reject_empty_required = reject_empty_required
+        self.nested = {name: RequestSchema(parser) for name, parser in (nested or dict()).items()}
+
+        self.compilable = all(map(self._is_compilable, request_parser.args)) and \
+            all(schema.compilable for schema in self.nested.values())
+
+        self._fields = [self._compile(arg) for arg in request_parser.args] if self.compilable else list()
+
+    @staticmethod
+    def _is_compilable(arg):
+        locations = (arg.location,) if isinstance(arg.location, str) else arg.location
+
+        return tuple(arg.operators) == ('=',) and all(location in _LOCATIONS for location in locations)
+
+    @staticmethod
+    def _converter(arg_type):
+        # resolve once the way reqparse calls the type: type(value, name, op), type(value, name) or type(value)
+        if arg_type in _SIMPLE_TYPES or arg_type is FileStorage:
+            return 1
+
+        try:
+            parameters = inspect.signature(arg_type).parameters.values()
+
+        except (TypeError, ValueError):
+            return None  # unknown signature, try the calls in order as reqparse does
+
+        if any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters):
+            return 3
+
+        positional = [parameter for parameter in parameters
+                      if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)]
+        required = [parameter for parameter in positional if parameter.default is parameter.empty]
+        for arity in (3, 2, 1):
+            if len(required) <= arity <= len(positional):
+                return arity
+
+        return None
+
+    def _compile(self, arg):
+        locations = (arg.location,) if isinstance(arg.location, str) else tuple(arg.location)
+        friendly_locations = ' or '.join(_friendly_location.get(location, location) for location in locations)
+
+        return {
+            'arg': arg,
+            'name': arg.name,
+            'dest': arg.dest or arg.name,
+            'locations': locations,
+            'multi': not isinstance(arg.location, str),
+            'arity': self._converter(arg.type),
+            'choices': [choice.lower() for choice in arg.choices] if arg.choices and not arg.case_sensitive
+            else arg.choices,
+            'missing_message': f'Missing required parameter in {friendly_locations}',
+            'nested': self.nested.get(arg.name)
+        }
+
+    @staticmethod
+    def _convert(field, value):
+        arg = field['arg']
+        if value is None:
+            if arg.nullable:
+                return None
+
+            raise ValueError('Must not be null!')
+
+        elif isinstance(value, FileStorage) and arg.type == FileStorage:
+            return value
+
+        match field['arity']:
+            case 1:
+                return arg.type(value)
+
+            case 2:
+                return arg.type(value, arg.name)
+
+            case 3:
+                return arg.type(value, arg.name, '=')
+
+        try:
+            return arg.type(value, arg.name, '=')
+
+        except TypeError:
+            try:
+                return arg.type(value, arg.name)
+
+            except TypeError:
+                return arg.type(value)
+
+    @staticmethod
+    def _error_message(field, error):
+        help_message = field['arg'].help
+        return help_message.format(error_msg=str(error)) if help_message else str(error)
+
+    @staticmethod
+    def request_sources(req=None):
+        req = req or request
+
+        json = req.get_json() if req.is_json else None
+        return {
+            'json': json if isinstance(json, dict) else dict(),
+            'values': req.values,
+            'args': req.args,
+            'form': req.form,
+            'files': req.files
+        }
+
+    def _values(self, field, sources):
+        # returns the argument values from the sources (or None if the argument is not present)
+        name, values = field['name'], None
+        for location in field['locations']:
+            source = sources.get(location) or dict()
+            if name not in source:
+                continue
+
+            if location != 'json':
+                values = (values or list()) + source.getlist(name)
+
+            elif field['multi']:
+                # reqparse merges the json body in a MultiDict, expanding list values
+                value = source[name]
+                value = value if isinstance(value, (list, tuple)) else [value]
+                if value:
+                    values = (values or list()) + list(value)
+
+            else:
+                value = source[name]
+                values = value if isinstance(value, MutableSequence) and field['arg'].action == 'append' \
+                    else [value]
+
+        return values
+
+    def validate(self, sources, strict=False):
+        # returns the parsed namespace and the errors ({argument name: message}) of the sources
+        namespace, errors, parsed_names = Namespace(), dict(), set()
+        for field in self._fields:
+            arg = field['arg']
+
+            results, error = list(), None
+            for value in (values := self._values(field, sources)) or list():
+                if hasattr(value, 'strip') and arg.trim:
+                    value = value.strip()
+
+                if hasattr(value, 'lower') and not arg.case_sensitive:
+                    value = value.lower()
+
+                try:
+                    value = self._convert(field, value)
+
+                except Exception as conversion_error:
+                    if arg.ignore:
+                        continue
+
+                    error = self._error_message(field, conversion_error)
+                    break
+
+                if field['choices'] and value not in field['choices']:
+                    error = self._error_message(field, ValueError(f'{value} is not a valid choice'))
+                    break
+
+                if nested := field['nested']:
+                    nested_namespace, nested_errors = nested.validate({'json': value})
+                    if nested_errors:
+                        # nested errors are reported with the nested argument names, as the nested parser did
+                        for nested_name, nested_error in nested_errors.items():
+                            errors.setdefault(nested_name, nested_error)
+
+                        continue
+
+                    value = nested_namespace
+
+                results.append(value)
+
+            if error is None and not results and arg.required:
+                error = self._error_message(field, ValueError(field['missing_message']))
+
+            # required arguments with empty values are reported with the argument help
+            elif error is None and self.reject_empty_required and arg.required and \
+                    not (results if arg.action == 'append' else results[0]):
+                error = arg.help
+
+            if error is not None:
+                errors[field['name']] = error
+                if not self.bundle_errors:
+                    break
+
+                continue
+
+            if values is not None:
+                parsed_names.add(field['name'])
+
+            if results:
+                namespace[field['dest']] = results if arg.action == 'append' or len(results) > 1 and \
+                    arg.action != 'store' else results[0]
+
+            elif arg.store_missing:
+                namespace[field['dest']] = arg.default() if callable(arg.default) else arg.default
+
+        if strict and not errors:
+            # empty lists are not arguments for reqparse (they are lost when merged in a MultiDict)
+            arguments = {name for name, value in sources.get('json', dict()).items() if value not in ([], ())}
+            arguments.update(sources.get('values') or dict())
+
+            if unknown_arguments := [name for name in arguments if name not in parsed_names]:
+                raise BadRequest(f'Unknown arguments: {", ".join(unknown_arguments)}')
+
+        return namespace, errors
+
+    def parse(self, req=None, strict=False, http_error_code=400):
+        # same behaviour as RequestParser.parse_args
+        namespace, errors = self.validate(self.request_sources(req), strict)
+        if errors:
+            abort(http_error_code, message=errors)
+
+        return namespace
@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+
+def net_balances(debts):
+    # debts: iterable of (debtor, creditor, amount) -> net amount of each user (positive is to receive)
+    nets = defaultdict(float)
+    for debtor, creditor, amount in debts:
+        nets[debtor] -= amount
+        nets[creditor] += amount
+
+    return {user: round(amount, 2) for user, amount in nets.items() if round(amount, 2)}
+
+
+def settle_up(nets):
+    # returns the transfers (debtor, creditor, amount) that settle the given net balances.
+    # finding the minimum number of transfers is NP-hard, so users whose nets cancel each other exactly are
+    # settled first with a single transfer and the remaining are matched greedily (largest debtor pays to the
+    # largest creditor), which never needs more than n - 1 transfers
+    transfers = list()
+
+    debtors = {user: -amount for user, amount in nets.items() if amount < 0}
+    creditors = {user: amount for user, amount in nets.items() if amount > 0}
+
+    # exact matches
+    creditors_by_amount = defaultdict(list)
+    for creditor, amount in creditors.items():
+        creditors_by_amount[amount].append(creditor)
+
+    for debtor, amount in list(debtors.items()):
+        if creditors_by_amount.get(amount):
+            creditor = creditors_by_amount[amount].pop()
+            transfers.append((debtor, creditor, amount))
+
+            del debtors[debtor], creditors[creditor]
+
+    # greedy matching
+    debtors = sorted(debtors.items(), key=lambda item: item[1])
+    creditors = sorted(creditors.items(), key=lambda item: item[1])
+    while debtors and creditors:
+        debtor, debt = debtors.pop()
+        creditor, credit = creditors.pop()
+
+        amount = round(min(debt, credit), 2)
+        transfers.append((debtor, creditor, amount))
+
+        if (debt := round(debt - amount, 2)) > 0:
+            debtors.append((debtor, debt))
+            debtors.sort(key=lambda item: item[1])
+
+        if (credit := round(credit - amount, 2)) > 0:
+            creditors.append((creditor, credit))
+            creditors.sort(key=lambda item: item[1])
+
+    return transfers
@@ -0,0 +1,300 @@
+import click
+import logging
+from bisect import bisect
+from hashlib import md5
+
+from flask import current_app, has_request_context
+from flask.cli import AppGroup
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import MetaData, inspect, select, text
+from sqlalchemy.schema import CreateTable, CreateIndex
+from sqlalchemy.sql.util import find_tables
+
+from commons.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# the primary database: global tables (users, shares, reports...) and the data of the users not placed on other shards
+DEFAULT_SHARD = 'default'
+
+# tables with the data of a single user, the users sharing expenses are kept together on the same shard
+SHARDED_TABLES = frozenset({'category', 'expense', 'archived_expense', 'expense_summary', 'balance',
+                            'change_sequence', 'change', 'recurring_expense'})
+
+# jobs and notifications are written on the session shard, in the same transaction as the users data they belong to
+# (the ones of global tables changes are written on the primary database). every shard has them, polled by the job
+# queue workers and the notifications listener
+OUTBOX_TABLES = frozenset({'job', 'notification'})
+
+# tables with data shared by every user, copied to every shard (so they can be joined with the users data)
+REPLICATED_TABLES = frozenset({'exchange_rate'})
+
+# ids of each shard are allocated from a disjoint range (postgres sequences), so moved rows keep their ids
+SHARD_ID_RANGE = 2 ** 40
+
+
+class HashRing:
+    # consistent hashing: each shard owns the ring points of its replicas, a key belongs to the next point
+
+    def __init__(self, shards, replicas=64):
+        self._points = sorted((self._hash(f'{shard}:{i}'), shard) for shard in shards for i in range(replicas))
+        self._hashes = [point for point, _ in self._points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(md5(str(key).encode()).digest()[:8], 'big')
+
+    def shard(self, key):
+        return self._points[bisect(self._hashes, self._hash(key)) % len(self._points)][1]
+
+
+class ShardSession(Session):
+    # users data (and outbox) tables are routed to the session shard (the shard of the jwt identity unless routed
+    # explicitly). the requests of the asgi application use the async twins of the engines (see commons.asgi)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and len((router := current_app.extensions['shard_router']).shards) > 1 and \
+                self._is_sharded(mapper, clause) and (shard := router.session_shard(self)) != DEFAULT_SHARD:
+            bind = router.engine(shard)
+
+        return current_app.extensions['asgi_adapter'].bind(super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                                                            **kwargs))
+
+    @staticmethod
+    def _is_sharded(mapper, clause):
+        if mapper is not None:
+            return inspect(mapper).local_table.name in SHARDED_TABLES | OUTBOX_TABLES
+
+        return clause is not None and \
+            any(table.name in SHARDED_TABLES | OUTBOX_TABLES for table in find_tables(clause, include_crud=True))
+
+
+class ShardRouter:
+    # users are placed on a shard by consistent hashing when created, the shard directory table (primary database)
+    # is the source of truth and records the moves. users without directory entry are on the default shard
+
+    CHANNEL = 'shards'
+
+    def __init__(self, app=None, db=None, pubsub=None):
+        self.db = db
+        self.pubsub = pubsub
+        self.shards = [DEFAULT_SHARD]
+
+        self._ring = None
+        self._directory = None
+
+        if app:
+            self.init_app(app, db, pubsub)
+
+    def init_app(self, app, db=None, pubsub=None):
+        # before the db extension, shards are database binds
+        self.db = db or self.db
+        self.pubsub = pubsub or self.pubsub
+
+        app.config.setdefault('SQLALCHEMY_SHARDS', dict())
+        app.config.setdefault('SHARD_RING_REPLICAS', 64)
+        app.config.setdefault('SHARD_DIRECTORY_CACHE_SIZE', 100000)
+        app.config.setdefault('SHARD_DIRECTORY_CACHE_TTL', 3600)
+
+        if DEFAULT_SHARD in app.config['SQLALCHEMY_SHARDS']:
+            raise ValueError(f'Shard name {DEFAULT_SHARD} is reserved for the primary database')
+
+        app.config['SQLALCHEMY_BINDS'] = {**app.config.get('SQLALCHEMY_BINDS', dict()),
+                                          **app.config['SQLALCHEMY_SHARDS']}
+
+        self.shards = [DEFAULT_SHARD, *app.config['SQLALCHEMY_SHARDS']]
+        self._ring = HashRing(self.shards, app.config['SHARD_RING_REPLICAS'])
+        self._directory = LRUCache(app.config['SHARD_DIRECTORY_CACHE_SIZE'], app.config['SHARD_DIRECTORY_CACHE_TTL'])
+        self.pubsub.subscribe(self.CHANNEL, self.invalidate)
+
+        app.cli.add_command(shards_cli)
+        app.extensions['shard_router'] = self
+
+    def engine(self, shard):
+        return self.db.engines[None if shard == DEFAULT_SHARD else shard]
+
+    def shard(self, user_id):
+        if user_id is None:
+            return DEFAULT_SHARD
+
+        return self._directory.get_or_set(int(user_id), lambda: self._lookup(int(user_id)))
+
+    def place(self, user_id):
+        # shard of a new user
+        return self._ring.shard(user_id)
+
+    def route(self, session, user_id):
+        # jobs and other code out of the user requests set the session shard explicitly
+        session.info['shard'] = self.shard(user_id)
+
+    def session_shard(self, session):
+        # not kept in the session, requests can share the application context session
+        if (shard := session.info.get('shard')) is None:
+            shard = self.shard(self._identity())
+
+        return shard
+
+    def invalidate(self, user_ids):
+        for user_id in user_ids:
+            self._directory.pop(user_id)
+
+    def assign(self, session, user_ids):
+        # directory entries of the new users, written with the users
+        from models import ShardDirectory
+
+        placements = {user_id: self.place(user_id) for user_id in user_ids}
+        session.execute(ShardDirectory.__table__.insert(),
+                        [{'user_id': user_id, 'shard': shard} for user_id, shard in placements.items()])
+
+        for user_id, shard in placements.items():
+            self._directory.set(user_id, shard)
+
+    def group(self, user_id, shard=None):
+        # users connected to the user through shares (placed on the shard), moved together
+        from models import Share
+
+        group, frontier = {user_id}, {user_id}
+        while frontier:
+            shares = self.db.session.query(Share.shared_by_user_id, Share.shared_with_user_id) \
+                .filter(self.db.or_(Share.shared_by_user_id.in_(frontier), Share.shared_with_user_id.in_(frontier)))
+
+            frontier = {other_user_id for share in shares for other_user_id in share
+                        if other_user_id not in group and (shard is None or self.shard(other_user_id) == shard)}
+            group.update(frontier)
+
+        return group
+
+    def move(self, user_id, shard):
+        # moves the user (and the users sharing expenses with him) to the shard: the data is copied to the shard,
+        # the directory entries switched and the data removed from the previous shard. returns the moved users
+        from models import ShardDirectory
+
+        if shard not in self.shards:
+            raise LookupError(f'There is no shard named {shard}')
+
+        if (source := self.shard(user_id)) == shard:
+            return set()
+
+        user_ids, tables = self.group(user_id, source), self._tables()
+        with self.engine(source).connect() as source_connection, source_connection.begin():
+            # the moved users writes wait for the move, every change updates the user change sequence
+            change_sequence = self.db.metadata.tables['change_sequence']
+            source_connection.execute(select(change_sequence.c.user_id)
+                                      .where(change_sequence.c.user_id.in_(user_ids))
+                                      .with_for_update())
+
+            # the users were moved by a concurrent move while waiting
+            if self._lookup(user_id) != source:
+                self.invalidate([user_id])
+                return set()
+
+            rows = {table: source_connection.execute(select(table).where(table.c.user_id.in_(user_ids)))
+                     .mappings().all() for table in tables}
+
+            with self.engine(shard).begin() as target_connection:
+                # rows left by a previous interrupted move are replaced
+                for table in reversed(tables):
+                    target_connection.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+
+                for table in tables:
+                    if rows[table]:
+                        # parent expenses before their shared expenses
+                        target_connection.execute(table.insert(),
+                                                  sorted(map(dict, rows[table]),
+                                                         key=lambda row: row.get('parent_id') is not None))
+
+            directory_table = ShardDirectory.__table__
+            self.db.session.execute(directory_table.delete().where(directory_table.c.user_id.in_(user_ids)))
+            self.db.session.execute(directory_table.insert(),
+                                    [{'user_id': moved_user_id, 'shard': shard} for moved_user_id in user_ids])
+            self.pubsub.publish(self.CHANNEL, sorted(user_ids), self.db.session, primary=True)
+            self.db.session.commit()
+
+            for table in reversed(tables):
+                source_connection.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+
+        logger.info(f'Users {", ".join(map(str, sorted(user_ids)))} moved from shard {source} to shard {shard}')
+
+        return user_ids
+
+    def create_all(self):
+        # shards only have the users data tables (and the outbox and replicated tables), without the foreign keys to
+        # the primary database tables
+        tables = [table for table in self.db.metadata.sorted_tables
+                  if table.name in SHARDED_TABLES | OUTBOX_TABLES | REPLICATED_TABLES]
+        for index, shard in enumerate(self.shards[1:], 1):
+            with self.engine(shard).begin() as connection:
+                existing_tables = set(inspect(connection).get_table_names())
+
+                # copies of the tables, sqlite ids ranges need autoincrement tables
+                metadata = MetaData()
+                for table in [table.to_metadata(metadata) for table in tables]:
+                    if table.name in existing_tables:
+                        continue
+
+                    table.dialect_options['sqlite']['autoincrement'] = table.autoincrement_column is not None
+                    connection.execute(CreateTable(table, include_foreign_key_constraints=[
+                        constraint for constraint in table.foreign_key_constraints
+                        if constraint.elements[0].target_fullname.split('.')[0] in SHARDED_TABLES]))
+
+                    for table_index in table.indexes:
+                        connection.execute(CreateIndex(table_index))
+
+                    if table.autoincrement_column is not None:
+                        self._reserve_ids(connection, table, index * SHARD_ID_RANGE)
+
+                    # replicated tables of a new shard start with the primary database rows
+                    if table.name in REPLICATED_TABLES:
+                        with self.engine(DEFAULT_SHARD).connect() as primary_connection:
+                            if rows := primary_connection.execute(select(table)).mappings().all():
+                                connection.execute(table.insert(), list(map(dict, rows)))
+
+    @staticmethod
+    def _reserve_ids(connection, table, start):
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                                    f"'{table.autoincrement_column.name}'), :start)"), {'start': start})
+
+        elif connection.dialect.name == 'sqlite':
+            connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :start)'),
+                               {'table': table.name, 'start': start})
+
+    def _tables(self):
+        # users data tables in dependency order
+        return [table for table in self.db.metadata.sorted_tables if table.name in SHARDED_TABLES]
+
+    def _lookup(self, user_id):
+        from models import ShardDirectory
+
+        # own connection, the lookup can happen while the session is choosing a connection or flushing
+        with self.db.engine.connect() as connection:
+            shard = connection.execute(select(ShardDirectory.shard)
+                                       .where(ShardDirectory.user_id == user_id)).scalar() or DEFAULT_SHARD
+
+        if shard not in self.shards:
+            raise LookupError(f'User {user_id} is on unknown shard {shard}')
+
+        return shard
+
+    @staticmethod
+    def _identity():
+        try:
+            return get_jwt_identity() if has_request_context() else None
+
+        except RuntimeError:  # request without jwt verification
+            return None
+
+
+shards_cli = AppGroup('shards', help='Users database shards.')
+
+
+@shards_cli.command('move', help='Move a user (and the users sharing expenses with him) to a shard.')
+@click.argument('user_id', type=int)
+@click.argument('shard')
+def move_command(user_id, shard):
+    if moved_user_ids := current_app.extensions['shard_router'].move(user_id, shard):
+        click.echo(f'Users {", ".join(map(str, sorted(moved_user_ids)))} moved to shard {shard}')
+
+    else:
+        click.echo(f'User {user_id} is already on shard {shard}')
@@ -0,0 +1,55 @@
+from commons.cache import LRUCache
+
+
+class SharePermissions:
+    # per user cache of the active users allowed to receive shared expenses, invalidated in every process by a
+    # notification published when shares are added or removed or users are enabled or disabled (the ttl is a backstop)
+
+    CHANNEL = 'share_permissions'
+
+    def __init__(self, app=None, pubsub=None):
+        self.pubsub = pubsub
+        self._allowed = None
+
+        if app:
+            self.init_app(app, pubsub)
+
+    def init_app(self, app, pubsub=None):
+        self.pubsub = pubsub or self.pubsub
+
+        app.config.setdefault('SHARE_PERMISSIONS_MAX_USERS', 10000)
+        app.config.setdefault('SHARE_PERMISSIONS_TTL', 300)
+
+        self._allowed = LRUCache(app.config['SHARE_PERMISSIONS_MAX_USERS'], app.config['SHARE_PERMISSIONS_TTL'])
+        self.pubsub.subscribe(self.CHANNEL, self.invalidate)
+
+        app.extensions['share_permissions'] = self
+
+    def allowed_user_ids(self, user_id):
+        return self._allowed.get_or_set(user_id, lambda: self._load(user_id))
+
+    def is_allowed(self, user_id, share_with_user_id):
+        return share_with_user_id in self.allowed_user_ids(user_id)
+
+    def invalidate(self, user_id=None):
+        # without user every user is invalidated (a disabled user may be in any allowed set)
+        if user_id is None:
+            self._allowed.clear()
+
+        else:
+            self._allowed.pop(user_id)
+
+    def changed(self, session, user_id=None):
+        # published with the session transaction (shares and users are global tables), so the permissions are
+        # reloaded after commit
+        self.pubsub.publish(self.CHANNEL, user_id, session, primary=True)
+
+    @staticmethod
+    def _load(user_id):
+        from models import Share, User
+
+        return frozenset(shared_with_user_id for shared_with_user_id, in Share.query
+                         .join(User, Share.shared_with_user_id == User.id)
+                         .with_entities(Share.shared_with_user_id)
+                         .filter(Share.shared_by_user_id == user_id,
+                                 User.active))
@@ -0,0 +1,100 @@
+import io
+import re
+import csv
+from datetime import datetime, time
+from itertools import islice
+
+
+class StatementImportError(ValueError):
+    pass
+
+
+def read_csv_statement(file, description_column='description', date_column='date', amount_column='amount',
+                       time_column=None, category_column=None, date_format=None, delimiter=','):
+    # yields (line, row) for each statement line, where row is a dict with the expense fields
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''), delimiter=delimiter)
+
+    try:
+        missing_columns = {description_column, date_column, amount_column, time_column, category_column} \
+            .difference(reader.fieldnames or list(), {None})
+        if missing_columns:
+            raise StatementImportError(f'Missing column(s) in file: {", ".join(sorted(missing_columns))}')
+
+        for row in reader:
+            try:
+                timestamp = datetime.strptime(row[date_column].strip(), date_format) if date_format \
+                    else datetime.fromisoformat(row[date_column].strip())
+
+                if time_column and row[time_column].strip():
+                    timestamp = datetime.combine(timestamp.date(), time.fromisoformat(row[time_column].strip()))
+
+                yield reader.line_num, {
+                    'description': row[description_column].strip(),
+                    'timestamp': timestamp,
+                    'amount': float(row[amount_column].strip().replace(',', '.')),
+                    'category': row[category_column].strip() if category_column else None
+                }
+
+            except (ValueError, TypeError, AttributeError) as conversion_error:
+                yield reader.line_num, StatementImportError(str(conversion_error))
+
+    except csv.Error as csv_error:
+        raise StatementImportError(f'line {reader.line_num}: {csv_error}')
+
+
+_OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.IGNORECASE | re.DOTALL)
+_OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def _parse_ofx_datetime(value):
+    # ofx dates: YYYYMMDD[HHMMSS[.XXX]][[gmt offset:tz name]]
+    value = value.split('[')[0].split('.')[0]
+    if len(value) >= 14:
+        return datetime.strptime(value[:14], '%Y%m%d%H%M%S')
+
+    return datetime.combine(datetime.strptime(value[:8], '%Y%m%d').date(), time())
+
+
+def read_ofx_statement(file, chunk_size=64 * 1024):
+    # ofx (sgml or xml) files are read in chunks, keeping only the incomplete transaction in the buffer
+    stream = io.TextIOWrapper(file, encoding='utf-8', errors='replace')
+
+    buffer, transaction_number = '', 0
+    while chunk := stream.read(chunk_size):
+        buffer += chunk
+
+        last_end = 0
+        for match in _OFX_TRANSACTION.finditer(buffer):
+            last_end = match.end()
+            transaction_number += 1
+
+            fields = {tag.upper(): value.strip() for tag, value in _OFX_FIELD.findall(match.group(1))}
+            try:
+                yield transaction_number, {
+                    'description': fields.get('NAME') or fields.get('MEMO') or fields.get('PAYEE') or '',
+                    'timestamp': _parse_ofx_datetime(fields['DTPOSTED']),
+                    'amount': float(fields['TRNAMT'].replace(',', '.')),
+                    'category': None
+                }
+
+            except (KeyError, ValueError) as conversion_error:
+                yield transaction_number, StatementImportError(f'Invalid transaction: {conversion_error}')
+
+        # drop everything before the next (incomplete) transaction
+        buffer = buffer[last_end:]
+        if (transaction_start := buffer.upper().rfind('<STMTTRN>')) >= 0:
+            buffer = buffer[transaction_start:]
+
+        else:
+            buffer = buffer[-len('<STMTTRN>'):]
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def expense_key(timestamp, amount, description):
+    # key used to detect statement lines already imported
+    return timestamp, round(amount, 2), description
@@ -0,0 +1,26 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def after_commit(session, callback):
+    # callbacks are kept in the session info and only run if the current transaction commits
+    session.info.setdefault('after_commit_callbacks', list()).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_callbacks(session):
+    for callback in session.info.pop('after_commit_callbacks', list()):
+        try:
+            callback()
+
+        except Exception as callback_error:
+            logger.error(f'After commit callback {callback} failed:', exc_info=callback_error)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_commit_callbacks(session):
+    session.info.pop('after_commit_callbacks', None)
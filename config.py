@@ -1,4 +1,5 @@
-from os import getenv
+from os import getenv, path
+from tempfile import gettempdir
 
 
 class Config:
@@ -6,13 +7,125 @@ class Config:
     FLASK_DEBUG = getenv('FLASK_DEBUG')
     SECRET_KEY = getenv('SECRET_KEY')
 
-    # jwt configuration
+    # jwt configuration (jwt errors must be propagated by flask restful to the jwt error handlers)
+    PROPAGATE_EXCEPTIONS = True
     JWT_SECRET_KEY = getenv('JWT_SECRET_KEY', SECRET_KEY)
     JWT_ACCESS_TOKEN_EXPIRES = int(getenv('JWT_ACCESS_TOKEN_EXPIRES', 900))
     JWT_REFRESH_TOKEN_EXPIRES = int(getenv('JWT_REFRESH_TOKEN_EXPIRES', 1800))
+    JWT_IDENTITY_CACHE_SIZE = int(getenv('JWT_IDENTITY_CACHE_SIZE', 10000))
+    JWT_IDENTITY_CACHE_TTL = int(getenv('JWT_IDENTITY_CACHE_TTL', 30))
+
+    # passwords hashing configuration (argon2[:time_cost:memory_cost:parallelism], scrypt:n:r:p or
+    # pbkdf2:hash:iterations), legacy hashes are rehashed on login
+    PASSWORD_HASH_METHOD = getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(getenv('PASSWORD_HASH_QUEUE_SIZE', 32))
+    PASSWORD_HASH_TIMEOUT = float(getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+    # rate limiting configurations (limits as "<requests>/<seconds>", memory:// or redis:// storage)
+    RATELIMIT_STORAGE_URL = getenv('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_MAX_KEYS = int(getenv('RATELIMIT_MAX_KEYS', 100000))
+    LOGIN_IP_RATE_LIMIT = getenv('LOGIN_IP_RATE_LIMIT', '20/60')
+    LOGIN_ACCOUNT_RATE_LIMIT = getenv('LOGIN_ACCOUNT_RATE_LIMIT', '5/60')
+    USER_AVAILABILITY_RATE_LIMIT = getenv('USER_AVAILABILITY_RATE_LIMIT', '120/60')
+
+    # usernames and emails availability filter: expected users (grows when exceeded) and false positives rate (checks
+    # confirmed with the database)
+    USER_AVAILABILITY_CAPACITY = int(getenv('USER_AVAILABILITY_CAPACITY', 1000000))
+    USER_AVAILABILITY_ERROR_RATE = float(getenv('USER_AVAILABILITY_ERROR_RATE', 0.01))
+
+    # admission control of the expensive endpoints: "<concurrent>/<waiting>" requests per process, waiting requests
+    # timeout (seconds), concurrent requests of each user, statement timeout (milliseconds, postgres, 0 disables)
+    HISTORY_CHART_ADMISSION_LIMIT = getenv('HISTORY_CHART_ADMISSION_LIMIT', '4/8')
+    CATEGORIES_CHART_ADMISSION_LIMIT = getenv('CATEGORIES_CHART_ADMISSION_LIMIT', '4/8')
+    CATEGORIES_BALANCE_ADMISSION_LIMIT = getenv('CATEGORIES_BALANCE_ADMISSION_LIMIT', '4/8')
+    EXPENSES_DATATABLE_ADMISSION_LIMIT = getenv('EXPENSES_DATATABLE_ADMISSION_LIMIT', '8/16')
+    ADMISSION_QUEUE_TIMEOUT = float(getenv('ADMISSION_QUEUE_TIMEOUT', 2))
+    ADMISSION_USER_CONCURRENCY = int(getenv('ADMISSION_USER_CONCURRENCY', 2))
+    ADMISSION_RETRY_AFTER = int(getenv('ADMISSION_RETRY_AFTER', 1))
+    ADMISSION_STATEMENT_TIMEOUT = int(getenv('ADMISSION_STATEMENT_TIMEOUT', 5000))
+
+    # requests size limits: datatables page length (negative lengths included), date ranges and history months
+    DATATABLE_MAX_PAGE_LENGTH = int(getenv('DATATABLE_MAX_PAGE_LENGTH', 500))
+    MAX_DATE_RANGE_DAYS = int(getenv('MAX_DATE_RANGE_DAYS', 731))
+    MAX_HISTORY_MONTHS = int(getenv('MAX_HISTORY_MONTHS', 36))
 
     # database configurations
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = getenv('DATABASE_URL')
 
+    # connections pools of the primary database and the shards (sqlalchemy defaults unless given), raised for the
+    # asgi serving mode (see asgi.py) where the pool bounds the requests querying at once
+    SQLALCHEMY_ENGINE_OPTIONS = {option: int(value) for option, value in {
+        'pool_size': getenv('DATABASE_POOL_SIZE'),
+        'max_overflow': getenv('DATABASE_MAX_OVERFLOW')
+    }.items() if value}
+
+    # users data shards as comma separated name=url pairs (the primary database is the default shard)
+    SQLALCHEMY_SHARDS = dict(shard.strip().split('=', 1) for shard in getenv('DATABASE_SHARDS', '').split(',')
+                             if shard.strip())
+    SHARD_RING_REPLICAS = int(getenv('SHARD_RING_REPLICAS', 64))
+    SHARD_DIRECTORY_CACHE_SIZE = int(getenv('SHARD_DIRECTORY_CACHE_SIZE', 100000))
+    SHARD_DIRECTORY_CACHE_TTL = int(getenv('SHARD_DIRECTORY_CACHE_TTL', 3600))
+
+    # expense table partitioning by timestamp (month or year, postgres >= 11), applied by the database migrations
+    EXPENSE_PARTITION_INTERVAL = getenv('EXPENSE_PARTITION_INTERVAL', '')
+    EXPENSE_PARTITIONS_AHEAD = int(getenv('EXPENSE_PARTITIONS_AHEAD', 3))
+
+    # expenses older than the given days are moved to the archive (0 disables archiving)
+    EXPENSE_ARCHIVE_AFTER_DAYS = int(getenv('EXPENSE_ARCHIVE_AFTER_DAYS', 0))
+    EXPENSE_ARCHIVE_BATCH_SIZE = int(getenv('EXPENSE_ARCHIVE_BATCH_SIZE', 1000))
+
+    # recurring expenses occurrences inserted at a time and on each shard per run (the next run continues)
+    RECURRING_EXPENSES_BATCH_SIZE = int(getenv('RECURRING_EXPENSES_BATCH_SIZE', 1000))
+    RECURRING_EXPENSES_MAX_OCCURRENCES = int(getenv('RECURRING_EXPENSES_MAX_OCCURRENCES', 100000))
+
+    # background jobs configurations
+    JOB_QUEUE_WORKERS = int(getenv('JOB_QUEUE_WORKERS', 2))
+    JOB_QUEUE_POLL_INTERVAL = float(getenv('JOB_QUEUE_POLL_INTERVAL', 1))
+    JOB_QUEUE_MAX_ATTEMPTS = int(getenv('JOB_QUEUE_MAX_ATTEMPTS', 5))
+    JOB_QUEUE_RETRY_BACKOFF = float(getenv('JOB_QUEUE_RETRY_BACKOFF', 2))
+    JOB_QUEUE_MAX_RETRY_BACKOFF = float(getenv('JOB_QUEUE_MAX_RETRY_BACKOFF', 300))
+    JOB_QUEUE_STALE_TIMEOUT = int(getenv('JOB_QUEUE_STALE_TIMEOUT', 600))
+
+    # cross process notifications configurations (notification table polling when postgres is not used)
+    PUBSUB_POLL_INTERVAL = float(getenv('PUBSUB_POLL_INTERVAL', 1))
+    PUBSUB_RETENTION = int(getenv('PUBSUB_RETENTION', 300))
+
+    # currencies: users default currency, exchange rates reference currency (rates are units of each currency per
+    # unit of it) and cache of the rates lookups and users currencies
+    DEFAULT_CURRENCY = getenv('DEFAULT_CURRENCY', 'EUR')
+    EXCHANGE_RATES_REFERENCE_CURRENCY = getenv('EXCHANGE_RATES_REFERENCE_CURRENCY', 'EUR')
+    EXCHANGE_RATES_CACHE_SIZE = int(getenv('EXCHANGE_RATES_CACHE_SIZE', 10000))
+    EXCHANGE_RATES_CACHE_TTL = int(getenv('EXCHANGE_RATES_CACHE_TTL', 3600))
+
+    # categories cache configurations
+    CATEGORY_CACHE_MAX_USERS = int(getenv('CATEGORY_CACHE_MAX_USERS', 10000))
+    CATEGORY_CACHE_TTL = int(getenv('CATEGORY_CACHE_TTL', 3600))
+
+    # users data change events (server-sent events) configurations
+    EVENTS_BUFFER_SIZE = int(getenv('EVENTS_BUFFER_SIZE', 100))
+    EVENTS_HEARTBEAT_INTERVAL = int(getenv('EVENTS_HEARTBEAT_INTERVAL', 15))
+    EVENTS_MAX_SUBSCRIPTIONS = int(getenv('EVENTS_MAX_SUBSCRIPTIONS', 100))
+    EVENTS_MAX_BATCH_SIZE = int(getenv('EVENTS_MAX_BATCH_SIZE', 50))
+
+    # expenses import configurations (uploads up to the spool size in bytes are kept in memory, bigger ones in a
+    # temporary file)
+    IMPORT_BATCH_SIZE = int(getenv('IMPORT_BATCH_SIZE', 1000))
+    IMPORT_SPOOL_MAX_SIZE = int(getenv('IMPORT_SPOOL_MAX_SIZE', 1024 * 1024))
+
+    # expenses descriptions autocomplete configurations
+    AUTOCOMPLETE_MAX_USERS = int(getenv('AUTOCOMPLETE_MAX_USERS', 1000))
+    AUTOCOMPLETE_TTL = int(getenv('AUTOCOMPLETE_TTL', 3600))
+    AUTOCOMPLETE_HALF_LIFE_DAYS = float(getenv('AUTOCOMPLETE_HALF_LIFE_DAYS', 30))
+
+    # expenses share permissions cache configurations (invalidated by notifications, the ttl is a backstop)
+    SHARE_PERMISSIONS_MAX_USERS = int(getenv('SHARE_PERMISSIONS_MAX_USERS', 10000))
+    SHARE_PERMISSIONS_TTL = int(getenv('SHARE_PERMISSIONS_TTL', 300))
 
+    # asynchronous reports: result files directory and time to live (seconds), pending reports of each user and rows
+    # read from the database at a time
+    REPORTS_DIRECTORY = getenv('REPORTS_DIRECTORY', path.join(gettempdir(), 'manymanager-reports'))
+    REPORTS_TTL = int(getenv('REPORTS_TTL', 24 * 60 * 60))
+    REPORTS_MAX_PENDING = int(getenv('REPORTS_MAX_PENDING', 2))
+    REPORTS_BATCH_SIZE = int(getenv('REPORTS_BATCH_SIZE', 1000))
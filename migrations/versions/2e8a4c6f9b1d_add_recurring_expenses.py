@@ -0,0 +1,44 @@
+"""add expenses recurring expense
+
+Revision ID: 2e8a4c6f9b1d
+Revises: 9d4f6b8c2e1a
+Create Date: 2026-10-19 20:03:51.284617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e8a4c6f9b1d'
+down_revision = '9d4f6b8c2e1a'
+branch_labels = None
+depends_on = None
+
+
+def _has_column():
+    return 'recurring_expense_id' in {column['name'] for column in sa.inspect(op.get_bind()).get_columns('expense')}
+
+
+def upgrade():
+    # recurring_expense table is created by the application, expense tables created by the application already have
+    # the column
+    if _has_column():
+        return
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recurring_expense_id', sa.BigInteger(), nullable=True))
+        batch_op.create_foreign_key('expense_recurring_expense_id_fkey', 'recurring_expense',
+                                    ['recurring_expense_id'], ['id'])
+        batch_op.create_index('ux_expense_recurring_expense_id_timestamp', ['recurring_expense_id', 'timestamp'],
+                              unique=True)
+
+
+def downgrade():
+    if not _has_column():
+        return
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.drop_index('ux_expense_recurring_expense_id_timestamp')
+        batch_op.drop_constraint('expense_recurring_expense_id_fkey', type_='foreignkey')
+        batch_op.drop_column('recurring_expense_id')
@@ -0,0 +1,33 @@
+"""widen user password hash column
+
+Revision ID: 3f1c2a9d8b7e
+Revises: 
+Create Date: 2026-10-19 10:12:31.417205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # scrypt and argon2 hashes do not fit in 128 characters
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+                              existing_type=sa.String(length=128),
+                              type_=sa.String(length=255),
+                              existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+                              existing_type=sa.String(length=255),
+                              type_=sa.String(length=128),
+                              existing_nullable=False)
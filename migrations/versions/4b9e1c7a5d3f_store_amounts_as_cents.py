@@ -0,0 +1,59 @@
+"""store amounts as integer cents
+
+Revision ID: 4b9e1c7a5d3f
+Revises: 7a3f5d1e8c2b
+Create Date: 2026-10-19 22:47:18.395162
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b9e1c7a5d3f'
+down_revision = '7a3f5d1e8c2b'
+branch_labels = None
+depends_on = None
+
+MONEY_COLUMNS = (('category', 'limit'), ('expense', 'amount'), ('archived_expense', 'amount'),
+                 ('expense_summary', 'amount'), ('recurring_expense', 'amount'), ('balance', 'amount'))
+
+
+def _is_cents(table, column):
+    # None when the table does not exist (tables created by the application already have cents)
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return None
+
+    return isinstance(next(c['type'] for c in inspector.get_columns(table) if c['name'] == column), sa.Integer)
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for table, column in MONEY_COLUMNS:
+        if _is_cents(table, column) is not False:
+            continue
+
+        # other databases convert the values before changing the column type (table copy)
+        if not postgres:
+            op.execute(sa.table(table, sa.column(column)).update()
+                       .values({column: sa.func.round(sa.column(column) * 100)}))
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.Float(), type_=sa.BigInteger(),
+                                  postgresql_using=f'round("{column}" * 100)::bigint')
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for table, column in reversed(MONEY_COLUMNS):
+        if not _is_cents(table, column):
+            continue
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.BigInteger(), type_=sa.Float(),
+                                  postgresql_using=f'"{column}" / 100.0')
+
+        if not postgres:
+            op.execute(sa.table(table, sa.column(column)).update()
+                       .values({column: sa.column(column) / 100.0}))
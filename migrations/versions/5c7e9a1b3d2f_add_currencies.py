@@ -0,0 +1,60 @@
+"""add users and expenses currencies
+
+Revision ID: 5c7e9a1b3d2f
+Revises: 8b2d4e6f1a3c
+Create Date: 2026-10-19 16:41:07.502318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '5c7e9a1b3d2f'
+down_revision = '8b2d4e6f1a3c'
+branch_labels = None
+depends_on = None
+
+CURRENCY_TABLES = ('user', 'expense', 'archived_expense', 'expense_summary')
+
+
+def _columns(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return None
+
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade():
+    # existing users and expenses are in the default currency (tables created by the application already have it)
+    default_currency = current_app.config.get('DEFAULT_CURRENCY', 'EUR')
+    for table in CURRENCY_TABLES:
+        if (columns := _columns(table)) is None or 'currency' in columns:
+            continue
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('currency', sa.String(length=3), nullable=False,
+                                          server_default=default_currency))
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('currency', existing_type=sa.String(length=3), server_default=None)
+
+            # archived expenses monthly summaries of each currency
+            if table == 'expense_summary':
+                batch_op.drop_constraint('expense_summary_pkey', type_='primary')
+                batch_op.create_primary_key('expense_summary_pkey', ['user_id', 'category_id', 'month', 'currency'])
+
+
+def downgrade():
+    for table in reversed(CURRENCY_TABLES):
+        if (columns := _columns(table)) is None or 'currency' not in columns:
+            continue
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            if table == 'expense_summary':
+                batch_op.drop_constraint('expense_summary_pkey', type_='primary')
+                batch_op.create_primary_key('expense_summary_pkey', ['user_id', 'category_id', 'month'])
+
+            batch_op.drop_column('currency')
@@ -0,0 +1,40 @@
+"""add expense user timestamp index
+
+Revision ID: 6d1b8f3a2c9e
+Revises: 4b9e1c7a5d3f
+Create Date: 2026-10-20 09:14:27.503218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from commons.partitions import is_partitioned
+
+
+# revision identifiers, used by Alembic.
+revision = '6d1b8f3a2c9e'
+down_revision = '4b9e1c7a5d3f'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['user_id', 'timestamp', 'amount', 'description']
+
+
+def _has_index():
+    return 'ix_expense_user_id_timestamp' in \
+        {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('expense')}
+
+
+def upgrade():
+    # user date interval queries and import deduplication lookups (tables created by the application and partitioned
+    # tables already have it)
+    if _has_index():
+        return
+
+    op.create_index('ix_expense_user_id_timestamp', 'expense', COLUMNS)
+
+
+def downgrade():
+    # the partitioned table index is renamed by the partitioning migration downgrade
+    if _has_index() and not is_partitioned(op.get_bind(), 'expense'):
+        op.drop_index('ix_expense_user_id_timestamp', table_name='expense')
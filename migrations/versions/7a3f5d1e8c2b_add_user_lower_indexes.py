@@ -0,0 +1,37 @@
+"""add users lower username and email indexes
+
+Revision ID: 7a3f5d1e8c2b
+Revises: 2e8a4c6f9b1d
+Create Date: 2026-10-19 21:12:36.840529
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3f5d1e8c2b'
+down_revision = '2e8a4c6f9b1d'
+branch_labels = None
+depends_on = None
+
+USER_INDEXES = {'ix_user_lower_username': 'username', 'ix_user_lower_email': 'email'}
+
+
+def _indexes():
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('user')}
+
+
+def upgrade():
+    # case insensitive availability lookups (tables created by the application already have them)
+    indexes = _indexes()
+    for name, column in USER_INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, 'user', [sa.text(f'lower({column})')])
+
+
+def downgrade():
+    indexes = _indexes()
+    for name in USER_INDEXES:
+        if name in indexes:
+            op.drop_index(name, table_name='user')
@@ -0,0 +1,82 @@
+"""partition expense table by timestamp
+
+Revision ID: 8b2d4e6f1a3c
+Revises: 3f1c2a9d8b7e
+Create Date: 2026-10-19 14:03:52.118730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+import logging
+
+from commons.partitions import supports_partitions, is_partitioned, create_partitions, ensure_partitions
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e6f1a3c'
+down_revision = '3f1c2a9d8b7e'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    # optional: only with EXPENSE_PARTITION_INTERVAL (month or year) set and postgres >= 11
+    connection = op.get_bind()
+    if not (interval := current_app.config.get('EXPENSE_PARTITION_INTERVAL')) or \
+            not supports_partitions(connection) or is_partitioned(connection, 'expense'):
+        logger.info('Expense table partitioning skipped')
+        return
+
+    op.rename_table('expense', 'expense_unpartitioned')
+    op.execute('ALTER TABLE expense_unpartitioned RENAME CONSTRAINT expense_pkey TO expense_unpartitioned_pkey')
+    op.execute('ALTER INDEX IF EXISTS ix_expense_user_id_timestamp '
+               'RENAME TO ix_expense_unpartitioned_user_id_timestamp')
+
+    # the partition key must be part of the primary key, the parent expense foreign key cannot reference the
+    # partitioned table (the relationship is kept by the orm)
+    op.execute('CREATE TABLE expense (LIKE expense_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)')
+    op.create_primary_key('expense_pkey', 'expense', ['id', 'timestamp'])
+    op.create_foreign_key('expense_user_id_fkey', 'expense', 'user', ['user_id'], ['id'])
+    op.create_foreign_key('expense_category_id_fkey', 'expense', 'category', ['category_id'], ['id'])
+    op.create_index('ix_expense_user_id_timestamp', 'expense', ['user_id', 'timestamp', 'amount', 'description'])
+
+    # partitions of the existing expenses and the next periods, rows out of them go to the default partition
+    start, end = connection.execute(sa.text('SELECT min(timestamp), max(timestamp) FROM expense_unpartitioned')).one()
+    if start:
+        create_partitions(connection, 'expense', interval, start, end)
+
+    ensure_partitions(connection, 'expense', interval, current_app.config.get('EXPENSE_PARTITIONS_AHEAD', 3))
+    op.execute('CREATE TABLE expense_default PARTITION OF expense DEFAULT')
+
+    op.execute('INSERT INTO expense SELECT * FROM expense_unpartitioned')
+
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('expense_unpartitioned', 'id')")).scalar()
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY expense.id')
+    op.drop_table('expense_unpartitioned')
+
+
+def downgrade():
+    connection = op.get_bind()
+    if not is_partitioned(connection, 'expense'):
+        return
+
+    op.rename_table('expense', 'expense_partitioned')
+    op.execute('ALTER TABLE expense_partitioned RENAME CONSTRAINT expense_pkey TO expense_partitioned_pkey')
+    op.execute('ALTER INDEX ix_expense_user_id_timestamp RENAME TO ix_expense_partitioned_user_id_timestamp')
+
+    op.execute('CREATE TABLE expense (LIKE expense_partitioned INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO expense SELECT * FROM expense_partitioned')
+
+    op.create_primary_key('expense_pkey', 'expense', ['id'])
+    op.create_foreign_key('expense_user_id_fkey', 'expense', 'user', ['user_id'], ['id'])
+    op.create_foreign_key('expense_category_id_fkey', 'expense', 'category', ['category_id'], ['id'])
+    op.create_foreign_key('expense_parent_id_fkey', 'expense', 'expense', ['parent_id'], ['id'])
+    op.create_index('ix_expense_user_id_timestamp', 'expense', ['user_id', 'timestamp', 'amount', 'description'])
+
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('expense_partitioned', 'id')")).scalar()
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY expense.id')
+    op.drop_table('expense_partitioned')  # partitions are dropped with the partitioned table
@@ -0,0 +1,35 @@
+"""add expense favorites partial index
+
+Revision ID: 9d4f6b8c2e1a
+Revises: 5c7e9a1b3d2f
+Create Date: 2026-10-19 18:22:45.913406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f6b8c2e1a'
+down_revision = '5c7e9a1b3d2f'
+branch_labels = None
+depends_on = None
+
+
+def _has_index():
+    return 'ix_expense_user_id_favorite_order' in \
+        {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('expense')}
+
+
+def upgrade():
+    # only the favorite expenses are indexed (tables created by the application already have it)
+    if _has_index():
+        return
+
+    op.create_index('ix_expense_user_id_favorite_order', 'expense', ['user_id', 'favorite_order'],
+                    postgresql_where=sa.text('is_favorite'), sqlite_where=sa.text('is_favorite = 1'))
+
+
+def downgrade():
+    if _has_index():
+        op.drop_index('ix_expense_user_id_favorite_order', table_name='expense')
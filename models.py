@@ -1,8 +1,16 @@
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, aliased
 
-from datetime import datetime
+from uuid import uuid4
+from datetime import datetime, timedelta
+from itertools import product
+from collections import defaultdict
 
-from app import db
+from app import db, password_hasher, share_permissions, category_cache, event_broker, job_queue, shard_router, \
+    exchange_rates
+from commons.recurrence import occurrence, due_occurrences
+from commons.money import Money
 
 
 class Share(db.Model):
@@ -21,14 +29,19 @@ class User(db.Model):
     def update_timestamp(context):
         context.get_current_parameters()['updated_timestamp'] = datetime.now()
 
-    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
     email = db.Column(db.String(25), nullable=False, unique=True)
     username = db.Column(db.String(20), nullable=False, unique=True)
-    password_hash = db.Column(db.String(128), name='password', nullable=False)
+    password_hash = db.Column(db.String(255), name='password', nullable=False)
     active = db.Column(db.Boolean, default=True)
+    currency = db.Column(db.String(3), nullable=False, default=lambda: current_app.config['DEFAULT_CURRENCY'])
     created_timestamp = db.Column(db.DateTime, default=datetime.now)
     updated_timestamp = db.Column(db.DateTime, nullable=True, onupdate=update_timestamp)
 
+    # case insensitive usernames and emails availability lookups
+    __table_args__ = (db.Index('ix_user_lower_username', db.func.lower(username)),
+                      db.Index('ix_user_lower_email', db.func.lower(email)))
+
     # share *--* relationship
     shared_by = db.relationship('Share', foreign_keys=Share.shared_by_user_id)
     shared_with = db.relationship('Share', foreign_keys=Share.shared_with_user_id)
@@ -45,17 +58,21 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    @property
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
 
 class Category(db.Model):
 
-    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
     name = db.Column(db.String(20), nullable=False)
-    limit = db.Column(db.Float, default=0)
+    limit = db.Column(Money, default=0)
     background_color = db.Column(db.String(7), name='color', nullable=False)
     text_color = db.Column(db.String(7), nullable=False)
     active = db.Column(db.Boolean, default=True)
@@ -94,10 +111,15 @@ class Category(db.Model):
 
 class Expense(db.Model):
 
-    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    @staticmethod
+    def user_currency(context):
+        return exchange_rates.user_currency(context.get_current_parameters()['user_id'])
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
     description = db.Column(db.String(50), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=user_currency)
     paid = db.Column(db.Boolean, default=True)
     is_favorite = db.Column(db.Boolean, default=False)
     favorite_order = db.Column(db.Integer, nullable=True)
@@ -114,6 +136,17 @@ class Expense(db.Model):
     parent_id = db.Column(db.BigInteger, db.ForeignKey('expense.id'), nullable=True)
     children = db.relationship('Expense', cascade='all, delete')
 
+    # recurring expense 1--* relationship (materialized occurrences)
+    recurring_expense_id = db.Column(db.BigInteger, db.ForeignKey('recurring_expense.id'), nullable=True)
+
+    # user date interval queries and import deduplication lookups, favorites (partial index, only the favorites),
+    # recurring expenses occurrences materialized once
+    __table_args__ = (db.Index('ix_expense_user_id_timestamp', user_id, timestamp, amount, description),
+                      db.Index('ix_expense_user_id_favorite_order', user_id, favorite_order,
+                               postgresql_where=is_favorite, sqlite_where=is_favorite == db.true()),
+                      db.Index('ux_expense_recurring_expense_id_timestamp', recurring_expense_id, timestamp,
+                               unique=True))
+
     @property
     def is_shared(self):
         return any(self.children) or self.parent_id is not None
@@ -143,11 +176,7 @@ class Expense(db.Model):
         if isinstance(share_with_user, User):
             share_with_user = share_with_user.id
 
-        if not Share.query \
-                .join(User, Share.shared_with_user_id == User.id) \
-                .filter(Share.shared_by_user_id == self.user_id,
-                        Share.shared_with_user_id == share_with_user,
-                        User.active).count():
+        if not share_permissions.is_allowed(self.user_id, share_with_user):
             raise PermissionError(f'{self.user_id} has no permission to share expenses with {share_with_user} '
                                   f'or user is disabled')
 
@@ -155,5 +184,700 @@ class Expense(db.Model):
                        description=self.description,
                        timestamp=self.timestamp,
                        amount=amount,
+                       currency=self.currency,
                        paid=paid,
                        parent_id=self.id)
+
+
+class RecurringExpense(db.Model):
+
+    # expenses repeated on a schedule (see commons.recurrence), the first count occurrences are materialized as
+    # expenses and next_timestamp is the next one. removed recurring expenses are kept inactive
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), nullable=False, index=True)
+    category_id = db.Column(db.BigInteger, db.ForeignKey('category.id'))
+    description = db.Column(db.String(50), nullable=False)
+    amount = db.Column(Money, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=Expense.user_currency)
+    paid = db.Column(db.Boolean, default=True)
+    shares = db.Column(db.JSON, nullable=False, default=list)
+    frequency = db.Column(db.String(10), nullable=False)
+    interval = db.Column(db.Integer, nullable=False, default=1)
+    start_timestamp = db.Column(db.DateTime, nullable=False)
+    end_timestamp = db.Column(db.DateTime, nullable=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    next_timestamp = db.Column(db.DateTime, nullable=False)
+    active = db.Column(db.Boolean, default=True)
+    created_timestamp = db.Column(db.DateTime, default=datetime.now)
+
+    # due recurring expenses lookups (partial index, only the active ones)
+    __table_args__ = (db.Index('ix_recurring_expense_next_timestamp', next_timestamp,
+                               postgresql_where=active, sqlite_where=active == db.true()),)
+
+    @staticmethod
+    def materialize(session, until, batch_size):
+        # inserts the occurrences due until the given time of a batch of recurring expenses (catching up the missed
+        # ones, at most batch_size in total), advancing them in the same transaction. returns the inserted expenses
+        # ids of each user of the batch
+        recurring_table = RecurringExpense.__table__
+        recurring_expenses = session.execute(db.select(recurring_table)
+                                             .where(recurring_table.c.active,
+                                                    recurring_table.c.next_timestamp <= until)
+                                             .order_by(recurring_table.c.next_timestamp)
+                                             .limit(batch_size)
+                                             .with_for_update(skip_locked=True)).all()
+        if not recurring_expenses:
+            return dict()
+
+        rows, schedules = list(), list()
+        for recurring_expense in recurring_expenses:
+            # recurring expenses left once the batch is full are kept due for the next batch
+            if len(rows) >= batch_size:
+                break
+
+            schedule = (recurring_expense.start_timestamp, recurring_expense.frequency, recurring_expense.interval)
+            due = due_occurrences(*schedule, recurring_expense.count, until, recurring_expense.end_timestamp,
+                                  batch_size - len(rows))
+
+            rows.extend({
+                'user_id': recurring_expense.user_id,
+                'category_id': recurring_expense.category_id,
+                'description': recurring_expense.description,
+                'timestamp': timestamp,
+                'amount': recurring_expense.amount,
+                'currency': recurring_expense.currency,
+                'paid': recurring_expense.paid,
+                'recurring_expense_id': recurring_expense.id
+            } for _, timestamp in due)
+
+            # finished schedules are deactivated
+            count = recurring_expense.count + len(due)
+            next_timestamp = occurrence(*schedule, count)
+            schedules.append({
+                'recurring_expense_id': recurring_expense.id,
+                'count': count,
+                'next_timestamp': next_timestamp,
+                'active': recurring_expense.end_timestamp is None or next_timestamp <= recurring_expense.end_timestamp
+            })
+
+        materialized = {recurring_expense.user_id: list() for recurring_expense in recurring_expenses[:len(schedules)]}
+        if rows:
+            expenses = session.execute(db.insert(Expense).returning(Expense.id,
+                                                                    Expense.user_id,
+                                                                    Expense.recurring_expense_id), rows).all()
+
+            # shares are created by the expense shares job, as for the expenses added by the users
+            shares = {recurring_expense.id: recurring_expense.shares for recurring_expense in recurring_expenses}
+            for expense_id, user_id, recurring_expense_id in expenses:
+                materialized[user_id].append(expense_id)
+
+                if shares[recurring_expense_id]:
+                    job_queue.enqueue('expense_shares', expense_id=expense_id, shares=shares[recurring_expense_id],
+                                      user_id=user_id)
+
+            # core inserts do not go through the session flush, the expenses changes are recorded here
+            Change.record(session, {(user_id, 'expense', expense_id): 'added'
+                                    for user_id, expense_ids in materialized.items() for expense_id in expense_ids})
+
+        session.execute(recurring_table.update()
+                        .where(recurring_table.c.id == db.bindparam('recurring_expense_id'))
+                        .values(count=db.bindparam('count'),
+                                next_timestamp=db.bindparam('next_timestamp'),
+                                active=db.bindparam('active')), schedules)
+
+        return materialized
+
+
+class Balance(db.Model):
+
+    # ledger of the shared expenses debts between each pair of users (user_id is always the lowest id):
+    # a positive amount is owed by user to other_user, a negative amount is owed by other_user to user.
+    # amounts are in the exchange rates reference currency, shown in the user currency
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), primary_key=True)
+    other_user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), primary_key=True)
+    amount = db.Column(Money, nullable=False, default=0)
+
+    user = db.relationship('User', foreign_keys=[user_id])
+    other_user = db.relationship('User', foreign_keys=[other_user_id])
+
+    @staticmethod
+    def pair(debtor_user_id, creditor_user_id, amount):
+        if debtor_user_id < creditor_user_id:
+            return (debtor_user_id, creditor_user_id), amount
+
+        return (creditor_user_id, debtor_user_id), -amount
+
+    @staticmethod
+    def apply(session, deltas):
+        balance_table = Balance.__table__
+        for (user_id, other_user_id), amount in deltas.items():
+            if not round(amount, 9):
+                continue
+
+            if not session.execute(balance_table.update()
+                                   .where(balance_table.c.user_id == user_id,
+                                          balance_table.c.other_user_id == other_user_id)
+                                   .values(amount=balance_table.c.amount + amount)).rowcount:
+                session.execute(balance_table.insert()
+                                .values(user_id=user_id, other_user_id=other_user_id, amount=amount))
+
+    @staticmethod
+    def get_user_balances(user_id):
+        # amounts are from the user point of view: positive when the other user owes the user
+        # balances are on the users shard, the usernames on the primary database
+        balances = Balance.query \
+            .with_entities(Balance.user_id, Balance.other_user_id, Balance.amount) \
+            .filter(db.or_(Balance.user_id == user_id, Balance.other_user_id == user_id), Balance.amount != 0) \
+            .all()
+
+        usernames = dict(User.query
+                         .filter(User.id.in_({other_user_id for balance in balances for other_user_id in balance[:2]}))
+                         .with_entities(User.id, User.username)
+                         .all())
+
+        # ledger amounts at the current exchange rate
+        rate = exchange_rates.convert(1, exchange_rates.reference_currency, exchange_rates.user_currency(user_id))
+
+        user_balances = list()
+        for balance_user_id, other_user_id, amount in balances:
+            if balance_user_id == user_id:
+                user_balances.append((other_user_id, -amount))
+
+            else:
+                user_balances.append((balance_user_id, amount))
+
+        return sorted(({
+            'user_id': other_user_id,
+            'username': usernames.get(other_user_id),
+            'amount': round(amount * rate, 2)
+        } for other_user_id, amount in user_balances), key=lambda balance: balance['username'] or '')
+
+    @staticmethod
+    def get_group_debts(user_id):
+        # debts (debtor, creditor, amount) of the sharing group of the user: every user connected to him
+        # through non settled balances
+        debts, visited, frontier = dict(), {user_id}, {user_id}
+        while frontier:
+            balances = Balance.query.filter(db.or_(Balance.user_id.in_(frontier), Balance.other_user_id.in_(frontier)),
+                                            Balance.amount != 0)
+
+            frontier = set()
+            for balance in balances:
+                if balance.amount > 0:
+                    debts[balance.user_id, balance.other_user_id] = balance.amount
+
+                else:
+                    debts[balance.other_user_id, balance.user_id] = -balance.amount
+
+                frontier.update({balance.user_id, balance.other_user_id}.difference(visited))
+
+            visited.update(frontier)
+
+        return [(debtor, creditor, amount) for (debtor, creditor), amount in debts.items()]
+
+    @staticmethod
+    def recompute_user_balances(user_id):
+        # rebuild the user ledger entries from the non paid shared expenses using aggregate sql
+        child, parent = aliased(Expense), aliased(Expense)
+        debts = db.session.query(child.user_id,
+                                 parent.user_id,
+                                 db.func.sum(ExchangeRate.converted(child.amount, child.currency, child.timestamp,
+                                                                    exchange_rates.reference_currency))) \
+            .join(parent, child.parent_id == parent.id) \
+            .filter(~child.paid,
+                    child.user_id != parent.user_id,
+                    db.or_(child.user_id == user_id, parent.user_id == user_id)) \
+            .group_by(child.user_id, parent.user_id)
+
+        deltas = defaultdict(float)
+        for debtor_user_id, creditor_user_id, amount in debts:
+            pair, amount = Balance.pair(debtor_user_id, creditor_user_id, amount)
+            deltas[pair] += amount
+
+        Balance.query \
+            .filter(db.or_(Balance.user_id == user_id, Balance.other_user_id == user_id)) \
+            .delete(synchronize_session=False)
+        Balance.apply(db.session, deltas)
+
+
+class Job(db.Model):
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    last_error = db.Column(db.Text, nullable=True)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    created_timestamp = db.Column(db.DateTime, default=datetime.now)
+    started_timestamp = db.Column(db.DateTime, nullable=True)
+
+    # workers look for pending jobs ordered by run_at
+    __table_args__ = (db.Index('ix_job_status_run_at', status, run_at),)
+
+
+class Report(db.Model):
+
+    # reports generated by the report job (status pending, running, done or failed) into the reports directory,
+    # removed with their file when expired. ids are random, they are part of the download urls
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid4().hex)
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), nullable=False, index=True)
+    format = db.Column(db.String(4), nullable=False)
+    parameters = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255), nullable=True)
+    created_timestamp = db.Column(db.DateTime, default=datetime.now)
+    finished_timestamp = db.Column(db.DateTime, nullable=True)
+    expires_timestamp = db.Column(db.DateTime, nullable=True, index=True)
+
+    @property
+    def file_name(self):
+        return f'{self.id}.{self.format}'
+
+
+class ArchivedExpense(db.Model):
+
+    # expenses older than the archive horizon (same ids), read only on explicit request
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), nullable=False)
+    category_id = db.Column(db.BigInteger, db.ForeignKey('category.id'))
+    description = db.Column(db.String(50), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    amount = db.Column(Money, nullable=False)
+    currency = db.Column(db.String(3), nullable=False)
+    paid = db.Column(db.Boolean, default=True)
+    archived_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (db.Index('ix_archived_expense_user_id_timestamp', user_id, timestamp),)
+
+    # archived expenses are never shared nor favorites
+    children = ()
+    parent_id = None
+    is_favorite = False
+    favorite_order = None
+    is_owner = True
+
+
+class ExpenseSummary(db.Model):
+
+    # monthly totals of the archived expenses of each user category (and currency)
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), primary_key=True)
+    category_id = db.Column(db.BigInteger, db.ForeignKey('category.id'), primary_key=True, autoincrement=False)
+    month = db.Column(db.DateTime, primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    amount = db.Column(Money, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def user_amounts(category=False):
+        # amounts (category_id, timestamp, amount) of the user expenses in the :start_date - :end_date interval
+        # (and :category_id) converted to :currency, archived expenses as their month totals from the :start_month
+        # (bound parameters of user_amounts_params)
+        expense_table, summary_table = Expense.__table__, ExpenseSummary.__table__
+        currency = db.bindparam('currency')
+
+        expenses = db.select(expense_table.c.category_id,
+                             expense_table.c.timestamp,
+                             ExchangeRate.converted(expense_table.c.amount,
+                                                    expense_table.c.currency,
+                                                    expense_table.c.timestamp,
+                                                    currency).label('amount')) \
+            .where(expense_table.c.user_id == db.bindparam('user_id'),
+                   expense_table.c.timestamp >= db.bindparam('start_date'),
+                   expense_table.c.timestamp <= db.bindparam('end_date'))
+
+        summaries = db.select(summary_table.c.category_id,
+                              summary_table.c.month,
+                              ExchangeRate.converted(summary_table.c.amount,
+                                                     summary_table.c.currency,
+                                                     summary_table.c.month,
+                                                     currency)) \
+            .where(summary_table.c.user_id == db.bindparam('user_id'),
+                   summary_table.c.month >= db.bindparam('start_month'),
+                   summary_table.c.month <= db.bindparam('end_date'))
+
+        if category:
+            expenses = expenses.where(expense_table.c.category_id == db.bindparam('category_id'))
+            summaries = summaries.where(summary_table.c.category_id == db.bindparam('category_id'))
+
+        return db.union_all(expenses, summaries).subquery('user_amounts')
+
+    @staticmethod
+    def user_amounts_params(user_id, start_date, end_date, category_id=None):
+        # the start date month is computed here, every database can compare it with the summaries months
+        return {'user_id': user_id,
+                'start_date': start_date,
+                'start_month': _month_interval(start_date)[0],
+                'end_date': end_date,
+                'category_id': category_id,
+                'currency': exchange_rates.user_currency(user_id)}
+
+    @staticmethod
+    def archive(session, horizon, batch_size):
+        # moves a batch of non shared and non favorite expenses older than the horizon to the archive, adding them
+        # to the monthly summaries. returns the archived expenses ids of each user
+        expense_table, child_expense = Expense.__table__, aliased(Expense)
+        expenses = session.execute(db.select(expense_table)
+                                   .where(expense_table.c.timestamp < horizon,
+                                          expense_table.c.parent_id.is_(None),
+                                          db.or_(expense_table.c.is_favorite.is_(None), ~expense_table.c.is_favorite),
+                                          ~db.select(child_expense.id)
+                                          .where(child_expense.parent_id == expense_table.c.id)
+                                          .exists())
+                                   .order_by(expense_table.c.timestamp)
+                                   .limit(batch_size)
+                                   .with_for_update(skip_locked=True)).all()
+        if not expenses:
+            return dict()
+
+        session.execute(db.insert(ArchivedExpense), [{
+            'id': expense.id,
+            'user_id': expense.user_id,
+            'category_id': expense.category_id,
+            'description': expense.description,
+            'timestamp': expense.timestamp,
+            'amount': expense.amount,
+            'currency': expense.currency,
+            'paid': expense.paid
+        } for expense in expenses])
+
+        summaries, archived = defaultdict(lambda: [0, 0]), defaultdict(list)
+        for expense in expenses:
+            month = expense.timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            summaries[expense.user_id, expense.category_id, month, expense.currency][0] += expense.amount
+            summaries[expense.user_id, expense.category_id, month, expense.currency][1] += 1
+            archived[expense.user_id].append(expense.id)
+
+        summary_table = ExpenseSummary.__table__
+        for (user_id, category_id, month, currency), (amount, count) in summaries.items():
+            if not session.execute(summary_table.update()
+                                   .where(summary_table.c.user_id == user_id,
+                                          summary_table.c.category_id == category_id,
+                                          summary_table.c.month == month,
+                                          summary_table.c.currency == currency)
+                                   .values(amount=summary_table.c.amount + amount,
+                                           count=summary_table.c.count + count)).rowcount:
+                session.execute(summary_table.insert()
+                                .values(user_id=user_id, category_id=category_id, month=month, currency=currency,
+                                        amount=amount, count=count))
+
+        session.execute(expense_table.delete().where(expense_table.c.id.in_([expense.id for expense in expenses])))
+
+        # core statements do not go through the session flush, the archived expenses changes are recorded here
+        Change.record(session, {(user_id, 'expense', expense_id): 'archived'
+                                for user_id, expense_ids in archived.items() for expense_id in expense_ids})
+
+        return archived
+
+
+class ExchangeRate(db.Model):
+
+    # units of the currency per unit of the reference currency from the date on (the reference currency has no
+    # rates), loaded by the exchange-rates command and replicated on every shard
+    currency = db.Column(db.String(3), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    rate = db.Column(db.Float, nullable=False)
+
+    @staticmethod
+    def rate_at(currency, timestamp):
+        # last rate on or before the timestamp, else the first one after it (correlated with the amounts rows, null
+        # only for currencies without rates, rejected by the api). the reference currency has no rates, bound when
+        # executed (statements are built on import)
+        reference_currency = db.bindparam('reference_currency', callable_=lambda: exchange_rates.reference_currency,
+                                          unique=True)
+        return db.case((currency == reference_currency, db.literal(1.0)),
+                       else_=db.func.coalesce(db.select(ExchangeRate.rate)
+                                              .where(ExchangeRate.currency == currency, ExchangeRate.date <= timestamp)
+                                              .order_by(ExchangeRate.date.desc())
+                                              .limit(1)
+                                              .scalar_subquery(),
+                                              db.select(ExchangeRate.rate)
+                                              .where(ExchangeRate.currency == currency)
+                                              .order_by(ExchangeRate.date)
+                                              .limit(1)
+                                              .scalar_subquery()))
+
+    @staticmethod
+    def converted(amount, currency, timestamp, to_currency):
+        # sql expression of the amount converted to the currency at the timestamp exchange rate, rounded to whole
+        # cents so the sums of converted amounts stay exact
+        return db.case((currency == to_currency, amount),
+                       else_=db.func.round(amount * ExchangeRate.rate_at(to_currency, timestamp) /
+                                           ExchangeRate.rate_at(currency, timestamp), type_=Money))
+
+
+class ShardDirectory(db.Model):
+
+    # database shard of each user (primary database), users without entry are on the default shard
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), primary_key=True)
+    shard = db.Column(db.String(30), nullable=False)
+
+
+class ChangeSequence(db.Model):
+
+    # last change sequence of each user
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), primary_key=True)
+    sequence = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def next(session, counts):
+        # returns the first of the new sequences of each user ({user_id: count}). the users rows are locked (in the
+        # users order, so concurrent transactions cannot deadlock) until the transaction ends, so the users changes
+        # are committed in sequence order
+        sequence_table = ChangeSequence.__table__
+        user_ids = sorted(counts)
+        session.execute(db.select(sequence_table.c.user_id)
+                        .where(sequence_table.c.user_id.in_(user_ids))
+                        .order_by(sequence_table.c.user_id)
+                        .with_for_update())
+
+        # one update for the users with the same count
+        users_counts, sequences = defaultdict(list), dict()
+        for user_id in user_ids:
+            users_counts[counts[user_id]].append(user_id)
+
+        for count, count_user_ids in users_counts.items():
+            sequences.update(session.execute(sequence_table.update()
+                                             .where(sequence_table.c.user_id.in_(count_user_ids))
+                                             .values(sequence=sequence_table.c.sequence + count)
+                                             .returning(sequence_table.c.user_id, sequence_table.c.sequence)).all())
+
+        if new_user_ids := [user_id for user_id in user_ids if user_id not in sequences]:
+            session.execute(sequence_table.insert(), [{'user_id': user_id, 'sequence': counts[user_id]}
+                                                      for user_id in new_user_ids])
+            sequences.update((user_id, counts[user_id]) for user_id in new_user_ids)
+
+        return {user_id: sequence - counts[user_id] + 1 for user_id, sequence in sequences.items()}
+
+
+class Change(db.Model):
+
+    # compacted change log: the last change (sequence) of each user entity, deleted entities are kept as tombstones
+    user_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), primary_key=True)
+    entity = db.Column(db.String(10), primary_key=True)
+    entity_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    sequence = db.Column(db.BigInteger, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+    # clients fetch the user changes after a sequence
+    __table_args__ = (db.Index('ix_change_user_id_sequence', user_id, sequence),)
+
+    @staticmethod
+    def record(session, changes, events=None):
+        # changes as {(user_id, entity, entity_id): operation (added, updated or deleted)}, published to the users
+        # event streams with the other events of the changes ({user_id: [event]})
+        user_changes = defaultdict(list)
+        for (user_id, entity, entity_id), operation in changes.items():
+            user_changes[user_id].append((entity, entity_id, operation))
+
+        # the changes of every user are written with a delete per entity and a single insert
+        events = events or defaultdict(list)
+        sequences = ChangeSequence.next(session, {user_id: len(user_changes[user_id]) for user_id in user_changes})
+        rows, entities = list(), defaultdict(list)
+        for user_id, user_changes in user_changes.items():
+            sequence = sequences[user_id]
+            for i, (entity, entity_id, operation) in enumerate(user_changes):
+                entities[entity].append((user_id, entity_id))
+                rows.append({
+                    'user_id': user_id,
+                    'entity': entity,
+                    'entity_id': entity_id,
+                    'sequence': sequence + i,
+                    'deleted': operation in ('deleted', 'archived')
+                })
+
+            events[user_id][:0] = [{'type': f'{entity}.{operation}', 'id': entity_id, 'sequence': sequence + i}
+                                   for i, (entity, entity_id, operation) in enumerate(user_changes)]
+
+        change_table = Change.__table__
+        for entity, keys in entities.items():
+            session.execute(change_table.delete()
+                            .where(change_table.c.entity == entity,
+                                   db.tuple_(change_table.c.user_id, change_table.c.entity_id).in_(keys)))
+
+        if rows:
+            session.execute(change_table.insert(), rows)
+
+        for user_id, user_events in events.items():
+            event_broker.publish(session, user_id, user_events)
+
+
+class Notification(db.Model):
+
+    # cross process notifications (when postgres LISTEN/NOTIFY is not available)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    channel = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+
+class RevokedToken(db.Model):
+
+    jti = db.Column(db.String(36), primary_key=True)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+
+def _previous_value(expense, key):
+    history = inspect(expense).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+
+    return (history.unchanged or history.added or [None])[0]
+
+
+def _converted_amount(expense, currency, value=getattr):
+    # expense amount (current or previous values) converted with the cached exchange rates
+    return exchange_rates.convert(value(expense, 'amount') or 0,
+                                  value(expense, 'currency') or exchange_rates.user_currency(expense.user_id),
+                                  currency,
+                                  value(expense, 'timestamp'))
+
+
+@event.listens_for(Expense, 'after_insert')
+@event.listens_for(Expense, 'after_update')
+@event.listens_for(Expense, 'after_delete')
+def _update_balances(mapper, connection, expense):
+    # keep the balance ledger up to date with the non paid shared expenses
+    if not expense.parent_id:
+        return
+
+    session, deltas = inspect(expense).session, defaultdict(float)
+
+    def add_debt(sign, value=getattr):
+        if not value(expense, 'amount') or value(expense, 'paid') is not False:
+            return
+
+        if (parent := session.get(Expense, expense.parent_id)) and parent.user_id != expense.user_id:
+            amount = _converted_amount(expense, exchange_rates.reference_currency, value)
+            pair, amount = Balance.pair(expense.user_id, parent.user_id, amount * sign)
+            deltas[pair] += amount
+
+    with session.no_autoflush:
+        if expense not in session.new:
+            add_debt(-1, _previous_value)
+
+        if expense not in session.deleted:
+            add_debt(1)
+
+    Balance.apply(session, deltas)
+
+
+@event.listens_for(Share, 'after_insert')
+@event.listens_for(Share, 'after_delete')
+def _invalidate_share_permissions(mapper, connection, share):
+    share_permissions.changed(inspect(share).session, share.shared_by_user_id)
+
+
+@event.listens_for(User, 'after_update')
+def _invalidate_users_share_permissions(mapper, connection, user):
+    # a disabled user may be in any allowed set
+    if inspect(user).attrs.active.history.has_changes():
+        share_permissions.changed(inspect(user).session)
+
+
+@event.listens_for(Share, 'after_insert')
+def _colocate_shared_users(mapper, connection, share):
+    # the shared with user is moved to the shard of the sharer
+    if (shard := shard_router.shard(share.shared_by_user_id)) != shard_router.shard(share.shared_with_user_id):
+        job_queue.enqueue('user_shard_move', primary=True, user_id=share.shared_with_user_id, shard=shard)
+
+
+@event.listens_for(User, 'after_insert')
+def _assign_shards(mapper, connection, user):
+    shard_router.assign(inspect(user).session, [user.id])
+
+
+def _month_interval(timestamp):
+    start = timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def _budget_breaches(session, spent):
+    # categories with the month limit exceeded by the amounts spent ({(user_id, category_id, month): amount}),
+    # amounts and limits in the user currency
+    for (user_id, category_id, month), amount in spent.items():
+        if amount <= 0 or not (category := category_cache.category(user_id, category_id)) or not category.limit:
+            continue
+
+        month_start, month_end = _month_interval(month)
+        total = session.execute(db.select(db.func.sum(ExchangeRate.converted(Expense.amount,
+                                                                             Expense.currency,
+                                                                             Expense.timestamp,
+                                                                             exchange_rates.user_currency(user_id))))
+                                .where(Expense.user_id == user_id,
+                                       Expense.category_id == category_id,
+                                       Expense.timestamp >= month_start,
+                                       Expense.timestamp < month_end)).scalar() or 0
+
+        if total > category.limit >= total - amount:
+            yield user_id, {'type': 'budget.breached',
+                            'category_id': category_id,
+                            'month': month_start.date().isoformat(),
+                            'limit': category.limit,
+                            'total': total}
+
+
+def _collect_changes(mapper, connection, instance):
+    inspect(instance).session.info.setdefault('flushed_changes', list()).append(instance)
+
+
+for mapped_class, mapper_event in product((Expense, Category, Share), ('after_insert', 'after_update', 'after_delete')):
+    event.listen(mapped_class, mapper_event, _collect_changes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    # change log and events of the collected changes, once per flush (limits are checked with the flush totals)
+    if not (instances := session.info.pop('flushed_changes', None)):
+        return
+
+    changes, events, spent = dict(), defaultdict(list), defaultdict(float)
+    with session.no_autoflush:
+        for instance in instances:
+            if instance in session.dirty and not session.is_modified(instance):
+                continue
+
+            operation = 'added' if instance in session.new else 'deleted' if instance in session.deleted \
+                else 'updated'
+            if isinstance(instance, Expense):
+                changes[instance.user_id, 'expense', instance.id] = operation
+
+                # the parent expense shares changed, the shared expense is received by the user
+                if instance.parent_id and (parent := session.get(Expense, instance.parent_id)):
+                    changes.setdefault((parent.user_id, 'expense', parent.id), 'updated')
+
+                    if operation == 'added' and parent.user_id != instance.user_id:
+                        events[instance.user_id].append({'type': 'share.received',
+                                                         'id': instance.id,
+                                                         'from_user_id': parent.user_id,
+                                                         'amount': instance.amount,
+                                                         'currency': instance.currency})
+
+                # amounts added to the categories months, checked against the categories limits
+                if operation != 'deleted' and instance.category_id and instance.amount:
+                    moved = operation == 'added' or any(_previous_value(instance, key) != getattr(instance, key)
+                                                        for key in ('category_id', 'timestamp'))
+                    currency = exchange_rates.user_currency(instance.user_id)
+                    spent[instance.user_id, instance.category_id, _month_interval(instance.timestamp)[0]] += \
+                        _converted_amount(instance, currency) - \
+                        (0 if moved else _converted_amount(instance, currency, _previous_value))
+
+            elif isinstance(instance, Category):
+                changes[instance.user_id, 'category', instance.id] = operation
+
+            elif isinstance(instance, Share):
+                changes[instance.shared_by_user_id, 'share', instance.shared_with_user_id] = operation
+
+        for user_id, budget_event in _budget_breaches(session, spent):
+            events[user_id].append(budget_event)
+
+    if changes:
+        Change.record(session, changes, events)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('flushed_changes', None)
@@ -0,0 +1,9 @@
+# wsgi serving entry point: the application with its background jobs workers and notifications listener
+#
+#   gunicorn --workers 4 wsgi:created_app
+from app import created_app, start_workers
+
+start_workers()
+
+if __name__ == '__main__':
+    created_app.run()